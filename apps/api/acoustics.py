@@ -0,0 +1,206 @@
+import io
+import wave
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from apps.api.settings import env_float, env_int
+from consensus_board.schemas.contracts import Claim, EvidenceRef, QualityFlag
+
+# -----------------------------
+# WINDOWED ACOUSTIC ANALYSIS
+# -----------------------------
+# HeAR embeds 2-second clips at 16 kHz. Instead of shipping a whole auscultation
+# recording in one all-or-nothing request, the bridge decodes the WAV, downmixes and
+# resamples it to 16 kHz, and cuts it into overlapping windows. Silent windows (RMS
+# below a dBFS floor) are never sent. Each remaining window is a small 16-bit WAV
+# classified on its own; the results are merged into per-segment claims (with
+# audio_segment evidence) and a confidence-weighted overall classification.
+
+HEAR_SAMPLE_RATE = 16000
+AUDIO_WINDOW_S = env_float("AUDIO_WINDOW_S", 2.0)
+AUDIO_HOP_S = env_float("AUDIO_HOP_S", 1.0)
+AUDIO_SILENCE_DBFS = env_float("AUDIO_SILENCE_DBFS", -50.0)
+AUDIO_MAX_WINDOWS = env_int("AUDIO_MAX_WINDOWS", 120)
+
+_FIR_TAPS = 101
+
+
+def windowing_settings() -> str:
+    """Part of the acoustic cache key: changing the windowing changes the result."""
+    return f"{HEAR_SAMPLE_RATE}Hz/{AUDIO_WINDOW_S}s/{AUDIO_HOP_S}s/{AUDIO_SILENCE_DBFS}dB/{AUDIO_MAX_WINDOWS}"
+
+
+@dataclass
+class AudioWindow:
+    index: int
+    start_s: float
+    end_s: float
+    rms_dbfs: float
+    wav: bytes
+
+
+def _read_pcm(path: str) -> Tuple[np.ndarray, int]:
+    """Mono float32 samples in [-1, 1] and the sample rate of a PCM WAV (raises wave.Error otherwise)."""
+    with wave.open(path, "rb") as wav:
+        channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+        raw = wav.readframes(wav.getnframes())
+
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        samples = np.where(ints >= 1 << 23, ints - (1 << 24), ints).astype(np.float32) / float(1 << 23)
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / float(1 << 31)
+    else:
+        raise wave.Error(f"Unsupported sample width: {width} bytes")
+
+    if channels > 1:
+        samples = samples[: len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return samples, rate
+
+
+def _resample(samples: np.ndarray, rate: int, target: int) -> np.ndarray:
+    """Band-limited resampling: windowed-sinc low-pass (when downsampling) then linear interpolation."""
+    if rate == target or len(samples) == 0:
+        return samples
+    if target < rate:
+        cutoff = 0.5 * target / rate
+        n = np.arange(_FIR_TAPS) - (_FIR_TAPS - 1) / 2
+        taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(_FIR_TAPS)
+        samples = np.convolve(samples, taps / taps.sum(), mode="same")
+    duration = len(samples) / rate
+    positions = np.arange(int(duration * target)) * (rate / target)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def _encode_wav(samples: np.ndarray) -> bytes:
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(HEAR_SAMPLE_RATE)
+        wav.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+def split_recording(path: str) -> Tuple[List[AudioWindow], Dict[str, Any]]:
+    """
+    Decodes a WAV into 16 kHz overlapping windows, dropping silent ones.
+    Returns (windows to classify, stats). Blocking: run it in a worker thread.
+    """
+    samples, rate = _read_pcm(path)
+    samples = _resample(samples, rate, HEAR_SAMPLE_RATE)
+
+    window = int(AUDIO_WINDOW_S * HEAR_SAMPLE_RATE)
+    hop = max(1, int(AUDIO_HOP_S * HEAR_SAMPLE_RATE))
+    if len(samples) < window:
+        samples = np.pad(samples, (0, window - len(samples)))
+
+    starts = list(range(0, len(samples) - window + 1, hop))
+    # Keep the tail when it holds more than half a hop of unseen audio
+    if starts and len(samples) - (starts[-1] + window) > hop // 2:
+        starts.append(len(samples) - window)
+
+    windows: List[AudioWindow] = []
+    silent = truncated = 0
+    for start in starts:
+        clip = samples[start:start + window]
+        rms = float(np.sqrt(np.mean(np.square(clip, dtype=np.float64))))
+        dbfs = 20 * np.log10(rms) if rms > 0 else -120.0
+        if dbfs < AUDIO_SILENCE_DBFS:
+            silent += 1
+            continue
+        if len(windows) >= AUDIO_MAX_WINDOWS:
+            truncated += 1
+            continue
+        windows.append(AudioWindow(
+            index=len(windows),
+            start_s=round(start / HEAR_SAMPLE_RATE, 2),
+            end_s=round((start + window) / HEAR_SAMPLE_RATE, 2),
+            rms_dbfs=round(dbfs, 1),
+            wav=_encode_wav(clip),
+        ))
+
+    stats = {
+        "source_rate": rate,
+        "duration_s": round(len(samples) / HEAR_SAMPLE_RATE, 2),
+        "windows_total": len(starts),
+        "windows_silent": silent,
+        "windows_truncated": truncated,
+    }
+    return windows, stats
+
+
+def _clamp(confidence: Any) -> float:
+    # Ensures confidence is always within [0.0, 1.0] for Pydantic validation
+    try:
+        return max(0.0, min(1.0, float(confidence)))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def aggregate_windows(
+    results: List[Tuple[AudioWindow, Optional[Dict[str, Any]]]],
+    stats: Dict[str, Any],
+) -> Tuple[List[Claim], List[QualityFlag]]:
+    """
+    Overall classification (confidence-weighted vote over classified windows) first,
+    then one segment claim per run of consecutive windows with the same prediction.
+    """
+    classified = [(w, r) for w, r in results if r is not None]
+    failed = len(results) - len(classified)
+    flags: List[QualityFlag] = []
+    if failed:
+        flags.append(QualityFlag(type="partial_analysis", severity="medium", detail=f"{failed}/{len(results)} windows failed"))
+    if stats["windows_truncated"]:
+        flags.append(QualityFlag(type="truncated_recording", severity="low", detail=f"{stats['windows_truncated']} windows beyond the limit were skipped"))
+
+    overview = [
+        EvidenceRef(type="metric", id="duration_s", value=stats["duration_s"]),
+        EvidenceRef(type="metric", id="windows_analysed", value=len(classified)),
+        EvidenceRef(type="metric", id="windows_silent", value=stats["windows_silent"]),
+    ]
+
+    if not classified:
+        flags.append(QualityFlag(type="no_signal", severity="high", detail="No audible window to classify"))
+        return [Claim(label="classification", value="no audible signal", confidence=0.0, evidence=overview)], flags
+
+    votes: Dict[str, float] = {}
+    for _, result in classified:
+        label = str(result.get("prediction", "unknown"))
+        votes[label] = votes.get(label, 0.0) + _clamp(result.get("confidence", 0.0))
+    overall = max(votes, key=votes.get)
+    claims = [Claim(label="classification", value=overall, confidence=_clamp(votes[overall] / len(classified)), evidence=overview)]
+
+    # Merge overlapping windows that agree into one segment
+    segment: List[Tuple[AudioWindow, Dict[str, Any]]] = []
+    for window, result in classified + [(None, None)]:
+        label = str(result.get("prediction", "unknown")) if result else None
+        if segment and (
+            window is None
+            or label != str(segment[-1][1].get("prediction", "unknown"))
+            or window.start_s - segment[-1][0].start_s > AUDIO_HOP_S + 1e-6  # a silent window lies between
+        ):
+            first, last = segment[0][0], segment[-1][0]
+            confidences = [_clamp(r.get("confidence", 0.0)) for _, r in segment]
+            claims.append(Claim(
+                label="segment_classification",
+                value=str(segment[0][1].get("prediction", "unknown")),
+                confidence=sum(confidences) / len(confidences),
+                evidence=[EvidenceRef(
+                    type="audio_segment",
+                    id=f"{first.start_s:.2f}-{last.end_s:.2f}s",
+                    value={"start_s": first.start_s, "end_s": last.end_s, "windows": len(segment)},
+                )],
+            ))
+            segment = []
+        if window is not None:
+            segment.append((window, result))
+    return claims, flags
@@ -0,0 +1,123 @@
+import os
+import asyncio
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Set
+
+import httpx
+
+from apps.api.settings import env_bool, env_int
+from apps.api.metrics import ARTIFACT_BYTES, ARTIFACT_TRANSFERS
+
+# -----------------------------
+# ARTIFACT TRANSFER PROTOCOL
+# -----------------------------
+# Each case artifact crosses the ngrok tunnel at most once. Agent calls then refer to
+# it by content ID (its SHA-256) instead of re-sending the multipart file.
+#
+#   HEAD {API_URL}/artifacts/{sha256}  -> 200 if the backend already holds the bytes, 404 if not
+#   PUT  {API_URL}/artifacts/{sha256}  -> raw bytes; backend verifies the hash (201 / 200)
+#   POST {API_URL}/agent/...           -> form field '<field>_sha256' instead of the '<field>' file
+#
+# Backends without the protocol (PUT answers 404/405) are detected once and get
+# plain multipart uploads, as do agent calls whose reference the backend no longer
+# knows (e.g. after a Colab restart).
+
+ARTIFACT_PROTOCOL = env_bool("ARTIFACT_PROTOCOL", True)
+ARTIFACT_CHUNK_BYTES = env_int("ARTIFACT_CHUNK_KB", 1024) * 1024
+
+# Agent responses meaning "unknown content ID" (422: backend still requires the multipart file)
+ARTIFACT_MISSING_STATUSES = {404, 409, 410, 422}
+_UNSUPPORTED_STATUSES = {404, 405, 501}
+
+
+async def _file_chunks(path: str) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = await asyncio.to_thread(f.read, ARTIFACT_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+class ArtifactTransfer:
+    """
+    Tracks which artifacts each GPU backend already holds and pushes missing ones once.
+    Concurrent pushes of the same artifact (vision + consensus, coalesced cases) share one upload.
+    """
+
+    def __init__(self, enabled: bool = ARTIFACT_PROTOCOL):
+        self.enabled = enabled
+        self._held: Dict[str, Set[str]] = {}
+        self._pushes: Dict[tuple, asyncio.Task] = {}
+        self._unsupported: Set[str] = set()
+
+    async def ensure(self, client: httpx.AsyncClient, base_url: str, path: str, digest: str, content_type: str) -> Optional[str]:
+        """Content ID to send instead of the file, or None when the caller must fall back to multipart."""
+        if not self.enabled or not base_url or base_url in self._unsupported:
+            return None
+        if digest in self._held.get(base_url, ()):
+            return digest
+
+        push_key = (base_url, digest)
+        task = self._pushes.get(push_key)
+        if task is None:
+            task = asyncio.create_task(self._push(client, base_url, path, digest, content_type))
+            self._pushes[push_key] = task
+            task.add_done_callback(lambda _: self._pushes.pop(push_key, None))
+        # shield: one cancelled agent call must not abort an upload another call is waiting on
+        return await asyncio.shield(task)
+
+    async def _push(self, client: httpx.AsyncClient, base_url: str, path: str, digest: str, content_type: str) -> Optional[str]:
+        url = f"{base_url}/artifacts/{digest}"
+        try:
+            head = await client.head(url)
+            if head.status_code == 200:
+                ARTIFACT_TRANSFERS.inc(result="already_held")
+                print(f"  [📎 ARTIFACT] Backend already holds {digest[:12]}: skipping upload")
+                self._held.setdefault(base_url, set()).add(digest)
+                return digest
+
+            size = os.path.getsize(path)
+            response = await client.put(
+                url,
+                content=_file_chunks(path),
+                headers={"Content-Type": content_type, "Content-Length": str(size)},
+            )
+            if response.status_code in _UNSUPPORTED_STATUSES:
+                print(f"  [📎 ARTIFACT] {base_url} has no artifact store: using multipart uploads")
+                self._unsupported.add(base_url)
+                ARTIFACT_TRANSFERS.inc(result="unsupported")
+                return None
+            response.raise_for_status()
+        except Exception as e:
+            print(f"  [⚠️ ARTIFACT] Push of {digest[:12]} failed ({e!r}): falling back to multipart")
+            ARTIFACT_TRANSFERS.inc(result="failed")
+            return None
+
+        ARTIFACT_TRANSFERS.inc(result="pushed")
+        ARTIFACT_BYTES.inc(size)
+        print(f"  [📤 ARTIFACT] Pushed {digest[:12]} to the GPU backend")
+        self._held.setdefault(base_url, set()).add(digest)
+        return digest
+
+    def forget(self, base_url: str, digest: str) -> None:
+        """The backend lost the artifact: the next ensure() pushes it again."""
+        self._held.get(base_url, set()).discard(digest)
+
+
+@contextmanager
+def artifact_part(field: str, filename: str, path: str, content_type: str, ref: Optional[str], data: Dict[str, Any]) -> Iterator[Optional[Dict[str, Any]]]:
+    """
+    Request parts for one artifact: adds '<field>_sha256' to the form data and yields no
+    files when the backend holds the artifact, otherwise yields the open multipart file.
+    """
+    if ref:
+        data[f"{field}_sha256"] = ref
+        try:
+            yield None
+        finally:
+            data.pop(f"{field}_sha256", None)
+        return
+
+    with open(path, "rb") as f:
+        yield {field: (filename, f, content_type)}
@@ -0,0 +1,231 @@
+import time
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, FrozenSet, Iterable, List, Optional, Set
+
+import httpx
+
+from apps.api.settings import env_float, env_int, env_str
+from apps.api.metrics import BACKEND_EJECTIONS, BACKEND_ROUTED, CIRCUIT_REJECTIONS
+from apps.api.resilience import CircuitBreaker, CircuitOpenError, StreamStalled
+
+# -----------------------------
+# GPU BACKEND POOL
+# -----------------------------
+# One Colab instance is the throughput ceiling, so the bridge can spread agent calls
+# over several. API_URLS lists the backends, each optionally restricted to some agent
+# endpoints:
+#
+#   API_URLS=https://gpu-a.ngrok.app,https://gpu-b.ngrok.app|vision+consensus,http://hear:8001|audio
+#
+# Every call goes to the capable backend with the fewest outstanding (queued + running)
+# requests. Calls for a case stick to a backend that already served it, so its
+# artifacts are pushed once and stay warm there, unless that backend is
+# BACKEND_STICKY_SLACK requests busier than the idlest one: then the case spills over
+# (one extra artifact push) and both backends count as its own. Each backend has its
+# own GPU / HeAR slots (LIMIT_CLOUD_GPU / LIMIT_HEAR), so capacity grows with the pool.
+# Backends that keep failing are ejected for a while; a periodic probe re-admits them early.
+# Each endpoint of each backend also has a circuit breaker (see resilience.py): when it
+# is open everywhere, calls fail fast instead of queueing on a dead tunnel.
+# Without API_URLS the pool is the single API_URL backend, as before.
+
+BACKEND_AGENTS = ("vision", "audio", "consensus")
+
+BACKEND_HEALTH_PATH = env_str("BACKEND_HEALTH_PATH", "/")
+BACKEND_HEALTH_INTERVAL_S = env_float("BACKEND_HEALTH_INTERVAL_S", 15.0)
+BACKEND_EJECT_AFTER = env_int("BACKEND_EJECT_AFTER", 3)
+BACKEND_EJECT_S = env_float("BACKEND_EJECT_S", 30.0)
+BACKEND_AFFINITY_CASES = env_int("BACKEND_AFFINITY_CASES", 1024)
+BACKEND_STICKY_SLACK = env_int("BACKEND_STICKY_SLACK", 2)
+
+
+class Backend:
+    """One GPU backend: what it serves, its own upstream slots and its health."""
+
+    def __init__(self, url: str, agents: Iterable[str] = BACKEND_AGENTS, gpu_slots: int = 2, hear_slots: int = 4):
+        self.url = url.rstrip("/")
+        self.agents: FrozenSet[str] = frozenset(agents)
+        # Vision + Consensus share the GPU; HeAR has its own capacity
+        self.gpu = asyncio.Semaphore(gpu_slots)
+        self.hear = asyncio.Semaphore(hear_slots)
+        self.outstanding = 0
+        self.routed = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.breakers = {agent: CircuitBreaker(f"{self.url}/agent/{agent}") for agent in self.agents}
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    def slot(self, agent: str) -> asyncio.Semaphore:
+        return self.hear if agent == "audio" else self.gpu
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "agents": sorted(self.agents),
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "routed": self.routed,
+            "failures": self.failures,
+            "ejected_for_s": round(max(0.0, self.ejected_until - time.monotonic()), 1),
+            "breakers": {agent: breaker.state for agent, breaker in sorted(self.breakers.items())},
+        }
+
+
+def parse_backend_urls(spec: str) -> List[tuple]:
+    """'url[|agent+agent],...' -> [(url, agents)]; a backend without a list serves every agent."""
+    entries = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        url, _, agents = entry.partition("|")
+        names = [a.strip() for a in agents.split("+") if a.strip()] or list(BACKEND_AGENTS)
+        unknown = set(names) - set(BACKEND_AGENTS)
+        if unknown:
+            raise ValueError(f"Unknown agent(s) {sorted(unknown)} for backend {url} (expected {'/'.join(BACKEND_AGENTS)})")
+        entries.append((url.strip(), names))
+    return entries
+
+
+class BackendPool:
+    """Least-outstanding routing with per-case affinity and passive + active health checks."""
+
+    def __init__(self, backends: List[Backend]):
+        self.backends = backends
+        self._affinity: "OrderedDict[str, List[Backend]]" = OrderedDict()
+        self._health_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, api_url: Optional[str], gpu_slots: int, hear_slots: int) -> "BackendPool":
+        spec = env_str("API_URLS", api_url or "")
+        return cls([Backend(url, agents, gpu_slots, hear_slots) for url, agents in parse_backend_urls(spec)])
+
+    def __bool__(self) -> bool:
+        return bool(self.backends)
+
+    def _candidates(self, agent: str, avoid: Optional[Set[str]] = None) -> List[Backend]:
+        capable = [b for b in self.backends if agent in b.agents]
+        if not capable:
+            raise ValueError(f"No backend in API_URLS serves /agent/{agent}")
+        allowed = [b for b in capable if b.breakers[agent].available()]
+        if not allowed:
+            CIRCUIT_REJECTIONS.inc(agent=agent)
+            retry_after = min(b.breakers[agent].retry_after() for b in capable)
+            raise CircuitOpenError(f"/agent/{agent} is failing on every backend (circuit open, retry in {retry_after:.0f}s)")
+        # Fail open: with every capable backend ejected, try the one due back first
+        healthy = [b for b in allowed if b.healthy] or [min(allowed, key=lambda b: b.ejected_until)]
+        return ([b for b in healthy if b.url not in avoid] or healthy) if avoid else healthy
+
+    def has_alternative(self, agent: str, avoid: Set[str]) -> bool:
+        """Whether a usable backend other than those in `avoid` could take a call (for hedging)."""
+        try:
+            return any(b.url not in avoid for b in self._candidates(agent, avoid))
+        except (ValueError, CircuitOpenError):
+            return False
+
+    def choose(self, agent: str, case_id: Optional[str] = None, avoid: Optional[Set[str]] = None) -> Backend:
+        """
+        The backend for the next call of `agent`; case_id=None means no affinity (e.g.
+        HeAR windows). Backends in `avoid` are only used when nothing else is left.
+        """
+        healthy = self._candidates(agent, avoid)
+
+        # Ties go to the backend routed least overall, so an idle pool round-robins
+        backend = min(healthy, key=lambda b: (b.outstanding, b.routed))
+        if case_id is not None:
+            owned = [b for b in self._affinity.get(case_id, ()) if b in healthy]
+            if owned:
+                sticky = min(owned, key=lambda b: (b.outstanding, b.routed))
+                if sticky.outstanding - backend.outstanding < BACKEND_STICKY_SLACK:
+                    self._affinity.move_to_end(case_id)
+                    return sticky
+
+            if backend not in self._affinity.setdefault(case_id, []):
+                self._affinity[case_id].append(backend)
+            self._affinity.move_to_end(case_id)
+            while len(self._affinity) > BACKEND_AFFINITY_CASES:
+                self._affinity.popitem(last=False)
+        return backend
+
+    @asynccontextmanager
+    async def lease(self, agent: str, case_id: Optional[str] = None, avoid: Optional[Set[str]] = None) -> AsyncIterator[Backend]:
+        """
+        Routes one agent call and holds the chosen backend's slot for its duration.
+        Transport errors and stalled streams count against the backend's health and
+        the endpoint's breaker; cancellation does not. The chosen URL is added to `avoid`.
+        """
+        backend = self.choose(agent, case_id, avoid)
+        if avoid is not None:
+            avoid.add(backend.url)
+        breaker = backend.breakers[agent]
+        # Taken before any await, so a half-open breaker lets exactly one trial through
+        breaker.begin()
+        backend.outstanding += 1
+        backend.routed += 1
+        BACKEND_ROUTED.inc(backend=backend.url, agent=agent)
+        try:
+            async with backend.slot(agent):
+                yield backend
+        except (httpx.TransportError, StreamStalled):
+            breaker.failure()
+            self.record_failure(backend)
+            raise
+        finally:
+            breaker.end()
+            backend.outstanding -= 1
+
+    def check(self, backend: Backend, agent: str, response: httpx.Response) -> None:
+        """Passive health: a 5xx counts as a failure, anything else as proof of life."""
+        if response.status_code >= 500:
+            backend.breakers[agent].failure()
+            self.record_failure(backend)
+        else:
+            backend.breakers[agent].success()
+            backend.failures = 0
+
+    def record_failure(self, backend: Backend) -> None:
+        backend.failures += 1
+        if backend.failures >= BACKEND_EJECT_AFTER and backend.healthy:
+            backend.ejected_until = time.monotonic() + BACKEND_EJECT_S
+            BACKEND_EJECTIONS.inc(backend=backend.url)
+            print(f"  [🚫 BACKEND] Ejecting {backend.url} for {BACKEND_EJECT_S:.0f}s after {backend.failures} failures")
+
+    # --- Active health checks ---------------------------------------------
+
+    def start_health_checks(self, client: httpx.AsyncClient, interval_s: float = BACKEND_HEALTH_INTERVAL_S) -> None:
+        if interval_s > 0 and self.backends:
+            self._health_task = asyncio.create_task(self._health_loop(client, interval_s))
+
+    async def stop_health_checks(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+
+    async def _health_loop(self, client: httpx.AsyncClient, interval_s: float) -> None:
+        while True:
+            await asyncio.sleep(interval_s)
+            await asyncio.gather(*(self.probe(client, backend) for backend in self.backends))
+
+    async def probe(self, client: httpx.AsyncClient, backend: Backend) -> bool:
+        """Any HTTP answer below 500 means the tunnel and server are up (Colab has no health route)."""
+        try:
+            response = await client.get(f"{backend.url}{BACKEND_HEALTH_PATH}", timeout=5.0)
+            alive = response.status_code < 500
+        except httpx.HTTPError:
+            alive = False
+
+        if not alive:
+            self.record_failure(backend)
+        elif not backend.healthy or backend.failures:
+            if not backend.healthy:
+                print(f"  [✅ BACKEND] {backend.url} is answering again: re-admitting it")
+            backend.failures = 0
+            backend.ejected_until = 0.0
+        return alive
+
+    def info(self) -> List[Dict[str, Any]]:
+        return [backend.info() for backend in self.backends]
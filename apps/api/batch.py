@@ -0,0 +1,120 @@
+import json
+import time
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+from pydantic import ValidationError
+
+from consensus_board.schemas.contracts import CaseInput
+from apps.api.settings import env_int
+
+# -----------------------------
+# BATCH CASE SCHEDULER
+# -----------------------------
+# Overnight retrospective reviews push thousands of cases through the same
+# pipeline as /run. A fixed pool of case workers keeps the number of cases in
+# flight bounded, while the per-upstream ConcurrencyLimits decide how many of
+# them actually hit the GPU / HeAR / Ollama at once. Results are emitted in
+# completion order, not submission order.
+
+BATCH_MAX_CASES = env_int("BATCH_MAX_CASES", 8)
+
+
+def parse_case_records(body: bytes, content_type: str = "") -> Tuple[List[CaseInput], List[Dict[str, Any]]]:
+    """
+    Accepts a JSON list of CaseInput records, {"cases": [...]}, or JSONL (one record per line).
+    Returns (valid cases, per-record errors) so one bad line never sinks the whole batch.
+    """
+    text = body.decode("utf-8").strip()
+    records: List[Tuple[int, Any]] = []
+    errors: List[Dict[str, Any]] = []
+
+    payload: Any = None
+    if "ndjson" not in content_type and "jsonl" not in content_type:
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            payload = None  # Not a single JSON document: treat as JSONL
+
+    if isinstance(payload, list):
+        records = list(enumerate(payload, start=1))
+    elif isinstance(payload, dict):
+        records = list(enumerate(payload.get("cases", [payload]), start=1))
+    else:
+        for line_no, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                records.append((line_no, json.loads(line)))
+            except ValueError as e:
+                errors.append({"type": "case_result", "status": "invalid", "line": line_no, "error": str(e)})
+
+    cases: List[CaseInput] = []
+    for line_no, record in records:
+        try:
+            cases.append(CaseInput(**record))
+        except (ValidationError, TypeError) as e:
+            errors.append({"type": "case_result", "status": "invalid", "line": line_no, "error": str(e)})
+    return cases, errors
+
+
+async def run_batch(
+    cases: List[CaseInput],
+    run_one: Callable[[CaseInput], Awaitable[Dict[str, Any]]],
+    max_cases: int = BATCH_MAX_CASES,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Runs cases with at most max_cases in flight and yields one record per case as it
+    completes, then a final 'batch_summary' record with aggregate throughput.
+    """
+    started = time.perf_counter()
+    pending: asyncio.Queue = asyncio.Queue()
+    done: asyncio.Queue = asyncio.Queue()
+    for case in cases:
+        pending.put_nowait(case)
+
+    async def worker():
+        while True:
+            try:
+                case = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            case_started = time.perf_counter()
+            try:
+                record = await run_one(case)
+            except Exception as e:
+                record = {"status": "error", "error": repr(e)}
+            record = {"type": "case_result", "case_id": case.case_id, **record}
+            record["elapsed_s"] = round(time.perf_counter() - case_started, 3)
+            await done.put(record)
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, min(max_cases, len(cases))))]
+    succeeded = failed = 0
+    case_seconds = 0.0
+
+    try:
+        for _ in range(len(cases)):
+            record = await done.get()
+            if record.get("status") == "ok":
+                succeeded += 1
+            else:
+                failed += 1
+            case_seconds += record["elapsed_s"]
+            yield record
+    finally:
+        for task in workers:
+            if not task.done():
+                task.cancel()
+
+    elapsed = time.perf_counter() - started
+    yield {
+        "type": "batch_summary",
+        "cases": len(cases),
+        "succeeded": succeeded,
+        "failed": failed,
+        "elapsed_s": round(elapsed, 3),
+        "cases_per_minute": round(len(cases) / elapsed * 60, 2) if elapsed > 0 else 0.0,
+        "mean_case_s": round(case_seconds / len(cases), 3) if cases else 0.0,
+        "max_cases_in_flight": max_cases,
+    }
@@ -0,0 +1,109 @@
+import math
+import re
+from dataclasses import dataclass
+from typing import List, Sequence
+
+from consensus_board.schemas.contracts import Claim
+from apps.api.settings import env_float, env_int
+from apps.api.notes import normalize_finding
+
+# -----------------------------
+# CONSENSUS PROMPT BUDGET
+# -----------------------------
+# The adjudicator prompt used to grow with the note: every history claim was joined
+# into history_text and the imaging summary was passed verbatim, so long discharge
+# summaries meant long consensus prefill. Each agent's evidence now gets a token
+# budget. History claims are ranked by category ([ACTIVE] > [RISK] > [NEGATION] >
+# [BASELINE]), then by confidence, and are added in that order while they fit. The
+# adjudicator is told how many were left out. Free-text summaries are cut at the last
+# sentence that fits. Tokens are estimated from the character count (~4 characters
+# per token for English clinical text). This is a cheap estimate, not a tokenizer
+# pass, and it is tunable with PROMPT_CHARS_PER_TOKEN. A budget of 0 disables that
+# agent's limit.
+
+PROMPT_CHARS_PER_TOKEN = env_float("PROMPT_CHARS_PER_TOKEN", 4.0)
+PROMPT_BUDGET_HISTORY_TOKENS = env_int("PROMPT_BUDGET_HISTORY_TOKENS", 400)
+PROMPT_BUDGET_IMAGING_TOKENS = env_int("PROMPT_BUDGET_IMAGING_TOKENS", 400)
+PROMPT_BUDGET_PRIOR_TOKENS = env_int("PROMPT_BUDGET_PRIOR_TOKENS", 150)
+PROMPT_BUDGET_AUDIO_TOKENS = env_int("PROMPT_BUDGET_AUDIO_TOKENS", 100)
+
+# Lower ranks first; claims without a known category (status / error claims) go last
+CATEGORY_RANK = {"ACTIVE": 0, "RISK": 1, "NEGATION": 2, "BASELINE": 3}
+_UNRANKED = len(CATEGORY_RANK)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+CLAIM_SEPARATOR = ", "
+TRUNCATION_MARK = " [...]"
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / PROMPT_CHARS_PER_TOKEN) if text else 0
+
+
+@dataclass
+class Budgeted:
+    text: str
+    tokens: int
+    # Estimated tokens of the input before budgeting
+    original_tokens: int
+    # Claims (or sentences) that did not fit
+    dropped: int = 0
+
+
+def claim_rank(claim: Claim) -> int:
+    normalized = normalize_finding(claim.value)
+    return CATEGORY_RANK.get(normalized[0], _UNRANKED) if normalized else _UNRANKED
+
+
+def rank_claims(claims: Sequence[Claim]) -> List[Claim]:
+    """Category first, then confidence; ties keep their extraction order (sort is stable)."""
+    return sorted(claims, key=lambda claim: (claim_rank(claim), -claim.confidence))
+
+
+def fit_claims(claims: Sequence[Claim], budget: int) -> Budgeted:
+    """The highest-ranked claim values that fit the budget, joined, plus an omission note."""
+    ranked = rank_claims(claims)
+    values = [claim.value for claim in ranked]
+    full = CLAIM_SEPARATOR.join(values)
+    original = estimate_tokens(full)
+    if budget <= 0 or original <= budget:
+        return Budgeted(full, original, original)
+
+    # Room is kept for the note about what is left out of the list
+    limit = budget * PROMPT_CHARS_PER_TOKEN - len(f"; {len(values)} lower-priority findings omitted")
+    kept: List[str] = []
+    used = 0
+    for value in values:
+        # A long claim that doesn't fit doesn't stop shorter, lower-ranked ones
+        cost = len(value) + (len(CLAIM_SEPARATOR) if kept else 0)
+        if used + cost <= limit:
+            kept.append(value)
+            used += cost
+    dropped = len(values) - len(kept)
+    text = CLAIM_SEPARATOR.join(kept)
+    if dropped:
+        text = f"{text}; {dropped} lower-priority findings omitted" if kept else f"{dropped} findings omitted (over budget)"
+    return Budgeted(text, estimate_tokens(text), original, dropped)
+
+
+def fit_text(text: str, budget: int) -> Budgeted:
+    """The leading sentences of `text` that fit the budget (hard-cut when the first one alone doesn't)."""
+    original = estimate_tokens(text)
+    if budget <= 0 or original <= budget:
+        return Budgeted(text, original, original)
+
+    limit = int(budget * PROMPT_CHARS_PER_TOKEN) - len(TRUNCATION_MARK)
+    sentences = [s for s in _SENTENCE_END.split(text.strip()) if s]
+    kept = ""
+    count = 0
+    for sentence in sentences:
+        candidate = f"{kept} {sentence}" if kept else sentence
+        if len(candidate) > limit:
+            break
+        kept = candidate
+        count += 1
+    if not kept:
+        cut = text.rfind(" ", 0, max(0, limit))
+        kept = text[:cut if cut > 0 else max(0, limit)].rstrip()
+    kept += TRUNCATION_MARK
+    return Budgeted(kept, estimate_tokens(kept), original, len(sentences) - count)
@@ -0,0 +1,374 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from apps.api.settings import env_bool, env_float, env_int, env_str
+from apps.api.metrics import CACHE_LOOKUPS
+
+# -----------------------------
+# CONTENT-ADDRESSED RESULT CACHE
+# -----------------------------
+# Agent results are keyed by a SHA-256 over the artifact bytes, the prompt inputs
+# and the model name, so re-running a case with identical inputs never goes back
+# to the GPU. Two tiers:
+#   1. In-memory LRU (hot cases, zero IO)
+#   2. On-disk JSON under artifacts/cache/<aa>/<key>.json (survives restarts)
+# Entries expire after a TTL and the disk tier is trimmed oldest-first to a size cap.
+# The disk tier's size is tracked as a running total: a write only stats its own file,
+# and the directory is listed (and trimmed to CACHE_EVICT_TARGET of the cap) only once
+# the total goes over the cap. Expired entries are dropped when read or at that trim.
+#
+# Entries are content-addressed, so one entry can serve several cases (the same x-ray
+# or note uploaded twice). Every case that reads or writes an entry adds its tag to
+# it, and DELETE /cache/{case_id} drops every entry that case has used.
+
+_HASH_CHUNK = 1024 * 1024
+# Fraction of max_disk_bytes an over-budget disk tier is trimmed down to, so the
+# next writes don't each trigger another scan
+CACHE_EVICT_TARGET = env_float("CACHE_EVICT_TARGET", 0.9)
+
+
+def make_key(namespace: str, *parts: Any) -> str:
+    """Stable SHA-256 over a namespace and any mix of str / bytes / JSON-able parts."""
+    digest = hashlib.sha256(namespace.encode())
+    for part in parts:
+        if isinstance(part, bytes):
+            raw = part
+        elif isinstance(part, str):
+            raw = part.encode()
+        else:
+            raw = json.dumps(part, sort_keys=True, default=str).encode()
+        # Length-prefix each part so ("ab", "c") and ("a", "bc") never collide
+        digest.update(len(raw).to_bytes(8, "big"))
+        digest.update(raw)
+    return digest.hexdigest()
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_CHUNK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier (memory LRU + disk) cache for agent results.
+    Values must be JSON-serializable. Each entry carries tags (e.g. the case_id)
+    so a whole case can be invalidated without knowing its content keys.
+    """
+
+    def __init__(
+        self,
+        root: str = "artifacts/cache",
+        max_memory_entries: int = 256,
+        max_file_digests: int = 1024,
+        max_disk_bytes: int = 512 * 1024 * 1024,
+        ttl_seconds: float = 7 * 24 * 3600,
+        enabled: bool = True,
+    ):
+        self.root = root
+        self.max_memory_entries = max_memory_entries
+        self.max_file_digests = max_file_digests
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # (path, size, mtime) -> SHA-256, an LRU bounded like the memory tier
+        self._file_digests: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+        self._disk_lock = asyncio.Lock()
+        # Running size of the disk tier; None until the first write lists it
+        self._disk_bytes: Optional[int] = None
+
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        return cls(
+            root=env_str("CACHE_DIR", "artifacts/cache"),
+            max_memory_entries=env_int("CACHE_MAX_MEMORY_ENTRIES", 256),
+            max_file_digests=env_int("CACHE_MAX_FILE_DIGESTS", 1024),
+            max_disk_bytes=env_int("CACHE_MAX_DISK_MB", 512) * 1024 * 1024,
+            ttl_seconds=env_float("CACHE_TTL_SECONDS", 7 * 24 * 3600),
+            enabled=env_bool("CACHE_ENABLED", True),
+        )
+
+    # --- Keys -------------------------------------------------------------
+
+    async def file_digest(self, path: str) -> Optional[str]:
+        """SHA-256 of a file, memoized on (path, size, mtime) so unchanged artifacts are hashed once."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        digest = self._file_digests.get(memo_key)
+        if digest is None:
+            digest = await asyncio.to_thread(_sha256_file, path)
+        self._remember_digest(memo_key, digest)
+        return digest
+
+    def remember_file_digest(self, path: str, digest: str) -> None:
+        """Seeds the digest memo when the hash was computed elsewhere (e.g. during upload)."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        self._remember_digest((os.path.abspath(path), st.st_size, st.st_mtime_ns), digest)
+
+    def _remember_digest(self, memo_key: Tuple[str, int, int], digest: str) -> None:
+        self._file_digests[memo_key] = digest
+        self._file_digests.move_to_end(memo_key)
+        while len(self._file_digests) > self.max_file_digests:
+            self._file_digests.popitem(last=False)
+
+    # --- Tiers ------------------------------------------------------------
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry.get("created_at", 0) > self.ttl_seconds
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_disk(self, key: str, entry: Dict[str, Any]) -> int:
+        """Writes the entry; returns the change in the disk tier's size."""
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        written = os.stat(tmp_path).st_size
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        return written - replaced
+
+    def _disk_entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for shard in os.listdir(self.root):
+            shard_dir = os.path.join(self.root, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(shard_dir, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict_disk(self) -> int:
+        """
+        Drops expired entries, then the oldest ones until the tier fits CACHE_EVICT_TARGET
+        of max_disk_bytes. Returns the tier's size afterwards.
+        """
+        entries = sorted(self._disk_entries())
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_disk_bytes * CACHE_EVICT_TARGET)
+
+        for mtime, size, path in entries:
+            if now - mtime <= self.ttl_seconds and total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+    async def _store(self, key: str, entry: Dict[str, Any]) -> None:
+        async with self._disk_lock:
+            delta = await asyncio.to_thread(self._write_disk, key, entry)
+            if self._disk_bytes is None:
+                # First write since startup: one listing seeds the running total
+                self._disk_bytes = await asyncio.to_thread(self._evict_disk)
+            else:
+                self._disk_bytes += delta
+            if self._disk_bytes > self.max_disk_bytes:
+                # Other workers share the directory: resync from a listing while trimming
+                self._disk_bytes = await asyncio.to_thread(self._evict_disk)
+
+    # --- Public API -------------------------------------------------------
+
+    async def get(self, key: str, tags: Iterable[str] = ()) -> Optional[Any]:
+        """The cached value, or None; a hit also tags the entry with the reading case's tags."""
+        if not self.enabled:
+            return None
+
+        entry = self._memory.get(key)
+        if entry is None:
+            entry = await asyncio.to_thread(self._read_disk, key)
+
+        if entry is None or self._expired(entry):
+            if entry is not None:
+                await self.invalidate(key)
+            self.misses += 1
+            return None
+
+        missing = [tag for tag in tags if tag not in entry.get("tags", [])]
+        if missing:
+            # Rewritten once per new case, so invalidating that case finds the entry too
+            entry = {**entry, "tags": [*entry.get("tags", []), *missing]}
+            await self._store(key, entry)
+        self._remember(key, entry)
+        self.hits += 1
+        return entry["value"]
+
+    async def set(self, key: str, value: Any, tags: Iterable[str] = ()) -> None:
+        if not self.enabled:
+            return
+
+        # A refresh (use_cache=false) keeps the tags of cases that already used the entry
+        previous = self._memory.get(key)
+        merged = list(dict.fromkeys([*(previous.get("tags", []) if previous else []), *tags]))
+        entry = {"key": key, "created_at": time.time(), "tags": merged, "value": value}
+        self._remember(key, entry)
+        await self._store(key, entry)
+
+    async def invalidate(self, key: str) -> bool:
+        self._memory.pop(key, None)
+        path = self._disk_path(key)
+
+        def _remove() -> int:
+            size = os.stat(path).st_size
+            os.remove(path)
+            return size
+
+        try:
+            size = await asyncio.to_thread(_remove)
+        except FileNotFoundError:
+            return False
+        if self._disk_bytes is not None:
+            self._disk_bytes -= size
+        return True
+
+    async def invalidate_tag(self, tag: str) -> int:
+        """Removes every entry carrying the tag (e.g. all agent results for one case_id)."""
+        def _drop_tagged() -> List[str]:
+            dropped = []
+            for _, _, path in self._disk_entries():
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        entry = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    continue
+                if tag in entry.get("tags", []):
+                    os.remove(path)
+                    dropped.append(entry["key"])
+            return dropped
+
+        async with self._disk_lock:
+            dropped = set(await asyncio.to_thread(_drop_tagged))
+            # Recounted on the next write
+            self._disk_bytes = None
+        for key, entry in list(self._memory.items()):
+            if tag in entry.get("tags", []):
+                self._memory.pop(key, None)
+                dropped.add(key)
+        return len(dropped)
+
+    async def clear(self) -> int:
+        def _drop_all() -> int:
+            entries = self._disk_entries()
+            for _, _, path in entries:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            return len(entries)
+
+        self._memory.clear()
+        async with self._disk_lock:
+            self._disk_bytes = None
+            return await asyncio.to_thread(_drop_all)
+
+    # --- Agent wrappers ---------------------------------------------------
+
+    async def cached_call(
+        self,
+        key: Optional[str],
+        call: Callable[[], Awaitable[Any]],
+        encode: Callable[[Any], Any],
+        decode: Callable[[Any], Any],
+        agent: str = "",
+        tags: Iterable[str] = (),
+        bypass: bool = False,
+        cacheable: Callable[[Any], bool] = lambda _: True,
+    ) -> Any:
+        """
+        Request/response agents (HeAR, OpenBioLLM).
+        bypass=True skips the lookup but still refreshes the entry with the new result.
+        """
+        if key is not None and not bypass:
+            hit = await self.get(key, tags)
+            CACHE_LOOKUPS.inc(agent=agent, result="hit" if hit is not None else "miss")
+            if hit is not None:
+                return decode(hit)
+
+        result = await call()
+        if key is not None and cacheable(result):
+            await self.set(key, encode(result), tags)
+        return result
+
+    async def cached_stream(
+        self,
+        key: Optional[str],
+        stream: Callable[[], AsyncIterator[Any]],
+        agent: str = "",
+        tags: Iterable[str] = (),
+        bypass: bool = False,
+        cacheable: Callable[[List[Any]], bool] = lambda _: True,
+        encode: Callable[[Any], Any] = lambda chunk: chunk,
+        decode: Callable[[Any], Any] = lambda chunk: chunk,
+    ) -> AsyncIterator[Any]:
+        """
+        Streaming agents (Vision, Consensus).
+        A hit replays the recorded chunks in order, so the UI sees the same SSE events.
+        A miss records the live stream and stores it once it completes cleanly.
+        encode/decode convert each chunk to and from its JSON-storable form.
+        """
+        if key is not None and not bypass:
+            hit = await self.get(key, tags)
+            CACHE_LOOKUPS.inc(agent=agent, result="hit" if hit is not None else "miss")
+            if hit is not None:
+                for chunk in hit:
+                    yield decode(chunk)
+                return
+
+        recorded: List[Any] = []
+        async for chunk in stream():
+            recorded.append(chunk)
+            yield chunk
+
+        if key is not None and cacheable(recorded):
+            await self.set(key, [encode(chunk) for chunk in recorded], tags)
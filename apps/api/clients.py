@@ -0,0 +1,116 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import httpx
+import ollama
+
+from apps.api.settings import env_bool, env_float, env_int
+
+# -----------------------------
+# SHARED UPSTREAM CLIENTS
+# -----------------------------
+# One pooled, keep-alive client per upstream: the cloud GPU tunnel (Vision / HeAR /
+# Consensus) and the local Ollama daemon. Both are created once in the app lifespan
+# so every case reuses warm TCP+TLS connections instead of re-handshaking.
+
+
+def _http2_available() -> bool:
+    # httpx only speaks HTTP/2 when the optional 'h2' package is installed
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+@dataclass
+class ClientSettings:
+    """
+    Pool limits and per-phase timeouts for the upstream clients.
+    Every field can be overridden from .env (see from_env).
+    """
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 120.0
+
+    connect_timeout: float = 10.0
+    write_timeout: float = 60.0
+    pool_timeout: float = 30.0
+    read_timeout: float = 300.0      # Request/response calls (HeAR)
+    stream_timeout: float = 600.0    # Max silence between chunks on streamed calls (Vision / Consensus)
+
+    http2: bool = True
+    verify_tls: bool = False         # ngrok tunnels are reached with verification off
+
+    ollama_host: Optional[str] = None
+    ollama_read_timeout: float = 600.0
+
+    @classmethod
+    def from_env(cls) -> "ClientSettings":
+        return cls(
+            max_connections=env_int("BRIDGE_POOL_MAX_CONNECTIONS", cls.max_connections),
+            max_keepalive_connections=env_int("BRIDGE_POOL_MAX_KEEPALIVE", cls.max_keepalive_connections),
+            keepalive_expiry=env_float("BRIDGE_POOL_KEEPALIVE_EXPIRY", cls.keepalive_expiry),
+            connect_timeout=env_float("BRIDGE_CONNECT_TIMEOUT", cls.connect_timeout),
+            write_timeout=env_float("BRIDGE_WRITE_TIMEOUT", cls.write_timeout),
+            pool_timeout=env_float("BRIDGE_POOL_TIMEOUT", cls.pool_timeout),
+            read_timeout=env_float("BRIDGE_READ_TIMEOUT", cls.read_timeout),
+            stream_timeout=env_float("BRIDGE_STREAM_TIMEOUT", cls.stream_timeout),
+            http2=env_bool("BRIDGE_HTTP2", cls.http2),
+            verify_tls=env_bool("BRIDGE_VERIFY_TLS", cls.verify_tls),
+            ollama_host=os.getenv("OLLAMA_HOST") or None,
+            ollama_read_timeout=env_float("OLLAMA_READ_TIMEOUT", cls.ollama_read_timeout),
+        )
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def request_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.connect_timeout,
+            read=self.read_timeout,
+            write=self.write_timeout,
+            pool=self.pool_timeout,
+        )
+
+    def stream_request_timeout(self) -> httpx.Timeout:
+        """Timeout for SSE calls: 'read' bounds the gap between chunks, not the whole stream."""
+        return httpx.Timeout(
+            connect=self.connect_timeout,
+            read=self.stream_timeout,
+            write=self.write_timeout,
+            pool=self.pool_timeout,
+        )
+
+
+def build_cloud_client(settings: ClientSettings) -> httpx.AsyncClient:
+    """Pooled keep-alive client for the Colab GPU tunnel (HTTP/2 when available)."""
+    use_http2 = settings.http2 and _http2_available()
+    if settings.http2 and not use_http2:
+        print("  [⚠️  CLIENTS] BRIDGE_HTTP2 requested but 'h2' is not installed. Falling back to HTTP/1.1.")
+
+    return httpx.AsyncClient(
+        http2=use_http2,
+        verify=settings.verify_tls,
+        limits=settings.limits(),
+        timeout=settings.request_timeout(),
+    )
+
+
+def build_ollama_client(settings: ClientSettings) -> ollama.AsyncClient:
+    """Pooled keep-alive client for the local Ollama daemon."""
+    return ollama.AsyncClient(
+        host=settings.ollama_host,
+        limits=settings.limits(),
+        timeout=httpx.Timeout(
+            connect=settings.connect_timeout,
+            read=settings.ollama_read_timeout,
+            write=settings.write_timeout,
+            pool=settings.pool_timeout,
+        ),
+    )
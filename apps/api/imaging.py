@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional
+
+from apps.api.settings import env_bool, env_int
+from apps.api.metrics import PREPROCESS_BYTES, PREPROCESS_SECONDS
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional: without it agents receive the original upload
+    Image = None
+
+# -----------------------------
+# X-RAY PREPROCESSING
+# -----------------------------
+# Scans arrive as multi-megabyte, often 16-bit images; MedGemma resizes everything to
+# 896x896 anyway. Before dispatch the bridge decodes the upload in a worker process,
+# downsamples it so its short side matches the model input (the processor's own
+# resize still sees full detail), windows it to 8-bit grayscale and re-encodes it as
+# a compact JPEG. The derivative is cached next to the original (xray.jpg -> xray.model.jpg,
+# xray_prior.jpg -> xray_prior.model.jpg, plus a sidecar naming its source hash and
+# settings) and is what the agents send.
+
+PREPROCESS_XRAY = env_bool("PREPROCESS_XRAY", True)
+XRAY_MODEL_SIZE = env_int("XRAY_MODEL_SIZE", 896)
+XRAY_JPEG_QUALITY = env_int("XRAY_JPEG_QUALITY", 90)
+PREPROCESS_WORKERS = env_int("PREPROCESS_WORKERS", 2)
+
+DERIVATIVE_SUFFIX = ".model.jpg"
+
+
+def preprocess_settings() -> str:
+    """Part of every cache key that depends on what the model actually sees."""
+    if not PREPROCESS_XRAY or Image is None:
+        return "original"
+    return f"xray:{XRAY_MODEL_SIZE}px/q{XRAY_JPEG_QUALITY}/L8"
+
+
+def _to_8bit(img: "Image.Image") -> "Image.Image":
+    """Grayscale 8-bit, stretching 16-bit / float scans over their actual value range."""
+    if img.mode in ("I;16", "I;16B", "I;16L", "I", "F"):
+        img = img.convert("I") if img.mode != "F" else img
+        lo, hi = img.getextrema()
+        scale = 255.0 / (hi - lo) if hi > lo else 1.0
+        return img.point(lambda v: (v - lo) * scale).convert("L")
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        background = Image.new("RGBA", img.size, (0, 0, 0, 255))
+        img = Image.alpha_composite(background, img)
+    return img.convert("L")
+
+
+def _build_derivative(src_path: str, dst_path: str, size: int, quality: int) -> Dict[str, Any]:
+    """Runs in a worker process: decode, resize, normalize, re-encode. Returns derivative stats."""
+    started = time.perf_counter()
+    with Image.open(src_path) as img:
+        img = ImageOps.exif_transpose(img)
+        original_size = img.size
+        img = _to_8bit(img)
+
+        short_side = min(img.size)
+        if short_side > size:
+            scale = size / short_side
+            img = img.resize((round(img.width * scale), round(img.height * scale)), Image.LANCZOS)
+
+        # Unique per build: two builds of the same derivative must not share a temp file
+        tmp_path = f"{dst_path}.{uuid.uuid4().hex}.part"
+        img.save(tmp_path, "JPEG", quality=quality, optimize=True)
+
+    with open(tmp_path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    os.replace(tmp_path, dst_path)
+    return {
+        "sha256": digest,
+        "bytes": os.path.getsize(dst_path),
+        "original_size": list(original_size),
+        "size": list(img.size),
+        "worker_s": round(time.perf_counter() - started, 4),
+    }
+
+
+class XrayPreprocessor:
+    """
+    Process pool building model-ready x-ray derivatives.
+    Requests for the same source share one job; results are reused while the
+    sidecar matches the source hash and the current settings.
+    """
+
+    def __init__(self, workers: int = PREPROCESS_WORKERS, enabled: bool = PREPROCESS_XRAY):
+        self.enabled = enabled and Image is not None
+        self.executor = ProcessPoolExecutor(max_workers=workers) if self.enabled else None
+        self._jobs: Dict[str, asyncio.Task] = {}
+        if enabled and Image is None:
+            print("  [⚠️ PREPROCESS] Pillow not installed: agents will receive original x-rays")
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            # Join the workers: orphaned ones would keep the bridge's inherited listening socket open
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    async def model_input(self, src_path: str, src_digest: Optional[str]) -> Dict[str, Any]:
+        """
+        {"path", "sha256", ...} of the file agents should send for this x-ray:
+        the cached or freshly built derivative, or the original when preprocessing
+        is off or fails.
+        """
+        if not self.enabled or src_digest is None:
+            return {"path": src_path, "sha256": src_digest}
+
+        job_key = f"{src_path}:{src_digest}"
+        task = self._jobs.get(job_key)
+        if task is None:
+            task = asyncio.create_task(self._derivative(src_path, src_digest))
+            self._jobs[job_key] = task
+            task.add_done_callback(lambda _: self._jobs.pop(job_key, None))
+        return await asyncio.shield(task)
+
+    async def _derivative(self, src_path: str, src_digest: str) -> Dict[str, Any]:
+        dst_path = os.path.splitext(src_path)[0] + DERIVATIVE_SUFFIX
+        sidecar_path = f"{dst_path}.json"
+        settings = preprocess_settings()
+
+        cached = await asyncio.to_thread(_read_sidecar, sidecar_path)
+        if cached and cached.get("source_sha256") == src_digest and cached.get("settings") == settings and os.path.exists(dst_path):
+            return {"path": dst_path, **cached}
+
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                self.executor, _build_derivative, src_path, dst_path, XRAY_MODEL_SIZE, XRAY_JPEG_QUALITY
+            )
+        except Exception as e:
+            print(f"  [⚠️ PREPROCESS] Could not preprocess {src_path} ({e!r}): sending the original")
+            return {"path": src_path, "sha256": src_digest}
+
+        elapsed = time.perf_counter() - started
+        original_bytes = os.path.getsize(src_path)
+        PREPROCESS_SECONDS.observe(elapsed, artifact="xray")
+        PREPROCESS_BYTES.inc(original_bytes, kind="original")
+        PREPROCESS_BYTES.inc(result["bytes"], kind="derivative")
+        print(
+            f"  [🖼️ PREPROCESS] {src_path}: {original_bytes / 1e6:.1f} MB {result['original_size']} -> "
+            f"{result['bytes'] / 1e3:.0f} KB {result['size']} in {elapsed:.2f}s"
+        )
+
+        record = {"source_sha256": src_digest, "settings": settings, "source_bytes": original_bytes, **result}
+        await asyncio.to_thread(_write_sidecar, sidecar_path, record)
+        return {"path": dst_path, **record}
+
+
+def _read_sidecar(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_sidecar(path: str, record: Dict[str, Any]) -> None:
+    tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(record, f)
+    os.replace(tmp_path, path)
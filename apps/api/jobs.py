@@ -0,0 +1,315 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Union
+
+from apps.api.settings import env_float, env_int, env_str
+from apps.api.metrics import JOBS_TOTAL, JOB_STREAM_RESUMES
+
+# -----------------------------
+# BACKGROUND JOBS
+# -----------------------------
+# A job runs a case pipeline independently of any HTTP connection. Every frame it
+# emits is numbered and appended to an event log, kept in memory and flushed to
+# artifacts/jobs/{job_id}/events.jsonl in small batches off the event loop. A client
+# that drops can reconnect to /run/{job_id}/events with Last-Event-ID and resume
+# where it left off; the final payload is kept as result.json and served without
+# re-running anything. Logs of finished jobs survive evictions and restarts. A job
+# reloaded from disk is kept in memory like a recent one, so polling its status or
+# events doesn't re-read the whole log on every request. A background sweep deletes
+# the logs of jobs that finished more than JOB_TTL_HOURS ago.
+
+JOB_DIR = env_str("JOB_DIR", "artifacts/jobs")
+JOB_MEMORY_LIMIT = env_int("JOB_MEMORY_LIMIT", 200)
+JOB_FLUSH_S = env_int("JOB_FLUSH_MS", 250) / 1000.0
+JOB_TTL_S = env_float("JOB_TTL_HOURS", 72.0) * 3600
+JOB_SWEEP_INTERVAL_S = env_float("JOB_SWEEP_INTERVAL_S", 900.0)
+
+_JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+# Sentinel pushed to followers once the job has finished
+_JOB_DONE = object()
+
+
+class Job:
+    """One background case run and its numbered event log (event ids start at 1)."""
+
+    def __init__(self, job_id: str, case_id: str, key: str = "", status: str = "running"):
+        self.id = job_id
+        self.case_id = case_id
+        self.key = key
+        self.status = status
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.events: List[bytes] = []
+        self.outcome: Dict[str, Any] = {}
+        self.persisted = 0
+        self._followers: List[asyncio.Queue] = []
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status != "running"
+
+    def append(self, frame: Union[str, bytes]) -> None:
+        frame = frame.encode() if isinstance(frame, str) else frame
+        self.events.append(frame)
+        for queue in self._followers:
+            queue.put_nowait(len(self.events))
+
+    def finish(self, status: str, error: Optional[str] = None) -> None:
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+        for queue in self._followers:
+            queue.put_nowait(_JOB_DONE)
+
+    def frame(self, event_id: int) -> bytes:
+        """The stored frame with its SSE id line, so the browser tracks Last-Event-ID itself."""
+        return b"id: %d\n" % event_id + self.events[event_id - 1]
+
+    async def follow(self, last_event_id: int = 0) -> AsyncIterator[bytes]:
+        """Frames after last_event_id: the logged ones first, then live ones until the job ends."""
+        if last_event_id:
+            JOB_STREAM_RESUMES.inc()
+        queue: Optional[asyncio.Queue] = None
+        if not self.done:
+            queue = asyncio.Queue()
+            self._followers.append(queue)
+        sent = max(0, last_event_id)
+
+        try:
+            # Snapshot and registration happen without an await in between, so nothing is missed
+            for event_id in range(sent + 1, len(self.events) + 1):
+                yield self.frame(event_id)
+                sent = event_id
+            if queue is not None:
+                while True:
+                    item = await queue.get()
+                    if item is _JOB_DONE:
+                        break
+                    for event_id in range(sent + 1, item + 1):
+                        yield self.frame(event_id)
+                        sent = event_id
+        finally:
+            if queue is not None:
+                self._followers.remove(queue)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "case_id": self.case_id,
+            "status": self.status,
+            "error": self.error,
+            "events": len(self.events),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "has_result": bool(self.outcome),
+        }
+
+
+class JobStore:
+    """Running and recent jobs in memory; every job's log and result on disk."""
+
+    def __init__(self, root: str = JOB_DIR, memory_limit: int = JOB_MEMORY_LIMIT, ttl_s: float = JOB_TTL_S):
+        self.root = root
+        self.memory_limit = memory_limit
+        self.ttl_s = ttl_s
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._running: Dict[str, Job] = {}
+        # The periodic flush runs in a worker thread; the final one may run on the loop
+        self._flush_lock = threading.Lock()
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def _dir(self, job_id: str) -> str:
+        return os.path.join(self.root, job_id)
+
+    def running(self, key: str) -> Optional[Job]:
+        """The job already running for an identical case, if any."""
+        return self._running.get(key)
+
+    def start(self, case_id: str, key: str, frames: AsyncIterator[Any], outcome: Callable[[], Dict[str, Any]]) -> Job:
+        """Registers a job and consumes `frames` in a background task until they end."""
+        job = Job(uuid.uuid4().hex, case_id, key)
+        self._jobs[job.id] = job
+        self._running[key] = job
+        job.task = asyncio.create_task(self._run(job, frames, outcome))
+        JOBS_TOTAL.inc(status="submitted")
+        self._evict()
+        return job
+
+    async def _run(self, job: Job, frames: AsyncIterator[Any], outcome: Callable[[], Dict[str, Any]]) -> None:
+        os.makedirs(self._dir(job.id), exist_ok=True)
+        await asyncio.to_thread(self._write_meta, job)
+        flusher = asyncio.create_task(self._flush_loop(job))
+        status, error = "failed", None
+        try:
+            async for frame in frames:
+                job.append(frame)
+            job.outcome = outcome()
+            status = "completed" if job.outcome else "failed"
+            if not job.outcome:
+                error = "Pipeline finished without a final consensus payload"
+        except asyncio.CancelledError:
+            status, error = "cancelled", "Bridge shut down"
+            raise
+        except Exception as e:
+            error = repr(e)
+        finally:
+            flusher.cancel()
+            job.finish(status, error)
+            if self._running.get(job.key) is job:
+                del self._running[job.key]
+            JOBS_TOTAL.inc(status=status)
+            if status == "cancelled":
+                # Shutting down: write synchronously so the log is complete before the loop stops
+                self._persist(job)
+            else:
+                await asyncio.to_thread(self._persist, job)
+            print(f"  [🗂️ JOB] {job.id} ({job.case_id}) {status} after {len(job.events)} events")
+
+    def _persist(self, job: Job) -> None:
+        self._flush(job)
+        self._write_meta(job)
+        if job.outcome:
+            self._write_json(os.path.join(self._dir(job.id), "result.json"), job.outcome)
+
+    async def _flush_loop(self, job: Job) -> None:
+        while True:
+            await asyncio.sleep(JOB_FLUSH_S)
+            await asyncio.to_thread(self._flush, job)
+
+    def _flush(self, job: Job) -> None:
+        """Appends events not yet on disk to events.jsonl (one {"id", "frame"} per line)."""
+        with self._flush_lock:
+            end = len(job.events)
+            if job.persisted >= end:
+                return
+            lines = [
+                json.dumps({"id": event_id, "frame": job.events[event_id - 1].decode("utf-8", "replace")}) + "\n"
+                for event_id in range(job.persisted + 1, end + 1)
+            ]
+            with open(os.path.join(self._dir(job.id), "events.jsonl"), "a", encoding="utf-8") as f:
+                f.writelines(lines)
+            job.persisted = end
+
+    def _write_meta(self, job: Job) -> None:
+        meta = {k: v for k, v in job.info().items() if k not in ("events", "has_result")}
+        self._write_json(os.path.join(self._dir(job.id), "meta.json"), {**meta, "key": job.key})
+
+    @staticmethod
+    def _write_json(path: str, data: Dict[str, Any]) -> None:
+        tmp_path = f"{path}.part"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _evict(self) -> None:
+        """Drops the least recently used finished jobs from memory; their logs stay on disk."""
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.memory_limit:
+                break
+            if self._jobs[job_id].done:
+                del self._jobs[job_id]
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        """A job from memory, or reloaded from its on-disk log (e.g. after a restart)."""
+        if not _JOB_ID.match(job_id):
+            return None
+        job = self._jobs.get(job_id)
+        if job is not None:
+            self._jobs.move_to_end(job_id)
+            return job
+        job = await asyncio.to_thread(self._load, job_id)
+        if job is not None:
+            # Concurrent reloads of the same job settle on one copy
+            job = self._jobs.setdefault(job_id, job)
+            self._evict()
+        return job
+
+    def _load(self, job_id: str) -> Optional[Job]:
+        path = self._dir(job_id)
+        try:
+            with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # A job still marked running on disk was cut off by a bridge restart
+        status = "interrupted" if meta.get("status") == "running" else meta.get("status", "failed")
+        job = Job(job_id, meta.get("case_id", ""), meta.get("key", ""), status)
+        job.error = meta.get("error")
+        job.created_at = meta.get("created_at", job.created_at)
+        job.finished_at = meta.get("finished_at")
+        try:
+            with open(os.path.join(path, "events.jsonl"), encoding="utf-8") as f:
+                job.events = [json.loads(line)["frame"].encode() for line in f if line.strip()]
+        except FileNotFoundError:
+            pass
+        job.persisted = len(job.events)
+        try:
+            with open(os.path.join(path, "result.json"), encoding="utf-8") as f:
+                job.outcome = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+        return job
+
+    # --- Retention ----------------------------------------------------------------
+
+    def sweep(self, running: Set[str]) -> int:
+        """Deletes the logs of jobs finished more than ttl_s ago, except `running` (blocking)."""
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return 0
+        cutoff = time.time() - self.ttl_s
+        removed = 0
+        for job_id in names:
+            if not _JOB_ID.match(job_id) or job_id in running:
+                continue
+            job_dir = self._dir(job_id)
+            # meta.json is rewritten when the job finishes; a job without one is judged by its directory
+            for path in (os.path.join(job_dir, "meta.json"), job_dir):
+                try:
+                    finished = os.stat(path).st_mtime
+                    break
+                except FileNotFoundError:
+                    continue
+            else:
+                continue
+            if finished <= cutoff:
+                shutil.rmtree(job_dir, ignore_errors=True)
+                removed += 1
+        return removed
+
+    def start_sweeper(self, interval_s: float = JOB_SWEEP_INTERVAL_S) -> None:
+        if interval_s > 0 and self.ttl_s > 0:
+            self._sweeper = asyncio.create_task(self._sweep_loop(interval_s))
+
+    async def stop_sweeper(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+
+    async def _sweep_loop(self, interval_s: float) -> None:
+        while True:
+            try:
+                removed = await asyncio.to_thread(self.sweep, {job.id for job in self._running.values()})
+            except OSError as e:
+                print(f"  [⚠️ JOB] Log sweep failed: {e!r}")
+            else:
+                if removed:
+                    # Finished jobs still cached in memory would outlive their logs
+                    cutoff = time.time() - self.ttl_s
+                    for job_id, job in list(self._jobs.items()):
+                        if job.done and (job.finished_at or job.created_at) < cutoff:
+                            del self._jobs[job_id]
+                    print(f"  [🧹 JOB] Removed {removed} job logs older than {self.ttl_s / 3600:g}h")
+            await asyncio.sleep(interval_s)
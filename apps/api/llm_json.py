@@ -0,0 +1,242 @@
+import re
+import json
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+# -----------------------------
+# TOLERANT LLM JSON EXTRACTION
+# -----------------------------
+# Adjudicator output is "almost JSON": wrapped in ``` fences or prose, single-quoted,
+# trailing commas, Python literals, raw newlines inside strings, or cut off mid-object.
+# Instead of a chain of full-string passes (strip fences, find/rfind, parse, global
+# quote swap, regex repair, regex fallback), one balanced-brace scan copies the object
+# out and repairs defects as it goes. Apostrophes inside double-quoted strings are
+# left untouched. Well-formed objects never reach the scanner: raw_decode parses them
+# in place (C speed, trailing prose ignored). The scanner itself jumps between
+# interesting characters with precompiled patterns and copies clean strings whole.
+
+DEFAULT_VERDICT = {"score": 0.5, "reasoning": "Empty input", "recommendation": "Review"}
+
+# Characters that need attention inside a string that is being repaired, per opening quote
+_STRING_SPECIAL = {
+    '"': re.compile(r'["\\\x00-\x1f]'),
+    "'": re.compile(r'[\'"\\\x00-\x1f]'),
+}
+# One token per match outside strings. `clean` is a whole run that is already valid
+# JSON (numbers, punctuation, clean double-quoted strings, separator commas, JSON
+# literals, exponents), copied in one piece so repairs only cost time where the
+# defects are. String bodies are matched inside a lookahead, which Python's re never
+# backtracks into, so an unterminated string fails in one pass instead of giving its
+# body back one character at a time. A comma only joins a run when a value follows
+# it; trailing commas come out as their own token.
+_TOKEN = re.compile(r"""
+    (?P<clean>(?:
+        [^"'{}\[\],A-Za-z_]+
+      | "(?=(?P<dbody>[^"\\\x00-\x1f]*(?:\\.[^"\\\x00-\x1f]*)*))(?P=dbody)"
+      | ,(?!\s*(?:[}\],]|$))
+      | \b(?:true|false|null)\b
+      | (?<=[\d.])[eE]
+    )+)
+  | (?P<comma>,)
+  | (?P<open>[{\[])
+  | (?P<close>[}\]])
+  | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<squoted>'(?=(?P<sbody>[^'"\\\x00-\x1f]*))(?P=sbody)')
+  | (?P<quote>["'])
+""", re.X)
+_DECODER = json.JSONDecoder()
+
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t", "\b": "\\b", "\f": "\\f"}
+_LITERALS = {
+    "True": "true", "False": "false", "None": "null",
+    "true": "true", "false": "false", "null": "null",
+    "NaN": "NaN", "Infinity": "Infinity",
+}
+_CLOSERS = {"{": "}", "[": "]"}
+
+# Last-resort field recovery when the object is beyond repair
+_FIELD_PATTERNS = {
+    "score": re.compile(r'["\']?score["\']?\s*:\s*["\']?(\d*\.?\d+)'),
+    "reasoning": re.compile(r'["\']?reasoning["\']?\s*:\s*"((?:[^"\\]|\\.)*)"', re.S),
+    "recommendation": re.compile(r'["\']?recommendation["\']?\s*:\s*"((?:[^"\\]|\\.)*)"', re.S),
+}
+
+MAX_CANDIDATES = 4
+
+
+def _repair_string(text: str, i: int, quote: str, out: List[str]) -> Tuple[int, bool]:
+    """
+    Copies a string body starting after its opening quote, escaping raw control
+    characters and converting single-quoted strings to JSON. Returns (next_index, closed).
+    """
+    special = _STRING_SPECIAL[quote]
+    n = len(text)
+    while i < n:
+        m = special.search(text, i)
+        if m is None:
+            out.append(text[i:])
+            return n, False
+        j = m.start()
+        if j > i:
+            out.append(text[i:j])
+        ch = text[j]
+
+        if ch == quote:
+            out.append('"')
+            return j + 1, True
+        if ch == "\\":
+            nxt = text[j + 1:j + 2]
+            if quote == "'" and nxt == "'":
+                out.append("'")          # \' is not a valid JSON escape
+            elif nxt:
+                out.append(ch + nxt)
+            j += 1
+        elif ch == '"':
+            out.append('\\"')           # Bare " inside a single-quoted string
+        else:
+            out.append(_CONTROL_ESCAPES.get(ch, f"\\u{ord(ch):04x}"))
+        i = j + 1
+    return n, False
+
+
+def scan_object(text: str, start: int) -> Tuple[str, int, bool]:
+    """
+    Copies the balanced JSON value starting at text[start] ('{' or '['), repairing as it goes:
+    single-quoted strings, raw control characters in strings, trailing commas, Python
+    literals, bare keys, mismatched closers and truncation (open strings/brackets closed).
+    Returns (repaired_json, end_index, complete).
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    n = len(text)
+    i = start
+    comma_pending = False  # A ',' is only written once we know it isn't trailing
+
+    while i < n:
+        m = _TOKEN.match(text, i)
+        kind = m.lastgroup
+        token = m.group(0)
+        i = m.end()
+
+        if kind == "clean":
+            # Whitespace may sit between a comma and a trailing closer; anything else
+            # (a number, a colon) means the pending comma was a separator after all
+            if comma_pending and not token.isspace():
+                if token.lstrip()[:1] != ",":
+                    out.append(",")
+                comma_pending = False
+            out.append(token)
+            continue
+        if kind == "close":
+            comma_pending = False
+            if stack:
+                out.append(_CLOSERS[stack.pop()])
+            if not stack:
+                return "".join(out), i, True
+            continue
+        if kind == "comma":
+            comma_pending = True
+            continue
+
+        if comma_pending:
+            out.append(",")
+            comma_pending = False
+
+        if kind == "squoted":
+            out.append(f'"{m.group("sbody")}"')
+        elif kind == "open":
+            stack.append(token)
+            out.append(token)
+        elif kind == "quote":
+            out.append('"')
+            i, closed = _repair_string(text, i, token, out)
+            if not closed:
+                out.append('"')
+        else:
+            literal = _LITERALS.get(token)
+            prev = text[m.start() - 1:m.start()]
+            if prev.isdigit() or prev == ".":
+                out.append(token)             # Exponent of a number (1e-3)
+            elif literal is not None:
+                out.append(literal)
+            else:
+                # Bare key (`score: 0.8`) or stray word: quote it so the object still parses
+                out.append(f'"{token}"')
+
+    # Truncated output: close whatever is still open
+    tail = "".join(out).rstrip()
+    if tail.endswith(":"):
+        tail += " null"
+    return tail + "".join(_CLOSERS[opener] for opener in reversed(stack)), i, False
+
+
+def parse_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """
+    First JSON object in free-form LLM output.
+    Well-formed objects are decoded in place; malformed ones are repaired in a single scan.
+    Tries up to MAX_CANDIDATES opening braces (prose before the JSON may contain '{').
+    Returns None when no candidate parses to a dict.
+    """
+    if not text:
+        return None
+
+    start = text.find("{")
+    for _ in range(MAX_CANDIDATES):
+        if start == -1:
+            return None
+        try:
+            parsed = _DECODER.raw_decode(text, start)[0]
+        except ValueError:
+            try:
+                parsed = json.loads(scan_object(text, start)[0])
+            except ValueError:
+                parsed = None
+        if isinstance(parsed, dict):
+            return parsed
+        start = text.find("{", start + 1)
+    return None
+
+
+def _recover_fields(text: str) -> Dict[str, Any]:
+    recovered: Dict[str, Any] = {}
+    for name, pattern in _FIELD_PATTERNS.items():
+        m = pattern.search(text)
+        if m:
+            recovered[name] = float(m.group(1)) if name == "score" else m.group(1)
+    return recovered
+
+
+def extract_json(text: str) -> Dict[str, Any]:
+    """
+    Adjudicator verdict from raw model output: {"score", "reasoning", "recommendation", ...}.
+    Never raises; falls back to field-level regex recovery, then to a neutral 'Review' verdict.
+    """
+    if not text:
+        return dict(DEFAULT_VERDICT)
+
+    parsed = parse_json_object(text)
+    if parsed is not None:
+        return parsed
+
+    if "{" not in text:
+        return {"score": 0.5, "reasoning": "JSON boundaries not found", "recommendation": "Review"}
+
+    recovered = _recover_fields(text)
+    if not recovered:
+        return {"score": 0.5, "reasoning": "Total parse failure", "recommendation": "Manual Review"}
+    return {
+        "score": recovered.get("score", 0.5),
+        "reasoning": recovered.get("reasoning", "Regex recovery"),
+        "recommendation": recovered.get("recommendation", "Manual Review"),
+    }
+
+
+@lru_cache(maxsize=32)
+def _tag_pattern(tag: str) -> "re.Pattern[str]":
+    return re.compile(f"<{re.escape(tag)}>(.*?)</{re.escape(tag)}>", re.S)
+
+
+def extract_tag(text: str, tag: str) -> str:
+    """Contents of the first <tag>...</tag> block, stripped ('' when absent)."""
+    m = _tag_pattern(tag).search(text)
+    return m.group(1).strip() if m else ""
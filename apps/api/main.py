@@ -1,32 +1,153 @@
 import os
 import json
-import re
-import ast
-import requests
+import uuid
+import wave
 from dotenv import load_dotenv
 import ollama
 from fastapi.middleware.cors import CORSMiddleware
-import shutil  # Added for file saving
-from fastapi import FastAPI, UploadFile, File, Form  # Added UploadFile, File, Form
-from typing import Dict, Any, Optional
+from fastapi import FastAPI, UploadFile, File, Request, HTTPException, Header  # Added UploadFile, File
+from typing import Dict, Any, Optional, List, Set, Tuple
 import httpx
 import asyncio
-from fastapi.responses import StreamingResponse
+import time
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse, Response
+from contextlib import asynccontextmanager
+from pydantic import ValidationError
 
 
 from consensus_board.schemas.contracts import (
     CaseInput,
     ConsensusOutput,
-    DiscrepancyAlert,
     AgentReport,
     Claim,
-    VisionReport
+    ExtractedFinding,
+    FINDING_MAX_CHARS,
+    HistoryExtraction,
+    QualityFlag,
+)
+from apps.api.clients import ClientSettings, build_cloud_client, build_ollama_client
+from apps.api.cache import ResultCache, make_key
+from apps.api.uploads import MAX_AUDIO_BYTES, MAX_XRAY_BYTES, UploadLimitMiddleware, save_upload
+from apps.api.scheduling import ConcurrencyLimits, limited_call
+from apps.api.backends import Backend, BackendPool
+from apps.api.resilience import AGENT_RETRY_ATTEMPTS, connect_failed, hedged_stream, idle_guarded, retry_pause, with_retries
+from apps.api.batch import parse_case_records, run_batch
+from apps.api.singleflight import SingleFlight
+from apps.api.jobs import JobStore
+from apps.api.patients import PatientStore
+from apps.api.results import ResultStore
+from apps.api.storage import RUNS_DIR, BlobStore, CaseStorage
+from apps.api.profiling import RUN_PROFILING, LoopMonitor, RunProfiler, list_profiles, profiled, read_profile
+from apps.api.warmup import OLLAMA_KEEP_ALIVE, Warmup
+from apps.api.acoustics import AudioWindow, aggregate_windows, split_recording, windowing_settings
+from apps.api.imaging import XrayPreprocessor, preprocess_settings
+from apps.api.artifacts import ARTIFACT_MISSING_STATUSES, ArtifactTransfer, artifact_part
+from apps.api.budget import (
+    PROMPT_BUDGET_AUDIO_TOKENS,
+    PROMPT_BUDGET_HISTORY_TOKENS,
+    PROMPT_BUDGET_IMAGING_TOKENS,
+    PROMPT_BUDGET_PRIOR_TOKENS,
+    fit_claims,
+    fit_text,
+)
+from apps.api.notes import RULE_CONFIDENCE, merge_findings, note_settings, rule_findings, split_sections
+from apps.api.sse import SSEEvent, coalesce_frames, iter_sse_events, until_disconnected
+from apps.api.speculation import (
+    SPECULATIVE_CONSENSUS,
+    SPECULATION_MATCH_RATIO,
+    SPECULATION_MAX_ATTEMPTS,
+    SpeculativeConsensus,
+    phase_summary,
+)
+from apps.api.metrics import (
+    REGISTRY,
+    ARTIFACT_REFERENCES,
+    BLOB_DEDUP_BYTES,
+    CLIENT_DISCONNECTS,
+    GPU_SECONDS_SAVED,
+    NOTE_SECTIONS,
+    PIPELINE_SECONDS,
+    PROMPT_TOKENS,
+    PROMPT_TOKENS_TRIMMED,
+    RESULT_QUERY_SECONDS,
+    RESULTS_STORED,
+    RUN_CANCELLATIONS,
+    UPLOAD_BYTES,
+    UPLOAD_SIZE,
+    expected_remaining_seconds,
+    instrument_call,
+    instrument_stream,
 )
 
 # 1. LOAD ENVIRONMENT VARIABLES
 load_dotenv()
 
-app = FastAPI(title="Consensus Board API", version="0.5.0 (MedGemma-Native)")
+API_URL = os.getenv("API_URL")
+CLIENT_SETTINGS = ClientSettings.from_env()
+
+# Model identities are part of every cache key: swapping a model must never replay stale results
+VISION_MODEL = "google/medgemma-1.5-4b-it"
+AUDIO_MODEL = "google/hear-pytorch"
+HISTORY_MODEL = "koesn/llama3-openbiollm-8b"
+CONSENSUS_MODEL = "google/medgemma-1.5-4b-it"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Creates one pooled, keep-alive client per upstream for the lifetime of the bridge.
+    app.state.cloud_client  -> Colab GPU tunnel (Vision / HeAR / Consensus)
+    app.state.ollama_client -> Local Ollama daemon (OpenBioLLM)
+    app.state.result_cache  -> Content-addressed agent result cache
+    app.state.limits        -> Per-upstream concurrency limits (GPU / HeAR per backend, Ollama)
+    app.state.backends      -> Pool of GPU backends (API_URLS) with per-case routing and health checks
+    app.state.inflight      -> Single-flight registry of running case pipelines
+    app.state.artifact_transfer -> Which artifacts the GPU backend already holds (push once, then reference)
+    app.state.preprocessor  -> Process pool shrinking x-rays to the model's input resolution
+    app.state.jobs          -> Background case jobs with resumable event logs
+    app.state.patients      -> Per-patient record of analyzed studies (prior comparison)
+    app.state.warmup        -> Background model / connection warmup and keep-alive behind /ready
+    app.state.results       -> SQLite record of every final case payload (GET /results)
+    app.state.storage       -> Content-addressed upload blobs, case manifests and the retention GC
+    app.state.loop_monitor  -> Event loop lag heartbeat and blocked-callback stack capture (GET /debug/loop)
+    """
+    app.state.cloud_client = build_cloud_client(CLIENT_SETTINGS)
+    app.state.ollama_client = build_ollama_client(CLIENT_SETTINGS)
+    app.state.result_cache = ResultCache.from_env()
+    app.state.limits = ConcurrencyLimits.from_env()
+    app.state.backends = BackendPool.from_env(API_URL, app.state.limits.cloud_gpu_slots, app.state.limits.hear_slots)
+    app.state.backends.start_health_checks(app.state.cloud_client)
+    app.state.inflight = SingleFlight()
+    app.state.artifact_transfer = ArtifactTransfer()
+    app.state.preprocessor = XrayPreprocessor()
+    app.state.jobs = JobStore()
+    app.state.jobs.start_sweeper()
+    app.state.patients = PatientStore()
+    app.state.results = ResultStore()
+    app.state.storage = CaseStorage(BlobStore())
+    app.state.storage.start()
+    app.state.loop_monitor = LoopMonitor()
+    app.state.loop_monitor.start()
+    app.state.warmup = Warmup(app.state.backends, app.state.cloud_client, app.state.ollama_client, HISTORY_MODEL)
+    app.state.warmup.start()
+    print("  [🔌 CLIENTS] Shared upstream connection pools ready.")
+    try:
+        yield
+    finally:
+        await app.state.warmup.stop()
+        await app.state.storage.stop()
+        await app.state.jobs.stop_sweeper()
+        await app.state.loop_monitor.stop()
+        await app.state.backends.stop_health_checks()
+        await app.state.cloud_client.aclose()
+        await app.state.ollama_client.close()
+        # Joining the worker processes blocks: keep it off the loop
+        await asyncio.to_thread(app.state.preprocessor.shutdown)
+        # Commit the results still queued for the writer thread
+        await asyncio.to_thread(app.state.results.close)
+
+
+app = FastAPI(title="Consensus Board API", version="0.5.0 (MedGemma-Native)", lifespan=lifespan)
 
 # --- CORS CONFIGURATION ---
 # Define the origins that are allowed to make requests to this API
@@ -45,7 +166,8 @@ app.add_middleware(
 )
 # --------------------------
 
-API_URL = os.getenv("API_URL")
+# Caps /upload request bodies before Starlette spools the multipart form to disk
+app.add_middleware(UploadLimitMiddleware)
 
 # -----------------------------
 # NEW: UPLOAD ENDPOINT
@@ -54,143 +176,287 @@ API_URL = os.getenv("API_URL")
 async def upload_case_artifacts(
     case_id: str, 
     xray: UploadFile = File(None), 
-    audio: UploadFile = File(None)
+    audio: UploadFile = File(None),
+    xray_prior: UploadFile = File(None),
+    audio_prior: UploadFile = File(None),
 ):
     """
     Saves uploaded files to the local disk so agents can find them.
-    Path: artifacts/runs/{case_id}/xray.jpg (or audio.wav)
+    Path: artifacts/runs/{case_id}/xray.jpg (or audio.wav; xray_prior.jpg / audio_prior.wav
+    for the prior studies the case is compared against)
+    Files are streamed off the event loop, size-capped, hashed on the fly and
+    renamed into place atomically. Each file is a hardlink to its content blob
+    (artifacts/blobs), so a study uploaded again under another case id is stored once.
     """
-    target_dir = f"artifacts/runs/{case_id}"
-    os.makedirs(target_dir, exist_ok=True)
+    storage = app.state.storage
+    target_dir = storage.case_dir(case_id)
+    saved = {}
+
+    # 🧷 The storage GC leaves the case alone while its files are arriving
+    async with storage.protect(case_id):
+        # Save X-Ray
+        if xray:
+            saved["xray"] = await save_upload(xray, os.path.join(target_dir, "xray.jpg"), MAX_XRAY_BYTES, storage.blobs)
+
+        # Save Audio
+        if audio:
+            saved["audio"] = await save_upload(audio, os.path.join(target_dir, "audio.wav"), MAX_AUDIO_BYTES, storage.blobs)
 
-    # Save X-Ray
-    if xray:
-        file_location = os.path.join(target_dir, "xray.jpg")
-        with open(file_location, "wb+") as file_object:
-            shutil.copyfileobj(xray.file, file_object)
+        # Save prior studies
+        if xray_prior:
+            saved["xray_prior"] = await save_upload(xray_prior, os.path.join(target_dir, "xray_prior.jpg"), MAX_XRAY_BYTES, storage.blobs)
+        if audio_prior:
+            saved["audio_prior"] = await save_upload(audio_prior, os.path.join(target_dir, "audio_prior.wav"), MAX_AUDIO_BYTES, storage.blobs)
 
-    # Save Audio
-    if audio:
-        file_location = os.path.join(target_dir, "audio.wav")
-        with open(file_location, "wb+") as file_object:
-            shutil.copyfileobj(audio.file, file_object)
+        if saved:
+            await asyncio.to_thread(storage.record, case_id, {os.path.basename(info["path"]): info for info in saved.values()})
 
-    return {"message": "Files cached successfully", "case_id": case_id}
+    # The hash is already known: spare the cache from re-reading the file on /run
+    for name, info in saved.items():
+        app.state.result_cache.remember_file_digest(info["path"], info["sha256"])
+        UPLOAD_BYTES.inc(info["bytes"], artifact=name)
+        UPLOAD_SIZE.observe(info["bytes"], artifact=name)
+        if info["deduplicated"]:
+            BLOB_DEDUP_BYTES.inc(info["bytes"])
+
+    # 🖼️ Build the model-ready x-ray in the background; /run awaits the same job if it is still running
+    for name in ("xray", "xray_prior"):
+        if name in saved:
+            asyncio.create_task(app.state.preprocessor.model_input(saved[name]["path"], saved[name]["sha256"]))
+
+    return {
+        "message": "Files cached successfully",
+        "case_id": case_id,
+        "files": {name: {"sha256": info["sha256"], "bytes": info["bytes"], "deduplicated": info["deduplicated"]} for name, info in saved.items()},
+    }
 
 # -----------------------------
-# HELPER: ROBUST JSON PARSER
+# METRICS
 # -----------------------------
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint: agent latencies, stream rates, upload bytes, cache hits."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
+# -----------------------------
+# READINESS & BACKEND POOL
+# -----------------------------
+@app.get("/ready")
+async def readiness():
+    """
+    200 once the Ollama model is loaded and every agent endpoint has a warm backend, and
+    while every agent still has a backend that is not ejected and whose breaker is not open; else 503.
+    """
+    warmup = app.state.warmup
+    return JSONResponse(status_code=200 if warmup.ready else 503, content=warmup.info())
 
-def extract_json(text: str) -> Dict[str, Any]:
-    if not text:
-        return {"score": 0.5, "reasoning": "Empty input", "recommendation": "Review"}
 
-    # 1. Clean common LLM formatting errors
-    cleaned = text.replace("```json", "").replace("```", "").strip()
+@app.get("/backends")
+async def backend_status():
+    """GPU backend pool: capabilities, load and health of each backend."""
+    return app.state.backends.info()
 
-    # 2. Try to find the boundaries of the JSON object
-    start = cleaned.find("{")
-    end = cleaned.rfind("}")
+# -----------------------------
+# PATIENT STUDIES
+# -----------------------------
+@app.get("/patients/{patient_id}/studies")
+async def patient_studies(patient_id: str):
+    """Analyzed studies on record for a patient (the priors follow-up cases are compared against)."""
+    return {"patient_id": patient_id, **await app.state.patients.studies(patient_id)}
 
-    if start == -1 or end == -1:
-        return {"score": 0.5, "reasoning": "JSON boundaries not found", "recommendation": "Review"}
+# -----------------------------
+# ARTIFACT STORAGE
+# -----------------------------
+@app.get("/storage/stats")
+async def storage_stats():
+    """Disk usage of upload blobs and case directories, dedup savings, quotas and the last GC pass."""
+    return await app.state.storage.usage()
 
-    json_str = cleaned[start:end+1]
 
-    # 3. Attempt Standard Parse
-    try:
-        return json.loads(json_str)
-    except Exception:
-        # 4. Fallback: Repair single quotes and common trailing commas
-        try:
-            # Replace single quotes with double quotes
-            repaired = json_str.replace("'", '"')
-            # Remove trailing commas before closing braces
-            repaired = re.sub(r",\s*}", "}", repaired)
-            return json.loads(repaired)
-        except Exception:
-            # 5. Last Resort: Regex Extraction
-            try:
-                score_match = re.search(r'"score":\s*(\d?\.\d+)', json_str)
-                reason_match = re.search(r'"reasoning":\s*"(.*?)"', json_str)
-                rec_match = re.search(r'"recommendation":\s*"(.*?)"', json_str)
-
-                return {
-                    "score": float(score_match.group(1)) if score_match else 0.5,
-                    "reasoning": reason_match.group(1) if reason_match else "Regex recovery",
-                    "recommendation": rec_match.group(1) if rec_match else "Manual Review"
-                }
-            except:
-                return {"score": 0.5, "reasoning": "Total parse failure", "recommendation": "Manual Review"}
-    
-def _extract_tag(text: str, tag: str) -> str:
-        m = re.search(fr"<{tag}>(.*?)</{tag}>", text, flags=re.S)
-        return m.group(1).strip() if m else ""
+@app.post("/storage/gc")
+async def storage_gc():
+    """Runs a storage GC pass now (it also runs every STORAGE_GC_INTERVAL_S)."""
+    return await app.state.storage.gc()
+
+# -----------------------------
+# DEBUG: LOOP LAG & RUN PROFILES
+# -----------------------------
+@app.get("/debug/loop")
+async def loop_status():
+    """Event loop lag and the most recent blocking callbacks with their stacks."""
+    return app.state.loop_monitor.info()
+
+
+@app.get("/debug/profiles")
+async def run_profiles():
+    """Saved /run profiles (folded stacks), newest first."""
+    return {"profiles": await asyncio.to_thread(list_profiles)}
+
+
+@app.get("/debug/profiles/{name}")
+async def run_profile(name: str):
+    """One saved profile in the folded-stack format (flamegraph.pl / speedscope)."""
+    folded = await asyncio.to_thread(read_profile, name)
+    if folded is None:
+        raise HTTPException(status_code=404, detail=f"No profile named {name}")
+    return PlainTextResponse(folded)
+
+# -----------------------------
+# CACHE INVALIDATION
+# -----------------------------
+@app.delete("/cache/{case_id}")
+async def invalidate_case_cache(case_id: str):
+    """Drops every cached agent result recorded for this case."""
+    removed = await app.state.result_cache.invalidate_tag(case_id)
+    return {"message": "Case cache invalidated", "case_id": case_id, "removed": removed}
+
+
+@app.delete("/cache")
+async def clear_cache():
+    """Drops the whole agent result cache (memory and disk)."""
+    removed = await app.state.result_cache.clear()
+    return {"message": "Cache cleared", "removed": removed}
 
 # -----------------------------
 # 1) LOCAL AGENTS (Gemma-2-2B)
 # -----------------------------
 
 
-async def extract_history_with_medgemma(client: httpx.AsyncClient, note_text: str) -> AgentReport:
+HISTORY_SYSTEM_PROMPT = (
+    "You are a Clinical Data Extractor. Extract findings into: "
+    "[ACTIVE], [BASELINE], [RISK], [NEGATION]. \n"
+    "Search specifically for symptoms (e.g., weight loss, fever, cough). "
+    "Return each finding as {category, finding, confidence}: one short phrase per finding, "
+    "confidence = how explicitly the note states it (0-1). "
+    "Example: {\"findings\": [{\"category\": \"ACTIVE\", \"finding\": \"102F fever\", \"confidence\": 0.95}]}"
+)
+# Ollama structured output: generation is constrained to this schema (bounded list, short
+# strings), instead of format='json', which let the model ramble in any shape
+HISTORY_FORMAT = HistoryExtraction.model_json_schema()
+
+
+def _salvage_findings(items: List[Any]) -> List[Tuple[str, float]]:
+    """
+    Findings from a list that broke the schema as a whole: each item is validated on its
+    own, over-long phrases are cut at a word boundary, and only the invalid items are dropped.
+    """
+    findings = []
+    for item in items:
+        if isinstance(item, dict):
+            item = dict(item)
+            if isinstance(item.get("category"), str):
+                item["category"] = item["category"].upper()
+            text = item.get("finding")
+            if isinstance(text, str) and len(text) > FINDING_MAX_CHARS:
+                item["finding"] = text[:FINDING_MAX_CHARS].rsplit(" ", 1)[0]
+        try:
+            finding = ExtractedFinding.model_validate(item)
+        except ValidationError:
+            continue
+        findings.append((f"[{finding.category}] {finding.finding}", finding.confidence))
+    if len(findings) < len(items):
+        print(f"  [⚠️ CONTEXT] Dropped {len(items) - len(findings)}/{len(items)} history findings that broke the schema")
+    return findings
+
+
+def _loose_findings(raw_data: Any) -> List[Tuple[str, float]]:
+    """Findings from free-form JSON (a list, or {category: [findings]}) for models that ignore the schema."""
+    findings = []
+    if isinstance(raw_data, dict) and isinstance(raw_data.get("findings"), list):
+        # Schema-shaped but invalid (too many items, one phrase too long): keep the valid items
+        return _salvage_findings(raw_data["findings"])
+    if isinstance(raw_data, list) and raw_data and all(isinstance(item, dict) for item in raw_data):
+        return _salvage_findings(raw_data)
+    if isinstance(raw_data, list):
+        findings = raw_data
+    elif isinstance(raw_data, dict):
+        for cat, val in raw_data.items():
+            if isinstance(val, list):
+                for v in val: findings.append(f"[{cat.upper()}] {v}")
+            else:
+                findings.append(f"[{cat.upper()}] {val}")
+    return [(str(f), RULE_CONFIDENCE) for f in findings]
+
+
+async def extract_section_findings(client: ollama.AsyncClient, section: str) -> List[Tuple[str, float]]:
+    """One Ollama extraction over one note section: ('[CATEGORY] finding', confidence) pairs."""
+    # 1. ASYNC INFERENCE
+    # The shared AsyncClient keeps the Ollama connection warm and lets the
+    # event loop still handle network IO for other agents.
+    response = await client.chat(
+        model=HISTORY_MODEL,
+        messages=[
+            {'role': 'system', 'content': HISTORY_SYSTEM_PROMPT},
+            {'role': 'user', 'content': f"Extract: {section}"}
+        ],
+        format=HISTORY_FORMAT,
+        # Deterministic decoding is recommended with structured outputs
+        options={'temperature': 0},
+        # Renew the model's residency so the next case doesn't pay for a reload
+        keep_alive=OLLAMA_KEEP_ALIVE,
+    )
+    content = response['message']['content']
+
+    # 2. SCHEMA VALIDATION (free-form JSON is still accepted from older Ollama builds)
+    try:
+        extraction = HistoryExtraction.model_validate_json(content)
+    except ValidationError:
+        return _loose_findings(json.loads(content))
+    return [(f"[{f.category}] {f.finding}", f.confidence) for f in extraction.findings]
+
+
+@instrument_call("history")
+async def extract_history_with_medgemma(
+    client: ollama.AsyncClient,
+    note_text: str,
+    cache: ResultCache,
+    limits: ConcurrencyLimits,
+    tags: Optional[List[str]] = None,
+    use_cache: bool = True,
+) -> AgentReport:
     """
     Asynchronous Context Agent: Translates clinical notes into structured profiles
     concurrently with other diagnostic streams.
+    Long notes are extracted section by section (each cached by its text, each holding
+    one Ollama slot); negations and abnormal vitals come from a regex pre-pass.
     """
     print(f"  [📄 CONTEXT START] Analyzing clinical notes...")
-    
+
     try:
-        # 1. ASYNC INFERENCE
-        # Using AsyncClient ensures the CPU/GPU work on the local model 
-        # allows the event loop to still handle network IO for other agents.
-        client = ollama.AsyncClient()
-        response = await client.chat(
-            model='koesn/llama3-openbiollm-8b',
-            messages=[
-                {
-                    'role': 'system', 
-                    'content': (
-                        "You are a Clinical Data Extractor. Extract findings into: "
-                        "[ACTIVE], [BASELINE], [RISK], [NEGATION]. \n"
-                        "Search specifically for symptoms (e.g., weight loss, fever, cough). "
-                        "Format: '[CATEGORY] Finding'. Example: ['[ACTIVE] 102F fever']"
-                    )
-                },
-                {'role': 'user', 'content': f"Extract: {note_text}"}
-            ],
-            format='json',
+        sections = split_sections(note_text)
+        rules = [rule_findings(section) for section in sections]
+
+        async def section_findings(section: str, covered: bool) -> List[Tuple[str, float]]:
+            if covered:
+                # ⚡ Fast path: the rules already explain every sentence of this section
+                NOTE_SECTIONS.inc(route="rules_only")
+                return []
+            NOTE_SECTIONS.inc(route="llm")
+            return await cache.cached_call(
+                make_key("history-section", HISTORY_MODEL, HISTORY_SYSTEM_PROMPT, HISTORY_FORMAT, section),
+                lambda: limited_call(limits.ollama, lambda: extract_section_findings(client, section)),
+                encode=lambda pairs: [list(pair) for pair in pairs],
+                decode=lambda value: [tuple(pair) for pair in value],
+                agent="history_section",
+                tags=tags or [],
+                bypass=not use_cache,
+            )
+
+        results = await asyncio.gather(
+            *(section_findings(section, rule.covered) for section, rule in zip(sections, rules)),
+            return_exceptions=True,
         )
-        
-        raw_data = json.loads(response['message']['content'])
-
-        print('Patient history findings : ' , raw_data)
-        findings = []
-
-        # 2. ROBUST PARSING (Same logic as before)
-        if isinstance(raw_data, list):
-            findings = raw_data
-        elif isinstance(raw_data, dict):
-            for cat, val in raw_data.items():
-                if isinstance(val, list):
-                    for v in val: findings.append(f"[{cat.upper()}] {v}")
-                else:
-                    findings.append(f"[{cat.upper()}] {val}")
-
-        # 3. DEDUPLICATION & CLEANUP
-        valid_prefixes = ["[ACTIVE]", "[BASELINE]", "[RISK]", "[NEGATION]"]
-        final_claims = []
-        
-        for f in findings:
-            f_str = str(f).strip()
-            if any(f_str.startswith(p) for p in valid_prefixes):
-                for p in valid_prefixes:
-                    double_p = f"{p} {p}"
-                    if f_str.startswith(double_p):
-                        f_str = f_str.replace(double_p, p, 1)
-                
-                if len(f_str) > 10:
-                    final_claims.append(f_str)
+        failures = [r for r in results if isinstance(r, BaseException)]
+        for failure in failures:
+            if isinstance(failure, asyncio.CancelledError):
+                raise failure
+        if failures and len(failures) == len(sections):
+            raise failures[0]
+
+        # 3. SET-BASED DEDUPLICATION: the model's findings first, then the rules', normalized
+        model_findings = [r for r in results if not isinstance(r, BaseException)]
+        final_claims = merge_findings([*model_findings, [f for rule in rules for f in rule.findings]])
+        print('Patient history findings : ', [f for f, _ in final_claims])
 
         # 4. SIGNALING STATUS
         if not final_claims:
@@ -208,12 +474,20 @@ async def extract_history_with_medgemma(client: httpx.AsyncClient, note_text: st
                 uncertainties=["Local extraction failed to identify clinical entities."]
             )
 
-        print(f"  [✅ CONTEXT SUCCESS] Extracted {len(final_claims)} clinical entities.")
-        return AgentReport(
+        print(f"  [✅ CONTEXT SUCCESS] Extracted {len(final_claims)} clinical entities from {len(sections)} note section(s).")
+        report = AgentReport(
             agent_name="history",
             model="OpenBioLLM-8B (Local)",
-            claims=[Claim(label="finding", value=f, confidence=0.9) for f in final_claims]
+            claims=[Claim(label="finding", value=f, confidence=confidence) for f, confidence in final_claims]
         )
+        if failures:
+            # Partial reports are never cached, so the failed sections are retried next time
+            report.quality_flags.append(QualityFlag(
+                type="partial_analysis",
+                severity="medium",
+                detail=f"{len(failures)} of {len(sections)} note sections could not be extracted ({failures[0]!r})",
+            ))
+        return report
         
     except Exception as e:
         print(f"  [💥 CONTEXT CRASH] Exception: {str(e)}")
@@ -227,73 +501,155 @@ async def extract_history_with_medgemma(client: httpx.AsyncClient, note_text: st
 # 2) CLOUD AGENTS (MedGemma 4B / HeAR)
 # -----------------------------
 
-async def call_vision_agent(client: httpx.AsyncClient, case_id: str, note_text: str):
+async def model_xray_path(image_path: str) -> str:
+    """The x-ray file agents send: the preprocessed derivative when available, else the upload itself."""
+    model_input = await app.state.preprocessor.model_input(image_path, await app.state.result_cache.file_digest(image_path))
+    if model_input["path"] != image_path:
+        app.state.result_cache.remember_file_digest(model_input["path"], model_input["sha256"])
+    return model_input["path"]
+
+
+async def artifact_ref(client: httpx.AsyncClient, backend: Backend, path: str, content_type: str) -> Optional[str]:
+    """Content ID of a case artifact on this GPU backend (pushed on first use), or None to send it as multipart."""
+    digest = await app.state.result_cache.file_digest(path)
+    if digest is None:
+        return None
+    return await app.state.artifact_transfer.ensure(client, backend.url, path, digest, content_type)
+
+
+@instrument_stream("imaging")
+async def call_vision_agent(
+    client: httpx.AsyncClient,
+    case_id: str,
+    note_text: str,
+    avoid: Optional[Set[str]] = None,
+    image_path: Optional[str] = None,
+):
     """
     Dispatches clinical note and streams agentic reasoning tokens.
     Uses detailed error reporting to diagnose connection issues.
+    `avoid` steers a hedged duplicate away from the backends already serving this call.
+    `image_path` defaults to the case's current x-ray (a prior study passes its own).
     """
     print(f"\n[🚀 START] Agentic Vision Loop | Case: {case_id}")
-    image_path = f"artifacts/runs/{case_id}/xray.jpg"
+    image_path = image_path or f"artifacts/runs/{case_id}/xray.jpg"
 
     if not os.path.exists(image_path):
-        yield json.dumps({"type": "error", "message": "Image artifact missing on local server"})
+        yield SSEEvent.from_obj({"type": "error", "message": "Image artifact missing on local server"})
         return
 
     try:
-        # Check if API_URL exists
-        if not API_URL:
-            yield json.dumps({"type": "error", "message": "API_URL missing in .env file"})
+        # Check if a GPU backend is configured
+        if not app.state.backends:
+            yield SSEEvent.from_obj({"type": "error", "message": "API_URL missing in .env file"})
             return
 
         payload = {"context_hint": f"Clinical History: {note_text}"}
-        
-        with open(image_path, "rb") as img_file:
-            files = {"image": ("xray.jpg", img_file, "image/jpeg")}
-            
-            # Use a fresh client instance with specific settings for tunnels
-            async with httpx.AsyncClient(timeout=None, verify=False) as streaming_client:
-                async with streaming_client.stream(
-                    "POST", 
-                    f"{API_URL}/agent/vision", 
-                    data=payload, 
-                    files=files
-                ) as response:
-                    
-                    if response.status_code != 200:
-                        error_body = await response.aread()
-                        error_text = error_body.decode()
-                        yield json.dumps({"type": "error", "message": f"Colab rejected ({response.status_code}): {error_text}"})
-                        return
-
-                    async for line in response.aiter_lines():
-                        if line.startswith("data: "):
-                            yield line.replace("data: ", "").strip()
-                        elif line.strip():
-                            # Wrap raw text chunks as thoughts
-                            yield json.dumps({"type": "thought", "delta": line})
+        image_path = await model_xray_path(image_path)
+
+        for attempt in range(AGENT_RETRY_ATTEMPTS + 1):
+            try:
+                # 🧭 Least-busy backend, or the one already holding this case's artifacts
+                async with app.state.backends.lease("vision", case_id, avoid) as backend:
+                    image_ref = await artifact_ref(client, backend, image_path, "image/jpeg")
+
+                    # 📎 Reference the x-ray by content ID; re-send the file only if the backend lost it
+                    for ref in ([image_ref, None] if image_ref else [None]):
+                        with artifact_part("image", "xray.jpg", image_path, "image/jpeg", ref, payload) as files:
+                            # Shared pooled client: 'read' timeout bounds the silence between tokens
+                            async with client.stream(
+                                "POST", 
+                                f"{backend.url}/agent/vision", 
+                                data=payload, 
+                                files=files,
+                                timeout=CLIENT_SETTINGS.stream_request_timeout(),
+                            ) as response:
+                                app.state.backends.check(backend, "vision", response)
+                                if ref and response.status_code in ARTIFACT_MISSING_STATUSES:
+                                    app.state.artifact_transfer.forget(backend.url, ref)
+                                    continue
+                                ARTIFACT_REFERENCES.inc(agent="imaging", mode="reference" if ref else "multipart")
+
+                                if response.status_code != 200:
+                                    error_body = await response.aread()
+                                    error_text = error_body.decode()
+                                    yield SSEEvent.from_obj({"type": "error", "message": f"Colab rejected ({response.status_code}): {error_text}"})
+                                    return
+
+                                # Incremental parse: thought payloads stay raw bytes, raw text lines become thoughts
+                                async for event in idle_guarded(iter_sse_events(response.aiter_bytes()), "imaging"):
+                                    yield event
+                        break
+                break
+            except Exception as e:
+                # A streamed call is only repeated when its connection was never made
+                if attempt >= AGENT_RETRY_ATTEMPTS or not connect_failed(e):
+                    raise
+                await retry_pause("imaging", attempt, e)
 
         print(f"[✅ SUCCESS] Vision streaming finished for {case_id}\n")
 
     except httpx.ConnectError:
-        yield json.dumps({"type": "error", "message": "Connection Refused. Is ngrok running on Colab?"})
+        yield SSEEvent.from_obj({"type": "error", "message": "Connection Refused. Is ngrok running on Colab?"})
     except Exception as e:
         # Use repr(e) to get the specific class of the error (e.g., Timeout, DNS error)
         error_detail = repr(e)
         print(f"[💥 BRIDGE CRASH] {error_detail}")
-        yield json.dumps({"type": "error", "message": f"Vision Stream Bridge Failed: {error_detail}"})
+        yield SSEEvent.from_obj({"type": "error", "message": f"Vision Stream Bridge Failed: {error_detail}"})
 
-    except Exception as e:
-        print(f"[💥 CRASH] Agentic Loop Failure: {str(e)}")
-        yield json.dumps({"type": "error", "message": f"Vision Stream Error: {str(e)}"})
 
+async def classify_audio_window(client: httpx.AsyncClient, window: AudioWindow) -> Dict[str, Any]:
+    """
+    One 16 kHz window to HeAR. Windows are small derived clips, so they always go as
+    multipart and need no case affinity: a long recording spreads over the whole pool.
+    """
+    async with app.state.backends.lease("audio") as backend:
+        response = await client.post(
+            f"{backend.url}/agent/audio",
+            files={"file": (f"window_{window.index:04d}.wav", window.wav, "audio/wav")},
+            timeout=CLIENT_SETTINGS.request_timeout(),
+        )
+        app.state.backends.check(backend, "audio", response)
+    response.raise_for_status()
+    return response.json()
+
+
+async def classify_whole_recording(client: httpx.AsyncClient, case_id: str, audio_path: str) -> Dict[str, Any]:
+    """Fallback for recordings the bridge can't decode (non-PCM WAV): one request for the whole file."""
+    data: Dict[str, Any] = {}
+
+    async with app.state.backends.lease("audio", case_id) as backend:
+        audio_ref = await artifact_ref(client, backend, audio_path, "audio/wav")
 
-async def call_audio_agent(client: httpx.AsyncClient, case_id: str) -> AgentReport:
+        # 📎 Reference the recording by content ID; re-send the file only if the backend lost it
+        for ref in ([audio_ref, None] if audio_ref else [None]):
+            with artifact_part("file", "audio.wav", audio_path, "audio/wav", ref, data) as files:
+                response = await client.post(
+                    f"{backend.url}/agent/audio", 
+                    data=data,
+                    files=files, 
+                    timeout=CLIENT_SETTINGS.request_timeout()
+                )
+            app.state.backends.check(backend, "audio", response)
+            if ref and response.status_code in ARTIFACT_MISSING_STATUSES:
+                app.state.artifact_transfer.forget(backend.url, ref)
+                continue
+            ARTIFACT_REFERENCES.inc(agent="acoustics", mode="reference" if ref else "multipart")
+            break
+    response.raise_for_status()
+    return response.json()
+
+
+@instrument_call("acoustics")
+async def call_audio_agent(client: httpx.AsyncClient, case_id: str, audio_path: Optional[str] = None) -> AgentReport:
     """
     Asynchronous Audio Agent: Analyzes bio-acoustic signatures (HeAR) 
     in parallel with other diagnostic streams.
+    The recording is split into overlapping 16 kHz windows (silence skipped) that are
+    classified concurrently, each holding one HeAR slot on the backend it is routed to.
     """
     print(f"  [🎤 AUDIO START] Processing Case: {case_id}")
-    audio_path = f"artifacts/runs/{case_id}/audio.wav"
+    audio_path = audio_path or f"artifacts/runs/{case_id}/audio.wav"
     
     if not os.path.exists(audio_path):
         print(f"  [❌ AUDIO ERROR] Audio file missing: {audio_path}")
@@ -304,40 +660,58 @@ async def call_audio_agent(client: httpx.AsyncClient, case_id: str) -> AgentRepo
         )
 
     try:
-        if not API_URL: 
+        if not app.state.backends: 
             raise ValueError("API_URL is missing in .env")
 
-        print(f"  [☁️  CLOUD REQUEST] Dispatching to HeAR Acoustic Endpoint (Async)...")
-        
-        # Async file handling with httpx
-        files = {"file": ("audio.wav", open(audio_path, "rb"), "audio/wav")}
-        
-        response = await client.post(
-            f"{API_URL}/agent/audio", 
-            files=files, 
-            timeout=300.0
+        try:
+            windows, stats = await asyncio.to_thread(split_recording, audio_path)
+        except (wave.Error, EOFError) as e:
+            print(f"  [⚠️ AUDIO] Cannot window this recording ({e}): sending it whole")
+            data = await with_retries(lambda: classify_whole_recording(client, case_id, audio_path), "acoustics")
+
+            # --- THE FIX: SAFETY CLAMPING ---
+            # Ensures confidence is always within [0.0, 1.0] for Pydantic validation
+            raw_confidence = data.get("confidence", 0.0)
+            safe_confidence = max(0.0, min(1.0, float(raw_confidence)))
+
+            print(f"  [✅ AUDIO SUCCESS] Acoustic classification: {data.get('prediction', 'unknown')}")
+            return AgentReport(
+                agent_name="acoustics",
+                model="HeAR (Cloud)",
+                claims=[
+                    Claim(
+                        label="classification", 
+                        value=data.get("prediction", "unknown"), 
+                        confidence=safe_confidence 
+                    )
+                ]
+            )
+
+        print(
+            f"  [☁️  CLOUD REQUEST] Dispatching {len(windows)} HeAR windows "
+            f"({stats['windows_silent']} silent skipped, {stats['duration_s']}s recording)..."
         )
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        # --- THE FIX: SAFETY CLAMPING ---
-        # Ensures confidence is always within [0.0, 1.0] for Pydantic validation
-        raw_confidence = data.get("confidence", 0.0)
-        safe_confidence = max(0.0, min(1.0, float(raw_confidence)))
 
-        print(f"  [✅ AUDIO SUCCESS] Acoustic classification: {data.get('prediction', 'unknown')}")
+        async def classify(window: AudioWindow):
+            try:
+                # Idempotent: transient failures are retried with jittered backoff
+                return window, await with_retries(lambda: classify_audio_window(client, window), "acoustics")
+            except Exception as e:
+                print(f"  [⚠️ AUDIO] Window {window.start_s}-{window.end_s}s failed: {e!r}")
+                return window, None
+
+        results = await asyncio.gather(*(classify(window) for window in windows))
+        if windows and all(result is None for _, result in results):
+            raise RuntimeError(f"All {len(windows)} HeAR window requests failed")
+
+        claims, flags = aggregate_windows(list(results), stats)
+        print(f"  [✅ AUDIO SUCCESS] Acoustic classification: {claims[0].value} ({len(claims) - 1} segments)")
 
         return AgentReport(
             agent_name="acoustics",
-            model="HeAR (Cloud)",
-            claims=[
-                Claim(
-                    label="classification", 
-                    value=data.get("prediction", "unknown"), 
-                    confidence=safe_confidence 
-                )
-            ]
+            model="HeAR (Cloud, windowed)",
+            claims=claims,
+            quality_flags=flags,
         )
     except Exception as e:
         print(f"  [💥 AUDIO CRASH] Exception: {str(e)}")
@@ -350,11 +724,12 @@ async def call_audio_agent(client: httpx.AsyncClient, case_id: str) -> AgentRepo
 # -----------------------------
 # 3) UPDATED CLOUD CONSENSUS (main.py)
 # -----------------------------
-async def call_cloud_consensus(case_id: str, imaging_txt: str, audio_txt: str, history_txt: str):
+@instrument_stream("consensus")
+async def call_cloud_consensus(client: httpx.AsyncClient, case_id: str, imaging_txt: str, audio_txt: str, history_txt: str, avoid: Optional[Set[str]] = None):
     image_path = f"artifacts/runs/{case_id}/xray.jpg"
     
     if not os.path.exists(image_path):
-        yield json.dumps({"type": "error", "message": "Image Missing"})
+        yield SSEEvent.from_obj({"type": "error", "message": "Image Missing"})
         return
 
     payload = {
@@ -364,148 +739,867 @@ async def call_cloud_consensus(case_id: str, imaging_txt: str, audio_txt: str, h
     }
 
     try:
-        async with httpx.AsyncClient(timeout=None,  verify=False) as client:
-            with open(image_path, "rb") as f:
-                files = {"image": ("xray.jpg", f, "image/jpeg")}
-                
-                # 🟢 Use client.stream to pipe word-by-word thoughts to the UI
-                async with client.stream(
-                    "POST", 
-                    f"{API_URL}/agent/consensus", 
-                    data=payload, 
-                    files=files
-                ) as response:
-                    async for line in response.aiter_lines():
-                        if line.startswith("data: "):
-                            yield line.replace("data: ", "").strip()
+        image_path = await model_xray_path(image_path)
+
+        for attempt in range(AGENT_RETRY_ATTEMPTS + 1):
+            try:
+                # 🧭 Sticky routing: the backend that ran the vision agent already holds the x-ray
+                async with app.state.backends.lease("consensus", case_id, avoid) as backend:
+                    image_ref = await artifact_ref(client, backend, image_path, "image/jpeg")
+
+                    for ref in ([image_ref, None] if image_ref else [None]):
+                        with artifact_part("image", "xray.jpg", image_path, "image/jpeg", ref, payload) as files:
+                            # 🟢 Use client.stream to pipe word-by-word thoughts to the UI
+                            async with client.stream(
+                                "POST", 
+                                f"{backend.url}/agent/consensus", 
+                                data=payload, 
+                                files=files,
+                                timeout=CLIENT_SETTINGS.stream_request_timeout(),
+                            ) as response:
+                                app.state.backends.check(backend, "consensus", response)
+                                if ref and response.status_code in ARTIFACT_MISSING_STATUSES:
+                                    app.state.artifact_transfer.forget(backend.url, ref)
+                                    continue
+                                ARTIFACT_REFERENCES.inc(agent="consensus", mode="reference" if ref else "multipart")
+
+                                async for event in idle_guarded(iter_sse_events(response.aiter_bytes(), wrap_raw_lines=False), "consensus"):
+                                    yield event
+                        break
+                break
+            except Exception as e:
+                # A streamed call is only repeated when its connection was never made
+                if attempt >= AGENT_RETRY_ATTEMPTS or not connect_failed(e):
+                    raise
+                await retry_pause("consensus", attempt, e)
     except Exception as e:
-        yield json.dumps({"type": "error", "message": f"Cloud Adjudicator Bridge Failed: {str(e)}"})
+        yield SSEEvent.from_obj({"type": "error", "message": f"Cloud Adjudicator Bridge Failed: {str(e)}"})
 
 # -----------------------------
-# 4) MAIN FLOW
+# 4) CACHED AGENT CALLS
 # -----------------------------
+# Keys: SHA-256 of the artifact bytes + the exact prompt inputs + the model name.
+# Failed or partial results are never stored, so a flaky tunnel can't poison the cache.
 
-@app.post("/run")
-async def run_case(case: CaseInput):
-    async def stream_protocol():
-        def yield_json(data: dict):
-            return f"data: {json.dumps(data)}\n\n"
+def _report_cacheable(report: AgentReport) -> bool:
+    return not any(c.label in ("error", "extraction_status") for c in report.claims) and not any(
+        f.type == "partial_analysis" for f in report.quality_flags
+    )
+
+
+def _stream_cacheable(events: List[SSEEvent]) -> bool:
+    types = {event.type for event in events}
+    return "final" in types and "error" not in types
+
+
+def _encode_event(event: SSEEvent) -> str:
+    return event.data.decode("utf-8")
+
+
+def _decode_event(data: str) -> SSEEvent:
+    return SSEEvent(data.encode("utf-8"))
+
+
+def _is_error_event(event: SSEEvent) -> bool:
+    # call_vision_agent / call_cloud_consensus report failures as an error event
+    return event.type == "error"
+
+
+async def cached_vision_agent(cache: ResultCache, client: httpx.AsyncClient, case: CaseInput):
+    xray_digest = await cache.file_digest(f"artifacts/runs/{case.case_id}/xray.jpg")
+    key = make_key("vision", VISION_MODEL, preprocess_settings(), xray_digest, f"Clinical History: {case.clinical_note_text}") if xray_digest else None
+
+    async for event in cache.cached_stream(
+        key,
+        # The GPU slot is taken on whichever backend the call (or its hedged duplicate) is routed to
+        lambda: hedged_stream(
+            lambda avoid: call_vision_agent(client, case.case_id, case.clinical_note_text, avoid),
+            "imaging",
+            lambda avoid: app.state.backends.has_alternative("vision", avoid),
+            failed=_is_error_event,
+        ),
+        agent="imaging",
+        tags=[case.case_id],
+        bypass=not case.use_cache,
+        cacheable=_stream_cacheable,
+        encode=_encode_event,
+        decode=_decode_event,
+    ):
+        yield event
+
+
+async def cached_audio_agent(cache: ResultCache, client: httpx.AsyncClient, case: CaseInput, audio_path: Optional[str] = None) -> AgentReport:
+    audio_path = audio_path or f"artifacts/runs/{case.case_id}/audio.wav"
+    audio_digest = await cache.file_digest(audio_path)
+    key = make_key("audio", AUDIO_MODEL, windowing_settings(), audio_digest) if audio_digest else None
+
+    return await cache.cached_call(
+        key,
+        # Slots are taken per HeAR window inside the agent, not for the whole recording
+        lambda: call_audio_agent(client, case.case_id, audio_path),
+        encode=lambda report: report.dict(),
+        decode=lambda value: AgentReport(**value),
+        agent="acoustics",
+        tags=[case.case_id],
+        bypass=not case.use_cache,
+        cacheable=_report_cacheable,
+    )
+
+
+async def cached_history_agent(cache: ResultCache, limits: ConcurrencyLimits, client: ollama.AsyncClient, case: CaseInput) -> AgentReport:
+    key = make_key("history", HISTORY_MODEL, HISTORY_SYSTEM_PROMPT, HISTORY_FORMAT, note_settings(), case.clinical_note_text)
+
+    return await cache.cached_call(
+        key,
+        # Ollama slots are taken per note section inside the agent
+        lambda: extract_history_with_medgemma(client, case.clinical_note_text, cache, limits, [case.case_id], case.use_cache),
+        encode=lambda report: report.dict(),
+        decode=lambda value: AgentReport(**value),
+        agent="history",
+        tags=[case.case_id],
+        bypass=not case.use_cache,
+        cacheable=_report_cacheable,
+    )
+
+
+async def cached_cloud_consensus(cache: ResultCache, client: httpx.AsyncClient, case: CaseInput, imaging_txt: str, audio_txt: str, history_txt: str):
+    xray_digest = await cache.file_digest(f"artifacts/runs/{case.case_id}/xray.jpg")
+    key = make_key("consensus", CONSENSUS_MODEL, preprocess_settings(), xray_digest, imaging_txt, audio_txt, history_txt) if xray_digest else None
+
+    async for event in cache.cached_stream(
+        key,
+        lambda: hedged_stream(
+            lambda avoid: call_cloud_consensus(client, case.case_id, imaging_txt, audio_txt, history_txt, avoid),
+            "consensus",
+            lambda avoid: app.state.backends.has_alternative("consensus", avoid),
+            failed=_is_error_event,
+        ),
+        agent="consensus",
+        tags=[case.case_id],
+        bypass=not case.use_cache,
+        cacheable=_stream_cacheable,
+        encode=_encode_event,
+        decode=_decode_event,
+    ):
+        yield event
+
+# -----------------------------
+# 5) PRIOR STUDIES
+# -----------------------------
+# A case is compared against a prior x-ray / recording of the same patient: the ones
+# uploaded with it (xray_prior.jpg / audio_prior.wav, or image_prior_path /
+# audio_prior_path under artifacts/), else the patient's most recent earlier study.
+# Each study is analyzed once and recorded in the patient store (apps/api/patients.py);
+# every case also records its current studies, so a follow-up only pays for the new one.
+
+PRIOR_CONTEXT_HINT = "Prior study of the same patient, for interval comparison."
+
+
+def xray_model_key() -> str:
+    return make_key("vision", VISION_MODEL, preprocess_settings())
+
+
+def audio_model_key() -> str:
+    return make_key("audio", AUDIO_MODEL, windowing_settings())
+
+
+def _case_artifact(path: Optional[str], default: str) -> Optional[str]:
+    """A path from the request, confined to artifacts/ (it is read and sent upstream), else the default."""
+    if not path:
+        return default
+    root = os.path.realpath("artifacts")
+    if os.path.commonpath([root, os.path.realpath(path)]) != root:
+        print(f"  [⚠️ PRIOR] Ignoring {path}: prior studies must live under artifacts/")
+        return None
+    return path
+
+
+def prior_paths(case: CaseInput) -> Tuple[Optional[str], Optional[str]]:
+    return (
+        _case_artifact(case.image_prior_path, f"artifacts/runs/{case.case_id}/xray_prior.jpg"),
+        _case_artifact(case.audio_prior_path, f"artifacts/runs/{case.case_id}/audio_prior.wav"),
+    )
 
+
+def _vision_analysis(final: Dict[str, Any]) -> Dict[str, Any]:
+    return {"finding": final.get("finding", ""), "data_for_consensus": final.get("data_for_consensus", "")}
+
+
+def _audio_analysis(report: AgentReport) -> Optional[Dict[str, Any]]:
+    if not report.claims or not _report_cacheable(report):
+        return None
+    return {"classification": report.claims[0].value, "confidence": report.claims[0].confidence}
+
+
+async def analyze_prior_xray(cache: ResultCache, client: httpx.AsyncClient, case: CaseInput, path: str, digest: str) -> Optional[Dict[str, Any]]:
+    """Vision pass over a prior x-ray; only its final summary is kept (no thoughts reach the UI)."""
+    key = make_key("vision", VISION_MODEL, preprocess_settings(), digest, PRIOR_CONTEXT_HINT)
+    final = None
+    async for event in cache.cached_stream(
+        key,
+        lambda: call_vision_agent(client, case.case_id, PRIOR_CONTEXT_HINT, image_path=path),
+        agent="imaging",
+        tags=[case.case_id],
+        bypass=not case.use_cache,
+        cacheable=_stream_cacheable,
+        encode=_encode_event,
+        decode=_decode_event,
+    ):
+        if event.type == "final":
+            try:
+                final = event.json()
+            except ValueError:
+                pass
+    return _vision_analysis(final) if final else None
+
+
+async def prior_study(case: CaseInput, kind: str, digest: Optional[str], current_digest: Optional[str], analyze) -> Optional[Dict[str, Any]]:
+    """
+    The record of one prior study: reused from the patient store, analyzed now (and
+    stored), or, with no prior artifact, the patient's latest study other than this one.
+    """
+    store = app.state.patients
+    model_key = xray_model_key() if kind == "xray" else audio_model_key()
+    if digest is None or digest == current_digest:
+        if case.patient_id is None:
+            return None
+        record = await store.latest(case.patient_id, kind, model_key, exclude=current_digest)
+        return {**record, "source": "patient_history"} if record else None
+
+    if case.patient_id is not None and case.use_cache:
+        record = await store.get(case.patient_id, kind, digest, model_key)
+        if record is not None:
+            return {**record, "source": "patient_store"}
+
+    analysis = await analyze()
+    if analysis is None:
+        return None
+    if case.patient_id is not None:
+        record = await store.put(case.patient_id, kind, digest, model_key, case.case_id, analysis)
+    else:
+        record = {"kind": kind, "sha256": digest, "case_id": case.case_id, "analyzed_at": time.time(), "analysis": analysis}
+    return {**record, "source": "analyzed"}
+
+
+async def analyze_priors(cache: ResultCache, client: httpx.AsyncClient, case: CaseInput) -> Dict[str, Any]:
+    """{"imaging": record | None, "acoustics": record | None}; failures only cost the comparison."""
+    xray_path, audio_path = prior_paths(case)
+    xray_digest = await cache.file_digest(xray_path) if xray_path else None
+    audio_digest = await cache.file_digest(audio_path) if audio_path else None
+    current_xray = await cache.file_digest(f"artifacts/runs/{case.case_id}/xray.jpg")
+    current_audio = await cache.file_digest(f"artifacts/runs/{case.case_id}/audio.wav")
+
+    async def analyze_audio():
+        return _audio_analysis(await cached_audio_agent(cache, client, case, audio_path))
+
+    async def guarded(kind: str, call) -> Optional[Dict[str, Any]]:
         try:
-            yield yield_json({"type": "thought", "delta": f"🚀 Momo System: Initiating analysis for {case.case_id}..."})
-            
-            # 🛡️ Store the structured vision report here when it arrives in the stream
-            captured_vision_data = None
-
-            async with httpx.AsyncClient(timeout=300.0) as client:
-                yield yield_json({"type": "thought", "delta": "⚡ Launching Vision Agentic Loop..."})
-                
-                async for vision_chunk in call_vision_agent(client, case.case_id, case.clinical_note_text):
-                    # Forward the chunk to frontend immediately
-                    yield f"data: {vision_chunk}\n\n"
-                    
-                    # 🔍 Check if this chunk is the 'final' structured data from the vision agent
+            return await call
+        except Exception as e:
+            print(f"  [⚠️ PRIOR] {case.case_id}: prior {kind} unavailable ({e!r})")
+            return None
+
+    imaging, acoustics = await asyncio.gather(
+        guarded("xray", prior_study(
+            case, "xray", xray_digest, current_xray, lambda: analyze_prior_xray(cache, client, case, xray_path, xray_digest),
+        )),
+        guarded("audio", prior_study(case, "audio", audio_digest, current_audio, analyze_audio)),
+    )
+    return {"imaging": imaging, "acoustics": acoustics}
+
+
+async def record_current_studies(cache: ResultCache, case: CaseInput, vision_final: Optional[Dict[str, Any]], acoustics: AgentReport) -> None:
+    """Adds this case's own studies to the patient record, for the follow-ups that compare against them."""
+    store = app.state.patients
+    try:
+        xray_digest = await cache.file_digest(f"artifacts/runs/{case.case_id}/xray.jpg")
+        if xray_digest and vision_final:
+            await store.put(case.patient_id, "xray", xray_digest, xray_model_key(), case.case_id, _vision_analysis(vision_final))
+        audio_digest = await cache.file_digest(f"artifacts/runs/{case.case_id}/audio.wav")
+        analysis = _audio_analysis(acoustics)
+        if audio_digest and analysis:
+            await store.put(case.patient_id, "audio", audio_digest, audio_model_key(), case.case_id, analysis)
+    except OSError as e:
+        print(f"  [⚠️ PRIOR] Could not record the studies of {case.case_id}: {e!r}")
+
+
+def _study_label(record: Dict[str, Any]) -> str:
+    return f"case {record.get('case_id', '?')}, analyzed {time.strftime('%Y-%m-%d', time.localtime(record.get('analyzed_at', 0)))}"
+
+
+def interval_change(priors: Dict[str, Any], img_summary: str, aud_txt: str) -> Tuple[str, str, List[Dict[str, Any]]]:
+    """Consensus inputs extended with the prior findings, plus the interval-change evidence rows."""
+    evidence: List[Dict[str, Any]] = []
+
+    prior = priors.get("imaging")
+    if prior:
+        prior_summary = prior["analysis"].get("data_for_consensus") or prior["analysis"].get("finding", "")
+        evidence.append({
+            "type": "interval_change",
+            "modality": "imaging",
+            "prior": prior_summary,
+            "current": img_summary,
+            "prior_study": {"sha256": prior["sha256"], "case_id": prior.get("case_id"), "source": prior["source"]},
+        })
+        img_summary = (
+            f"{img_summary}\n\nPRIOR STUDY ({_study_label(prior)}): {fit_text(prior_summary, PROMPT_BUDGET_PRIOR_TOKENS).text}\n"
+            "Assess interval change against the prior study."
+        )
+
+    prior = priors.get("acoustics")
+    if prior:
+        prior_class = prior["analysis"].get("classification", "unknown")
+        change = "unchanged" if prior_class == aud_txt else "changed"
+        evidence.append({
+            "type": "interval_change",
+            "modality": "acoustics",
+            "prior": prior_class,
+            "current": aud_txt,
+            "change": change,
+            "prior_study": {"sha256": prior["sha256"], "case_id": prior.get("case_id"), "source": prior["source"]},
+        })
+        aud_txt = f"{aud_txt} (prior recording, {_study_label(prior)}: {prior_class}; {change})"
+
+    return img_summary, aud_txt, evidence
+
+# -----------------------------
+# 6) FAN-OUT STAGE
+# -----------------------------
+
+# Sentinel pushed by each agent producer once it has nothing more to emit
+_AGENT_DONE = object()
+
+
+async def fan_out_agents(cache: ResultCache, limits: ConcurrencyLimits, cloud_client: httpx.AsyncClient, ollama_client: ollama.AsyncClient, case: CaseInput):
+    """
+    Starts the vision, acoustic and context agents (and the prior-study lookup)
+    together and multiplexes their output through a single queue, in arrival order.
+    Yields (agent_name, item) where item is a vision SSEEvent, a finished
+    AgentReport for the acoustic/context agents, or the prior records ("prior").
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump_vision():
+        try:
+            async for event in cached_vision_agent(cache, cloud_client, case):
+                await queue.put(("imaging", event))
+        finally:
+            await queue.put(("imaging", _AGENT_DONE))
+
+    async def pump_report(agent_name: str, agent_call):
+        try:
+            await queue.put((agent_name, await agent_call))
+        finally:
+            await queue.put((agent_name, _AGENT_DONE))
+
+    tasks = [
+        asyncio.create_task(pump_vision()),
+        asyncio.create_task(pump_report("acoustics", cached_audio_agent(cache, cloud_client, case))),
+        asyncio.create_task(pump_report("history", cached_history_agent(cache, limits, ollama_client, case))),
+        asyncio.create_task(pump_report("prior", analyze_priors(cache, cloud_client, case))),
+    ]
+    pending = len(tasks)
+
+    try:
+        while pending:
+            agent_name, item = await queue.get()
+            if item is _AGENT_DONE:
+                pending -= 1
+                continue
+            yield agent_name, item
+
+        # Surface any producer crash to the caller instead of losing it in the task
+        for task in tasks:
+            task.result()
+    finally:
+        # 🛡️ Never leave agent calls running behind a closed stream
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+# -----------------------------
+# 7) MAIN FLOW
+# -----------------------------
+
+def _audio_text(acoustics: AgentReport) -> str:
+    return acoustics.claims[0].value if acoustics.claims else "No Data"
+
+
+def consensus_inputs(
+    priors: Dict[str, Any], img_summary: str, acoustics: AgentReport, history: AgentReport, record: bool = True
+) -> Tuple[str, str, str, List[Dict[str, Any]]]:
+    """
+    The adjudicator's imaging / audio / history texts, each within its token budget
+    (history claims ranked, [ACTIVE] first), plus the interval-change evidence rows.
+    """
+    imaging = fit_text(img_summary, PROMPT_BUDGET_IMAGING_TOKENS)
+    audio = fit_text(_audio_text(acoustics), PROMPT_BUDGET_AUDIO_TOKENS)
+    hist = fit_claims(history.claims, PROMPT_BUDGET_HISTORY_TOKENS)
+    if record:
+        for agent, budgeted in (("imaging", imaging), ("acoustics", audio), ("history", hist)):
+            PROMPT_TOKENS.observe(budgeted.tokens, agent=agent)
+            if budgeted.original_tokens > budgeted.tokens:
+                PROMPT_TOKENS_TRIMMED.inc(budgeted.original_tokens - budgeted.tokens, agent=agent)
+        if hist.dropped:
+            print(f"  [✂️ BUDGET] History: kept {len(history.claims) - hist.dropped}/{len(history.claims)} findings ({hist.tokens}/{hist.original_tokens} tokens)")
+    img_txt, aud_txt, evidence = interval_change(priors, imaging.text, audio.text)
+    return img_txt, aud_txt, hist.text, evidence
+
+
+async def case_pipeline(case: CaseInput, outcome: Optional[Dict[str, Any]] = None):
+    """
+    End-to-end analysis of one case as a stream of SSE frames.
+    When an outcome dict is given, it is filled with the final aggregate payload
+    so non-streaming callers (e.g. /run/batch) don't have to re-parse the stream.
+    """
+    def yield_json(data: dict):
+        return f"data: {json.dumps(data)}\n\n"
+
+    # ⏱️ Per-case timing breakdown: seconds since case start at which each stage completed
+    started = time.perf_counter()
+    timings: Dict[str, float] = {}
+
+    def mark(stage: str):
+        if stage not in timings:
+            timings[stage] = round(time.perf_counter() - started, 3)
+            PIPELINE_SECONDS.observe(timings[stage], stage=stage)
+
+    # 🔮 Provisional consensus started before the vision final (speculative mode only)
+    speculate = SPECULATIVE_CONSENSUS if case.speculative_consensus is None else case.speculative_consensus
+    speculation: Optional[SpeculativeConsensus] = None
+    speculation_attempts = 0
+    speculation_outcome = "not_started" if speculate else None
+    consensus_started: Optional[float] = None
+
+    try:
+        yield yield_json({"type": "thought", "delta": f"🚀 Momo System: Initiating analysis for {case.case_id}..."})
+        
+        # 🛡️ Store the structured vision report here when it arrives in the stream
+        captured_vision_data = None
+        reports: Dict[str, AgentReport] = {}
+        # 🕰️ Prior-study records for interval comparison (set once the lookup finishes)
+        priors: Optional[Dict[str, Any]] = None
+
+        cloud_client = app.state.cloud_client
+        ollama_client = app.state.ollama_client
+        cache = app.state.result_cache
+        limits = app.state.limits
+
+        yield yield_json({"type": "thought", "delta": "⚡ Launching Vision, Acoustic and Context agents in parallel..."})
+
+        stable_summary = considered_summary = None
+
+        async for agent_name, item in fan_out_agents(cache, limits, cloud_client, ollama_client, case):
+            if agent_name == "prior":
+                priors = item
+                mark("prior_done")
+                for modality, record in item.items():
+                    if record:
+                        origin = "analyzed" if record["source"] == "analyzed" else "reused from the patient record"
+                        yield yield_json({"type": "thought", "agent": modality, "delta": f"🕰️ Prior {modality} study {origin} ({_study_label(record)})."})
+            elif isinstance(item, AgentReport):
+                reports[agent_name] = item
+                mark(f"{agent_name}_done")
+                yield yield_json({"type": "thought", "agent": agent_name, "delta": f"✅ {agent_name.capitalize()} report ready."})
+            else:
+                mark("imaging_first_event")
+
+                # 🔍 Thoughts are relayed byte-for-byte; only control and phase events are decoded
+                if item.type == "final":
                     try:
-                        chunk_data = json.loads(vision_chunk)
-                        if chunk_data.get("type") == "final":
-                            captured_vision_data = chunk_data
-                            # if "claims" not in captured_vision_data:
-                            #     captured_vision_data["claims"] = [] # 🛡️ CRITICAL: Prevents UI .map() crashes
-                    except:
-                        continue 
-
-                yield yield_json({"type": "thought", "delta": "🎤 Processing Acoustic and Context streams..."})
-                
-                audio_task = call_audio_agent(client, case.case_id)
-                history_task = extract_history_with_medgemma(client, case.clinical_note_text)
-                
-                acoustics, history = await asyncio.gather(audio_task, history_task)
-                yield yield_json({"type": "thought", "delta": "✅ Evidence gathered. Entering Consensus Board..."})
-
-            # ⚖️ CONSENSUS BOARD 
-            # Use the actual 'data_for_consensus' we just captured from the vision stream
-            img_summary = captured_vision_data.get("data_for_consensus", "Imaging analysis complete.") if captured_vision_data else "Imaging analysis complete."
-            
-            aud_txt = acoustics.claims[0].value if acoustics.claims else "No Data"
-            hist_txt = ", ".join([c.value for c in history.claims])
+                        captured_vision_data = item.json()
+                        mark("imaging_done")
+                    except ValueError:
+                        pass
+                elif speculate:
+                    stable_summary = phase_summary(item) or stable_summary
+                yield item.frame(agent_name)
+
+            # 🔮 Start the provisional consensus, or restart it when a later phase diverges
+            if (
+                speculate
+                and stable_summary is not None
+                and stable_summary is not considered_summary
+                and captured_vision_data is None
+                and "acoustics" in reports
+                and "history" in reports
+                and priors is not None
+                and speculation_attempts < SPECULATION_MAX_ATTEMPTS
+            ):
+                considered_summary = stable_summary
+                if speculation is not None:
+                    if speculation.similarity(stable_summary) >= SPECULATION_MATCH_RATIO:
+                        continue
+                    await speculation.discard("superseded")
+                spec_summary = stable_summary
+                spec_img_txt, spec_aud_txt, spec_hist_txt, _ = consensus_inputs(
+                    priors, spec_summary, reports["acoustics"], reports["history"], record=False
+                )
+                speculation = SpeculativeConsensus(
+                    spec_summary,
+                    lambda: cached_cloud_consensus(cache, cloud_client, case, spec_img_txt, spec_aud_txt, spec_hist_txt),
+                )
+                speculation_attempts += 1
+                consensus_started = consensus_started or time.perf_counter()
+                mark("consensus_speculation_started")
+                yield yield_json({"type": "thought", "delta": "🔮 Vision summary is stable: starting a speculative consensus..."})
+
+        acoustics = reports["acoustics"]
+        history = reports["history"]
+        mark("evidence_ready")
+        yield yield_json({"type": "thought", "delta": "✅ Evidence gathered. Entering Consensus Board..."})
+
+        # ⚖️ CONSENSUS BOARD 
+        # Use the actual 'data_for_consensus' we just captured from the vision stream
+        img_summary = captured_vision_data.get("data_for_consensus", "Imaging analysis complete.") if captured_vision_data else "Imaging analysis complete."
+        
+        # 🕰️ Prior findings go to the adjudicator alongside the current ones
+        # ✂️ Each agent's evidence is fitted to its token budget
+        img_txt, aud_txt, hist_txt, interval_evidence = consensus_inputs(priors or {}, img_summary, acoustics, history)
+
+        consensus_stream = None
+        if speculation is not None:
+            similarity = speculation.similarity(img_summary)
+            if similarity >= SPECULATION_MATCH_RATIO:
+                speculation_outcome = "confirmed"
+                consensus_stream = speculation.confirm()
+                yield yield_json({"type": "thought", "delta": f"🎯 Speculative consensus confirmed (summary similarity {similarity:.2f})."})
+            else:
+                speculation_outcome = "rejected"
+                await speculation.discard("rejected")
+                yield yield_json({"type": "thought", "delta": f"↩️ Final imaging summary diverged (similarity {similarity:.2f}): re-issuing consensus..."})
+
+        yield yield_json({"type": "thought", "delta": "⚖️ Adjudicating evidence and resolving discrepancies..."})
 
-            yield yield_json({"type": "thought", "delta": "⚖️ Adjudicating evidence and resolving discrepancies..."})
+        if consensus_stream is None:
+            consensus_started = time.perf_counter()
+            consensus_stream = cached_cloud_consensus(cache, cloud_client, case, img_txt, aud_txt, hist_txt)
 
-            final_consensus_data = None
+        final_consensus_data = None
 
-            # 🟢 PIPE CONSENSUS THOUGHTS: Colab -> Local -> Frontend
-            async for consensus_chunk in call_cloud_consensus(case.case_id, img_summary, aud_txt, hist_txt):
+        # 🟢 PIPE CONSENSUS THOUGHTS: Colab -> Local -> Frontend
+        async for consensus_event in consensus_stream:
+            mark("consensus_first_event")
+            if consensus_event.type == "thought":
+                # Forward thoughts immediately to UI "Neural Stream"
+                yield consensus_event.frame()
+            elif consensus_event.type == "final":
+                # Capture the structured final result
                 try:
-                    chunk_data = json.loads(consensus_chunk)
-                    if chunk_data.get("type") == "thought":
-                        # Forward thoughts immediately to UI "Neural Stream"
-                        yield f"data: {consensus_chunk}\n\n"
-                    elif chunk_data.get("type") == "final":
-                        # Capture the structured final result
-                        final_consensus_data = chunk_data
-                except:
+                    final_consensus_data = consensus_event.json()
+                except ValueError:
                     continue
 
-            # 🛡️ Extract consensus fields safely
-            parsed = final_consensus_data.get("parsed", {}) if final_consensus_data else {}
-            score = parsed.get("score", 0.5)
-            reasoning = parsed.get("reasoning", "Consensus bridge disconnected.")
-            recommendation = parsed.get("recommendation", "Manual review required.")
-            audit_markdown = final_consensus_data.get("audit_markdown", "Audit unavailable.") if final_consensus_data else "Cloud error."
-            thought_process = final_consensus_data.get("thought_process", "") if final_consensus_data else "Adjudicator offline."
-            
-            # score, reasoning, recommendation, audit_markdown, thought_process = await asyncio.to_thread(
-            #     call_cloud_consensus, case.case_id, img_summary, aud_txt, hist_txt
-            # )
+        mark("consensus_done")
+
+        # 🛡️ Extract consensus fields safely
+        parsed = final_consensus_data.get("parsed", {}) if final_consensus_data else {}
+        score = parsed.get("score", 0.5)
+        reasoning = parsed.get("reasoning", "Consensus bridge disconnected.")
+        recommendation = parsed.get("recommendation", "Manual review required.")
+        audit_markdown = final_consensus_data.get("audit_markdown", "Audit unavailable.") if final_consensus_data else "Cloud error."
+        thought_process = final_consensus_data.get("thought_process", "") if final_consensus_data else "Adjudicator offline."
+        
+        # score, reasoning, recommendation, audit_markdown, thought_process = await asyncio.to_thread(
+        #     call_cloud_consensus, case.case_id, img_summary, aud_txt, hist_txt
+        # )
 
-            level = "high" if score > 0.7 else ("medium" if score > 0.4 else "low")
+        level = "high" if score > 0.7 else ("medium" if score > 0.4 else "low")
+        
+        if captured_vision_data:
+            # Start with the data we have
+            imaging_report = {
+                "agent_name": "imaging",
+                "model": "MedGemma-2b-Vision",
+                "analysis_status": "complete",
+                "internal_logic": captured_vision_data.get("finding", ""),
+                "draft_findings": captured_vision_data.get("agent_metadata", {}).get("plan", ""),
+                "supervisor_critique": captured_vision_data.get("agent_metadata", {}).get("recall_data", ""),
+            }
             
-            if captured_vision_data:
-                # Start with the data we have
-                imaging_report = {
-                    "agent_name": "imaging",
-                    "model": "MedGemma-2b-Vision",
-                    "analysis_status": "complete",
-                    "internal_logic": captured_vision_data.get("finding", ""),
-                    "draft_findings": captured_vision_data.get("agent_metadata", {}).get("plan", ""),
-                    "supervisor_critique": captured_vision_data.get("agent_metadata", {}).get("recall_data", ""),
-                }
-                
-                # 🛡️ ONLY add empty claims if captured_vision_data doesn't already have them
-                if "claims" in captured_vision_data:
-                    imaging_report["claims"] = captured_vision_data["claims"]
-                else:
-                    imaging_report["claims"] = []
+            # 🛡️ ONLY add empty claims if captured_vision_data doesn't already have them
+            if "claims" in captured_vision_data:
+                imaging_report["claims"] = captured_vision_data["claims"]
             else:
-                imaging_report = {
-                    "agent_name": "imaging",
-                    "model": "MedGemma-2b-Vision",
-                    "analysis_status": "failed",
-                    "claims": [], # Safety fallback for failed state
-                    "internal_logic": "No imaging data captured.",
-                    "draft_findings": "",
-                    "supervisor_critique": ""
-                }
-
-            # 🎁 FINAL AGGREGATE PAYLOAD
-            final_res = {
-                "type": "final",
-                "case_id": case.case_id,
-                "discrepancy_alert": {"level": level, "score": score, "summary": reasoning},
-                "recommended_data_actions": [recommendation],
-                "reasoning_trace": [f"Consensus Logic: {thought_process}"],
-                "agent_reports": [
-                    acoustics.dict(), 
-                    history.dict(),
-                    imaging_report  
-                ], 
-                "audit_markdown": audit_markdown,
-                "thought_process": thought_process 
+                imaging_report["claims"] = []
+        else:
+            imaging_report = {
+                "agent_name": "imaging",
+                "model": "MedGemma-2b-Vision",
+                "analysis_status": "failed",
+                "claims": [], # Safety fallback for failed state
+                "internal_logic": "No imaging data captured.",
+                "draft_findings": "",
+                "supervisor_critique": ""
             }
 
-            yield yield_json(final_res)
+        if case.patient_id is not None:
+            await record_current_studies(cache, case, captured_vision_data, acoustics)
 
-        except Exception as e:
-            yield yield_json({"type": "error", "message": str(e)})
+        # 🎁 FINAL AGGREGATE PAYLOAD
+        final_res = {
+            "type": "final",
+            "case_id": case.case_id,
+            "discrepancy_alert": {"level": level, "score": score, "summary": reasoning},
+            "recommended_data_actions": [recommendation],
+            "evidence_table": interval_evidence,
+            "reasoning_trace": [f"Consensus Logic: {thought_process}"],
+            "agent_reports": [
+                acoustics.dict(), 
+                history.dict(),
+                imaging_report  
+            ], 
+            "audit_markdown": audit_markdown,
+            "thought_process": thought_process,
+            "timings": timings,
+            "speculation": speculation_outcome,
+        }
+
+        mark("total")
+        app.state.results.save(final_res, case.patient_id)
+        RESULTS_STORED.inc()
+        if outcome is not None:
+            outcome.update(final_res)
+        yield yield_json(final_res)
+
+    except asyncio.CancelledError:
+        # 🛑 Every listener has gone: the agent tasks are torn down with this generator,
+        # closing the upstream streams. Estimate the GPU time that no longer gets spent.
+        now = time.perf_counter()
+        saved = sum(
+            expected_remaining_seconds(agent, now - started)
+            for agent in ("imaging", "acoustics")
+            if f"{agent}_done" not in timings
+        )
+        if "consensus_done" not in timings:
+            saved += expected_remaining_seconds("consensus", now - consensus_started if consensus_started else 0.0)
+        RUN_CANCELLATIONS.inc()
+        GPU_SECONDS_SAVED.inc(saved)
+        print(f"  [🛑 CANCELLED] {case.case_id}: no listeners left after {now - started:.1f}s (~{saved:.1f} GPU-s saved)")
+        raise
+    except Exception as e:
+        yield yield_json({"type": "error", "message": str(e)})
+    finally:
+        # 🛡️ A speculation must never outlive its case (errors, client disconnects)
+        if speculation is not None:
+            speculation.cancel()
+
+
+
+async def inflight_key(case: CaseInput) -> str:
+    """Identity of a case run: the request itself plus the hashes of its artifacts."""
+    cache = app.state.result_cache
+    xray_digest = await cache.file_digest(f"artifacts/runs/{case.case_id}/xray.jpg")
+    audio_digest = await cache.file_digest(f"artifacts/runs/{case.case_id}/audio.wav")
+    priors = [await cache.file_digest(path) if path else None for path in prior_paths(case)]
+    return make_key("run", case.dict(), xray_digest or "", audio_digest or "", *(digest or "" for digest in priors))
+
+
+def storage_case_ids(case: CaseInput) -> List[str]:
+    """The case directories a run reads: its own, plus other cases' uploads it uses as priors."""
+    runs_dir = os.path.realpath(RUNS_DIR)
+    case_ids = [case.case_id]
+    for path in prior_paths(case):
+        if path:
+            relative = os.path.relpath(os.path.realpath(path), runs_dir)
+            parts = relative.split(os.sep)
+            if len(parts) > 1 and parts[0] != os.pardir:
+                case_ids.append(parts[0])
+    return case_ids
+
+
+async def protected_case_pipeline(case: CaseInput, outcome: Dict[str, Any]):
+    """case_pipeline with every case directory it reads held back from the storage GC."""
+    pipeline = case_pipeline(case, outcome)
+    async with app.state.storage.protect(*storage_case_ids(case)):
+        try:
+            async for frame in pipeline:
+                yield frame
+        finally:
+            await pipeline.aclose()
+
+
+async def attach_case_run(case: CaseInput):
+    """Starts the case pipeline, or joins the identical run already in flight."""
+    flight, joined = app.state.inflight.attach(await inflight_key(case), lambda outcome: protected_case_pipeline(case, outcome))
+    if joined:
+        print(f"  [🔗 COALESCED] {case.case_id} is already running: attaching to its stream")
+    return flight
+
+
+async def attach_profiled_run(case: CaseInput):
+    """A fresh, never coalesced pipeline sampled by a RunProfiler (its profile frame precedes the final one)."""
+    key = f"{await inflight_key(case)}:profile:{uuid.uuid4().hex}"
+    flight, _ = app.state.inflight.attach(key, lambda outcome: profiled(protected_case_pipeline(case, outcome), RunProfiler(case.case_id)))
+    print(f"  [🔬 PROFILE] Profiling the pipeline of {case.case_id}")
+    return flight
+
+
+@app.post("/run")
+async def run_case(case: CaseInput, request: Request, profile: bool = False, x_profile: Optional[str] = Header(None)):
+    """
+    Streams the case analysis as SSE. With ?profile=1 (or X-Profile: 1) the run is
+    sampled and saved as folded stacks under PROFILE_DIR (see GET /debug/profiles).
+    """
+    if RUN_PROFILING and (profile or (x_profile or "").lower() in ("1", "true", "yes")):
+        flight = await attach_profiled_run(case)
+    else:
+        flight = await attach_case_run(case)
+    # 🛑 A closed tab releases its hold on the run; the last one out cancels the agents
+    frames = until_disconnected(flight.subscribe(), request.receive, lambda: CLIENT_DISCONNECTS.inc(endpoint="run"))
+    # Tiny token frames are batched into short time-bounded writes to the browser
+    return StreamingResponse(coalesce_frames(frames), media_type="text/event-stream")
+
+
+# -----------------------------
+# BACKGROUND JOBS
+# -----------------------------
+@app.post("/run/jobs", status_code=202)
+async def submit_case_job(case: CaseInput):
+    """
+    Runs the case as a background job that survives dropped connections.
+    An identical case already running as a job is returned instead of started twice.
+    """
+    key = await inflight_key(case)
+    job = app.state.jobs.running(key)
+    joined = job is not None
+    if not joined:
+        # The job holds its own flight reference, so the pipeline outlives every /run listener
+        flight = await attach_case_run(case)
+        job = app.state.jobs.start(case.case_id, key, flight.subscribe(), lambda: flight.outcome)
+        print(f"  [🗂️ JOB] {job.id} started for {case.case_id}")
+
+    return {
+        **job.info(),
+        "joined": joined,
+        "events_url": f"/run/{job.id}/events",
+        "result_url": f"/run/{job.id}/result",
+    }
+
+
+async def get_job_or_404(job_id: str):
+    job = await app.state.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job
+
+
+@app.get("/run/{job_id}")
+async def get_case_job(job_id: str):
+    return (await get_job_or_404(job_id)).info()
+
+
+@app.get("/run/{job_id}/events")
+async def stream_case_job(request: Request, job_id: str, last_event_id: Optional[str] = Header(None), after: Optional[int] = None):
+    """
+    SSE stream of a job's events. Each frame carries an 'id:' line; reconnecting with the
+    Last-Event-ID header (sent automatically by EventSource) or ?after=N resumes after it.
+    """
+    job = await get_job_or_404(job_id)
+    try:
+        resume_from = int(last_event_id) if last_event_id else (after or 0)
+    except ValueError:
+        resume_from = 0
+    # The job keeps running without this listener; only the follower is dropped
+    frames = until_disconnected(job.follow(resume_from), request.receive, lambda: CLIENT_DISCONNECTS.inc(endpoint="job_events"))
+    return StreamingResponse(coalesce_frames(frames), media_type="text/event-stream")
+
+
+@app.get("/run/{job_id}/result")
+async def get_case_job_result(job_id: str):
+    """The final ConsensusOutput of a finished job, served from its log (never re-executed)."""
+    job = await get_job_or_404(job_id)
+    if not job.done:
+        return JSONResponse(status_code=202, content=job.info())
+    if not job.outcome:
+        return JSONResponse(status_code=409, content=job.info())
+    try:
+        return ConsensusOutput(**job.outcome).dict()
+    except ValueError:
+        return job.outcome
+
+
+# -----------------------------
+# STORED RESULTS
+# -----------------------------
+@app.get("/results")
+async def list_results(
+    case_id: Optional[str] = None,
+    patient_id: Optional[str] = None,
+    level: Optional[str] = None,
+    min_score: Optional[float] = None,
+    max_score: Optional[float] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    cursor: Optional[int] = None,
+    limit: int = 50,
+):
+    """
+    Stored verdicts, newest first, filtered by case, patient, discrepancy level, score
+    range or time (epoch seconds). Pass next_cursor back as ?cursor= for the next page.
+    """
+    started = time.perf_counter()
+    page = await asyncio.to_thread(
+        app.state.results.query,
+        case_id=case_id,
+        patient_id=patient_id,
+        level=level,
+        min_score=min_score,
+        max_score=max_score,
+        since=since,
+        until=until,
+        before=cursor,
+        limit=max(1, min(limit, 500)),
+    )
+    RESULT_QUERY_SECONDS.observe(time.perf_counter() - started, endpoint="list")
+    return page
+
+
+async def stored_payload_or_404(result_id: Optional[int] = None, case_id: Optional[str] = None) -> Response:
+    started = time.perf_counter()
+    payload = await asyncio.to_thread(app.state.results.payload, result_id, case_id)
+    RESULT_QUERY_SECONDS.observe(time.perf_counter() - started, endpoint="get")
+    if payload is None:
+        raise HTTPException(status_code=404, detail=f"No stored result for {case_id or result_id}")
+    # Served as stored: no re-validation or re-serialization of the payload
+    return Response(content=payload, media_type="application/json")
+
+
+@app.get("/results/{result_id}")
+async def get_result(result_id: int):
+    """The full final payload recorded for one run."""
+    return await stored_payload_or_404(result_id=result_id)
+
+
+@app.get("/results/case/{case_id}")
+async def get_latest_case_result(case_id: str):
+    """The most recent stored verdict of a case, without re-running it."""
+    return await stored_payload_or_404(case_id=case_id)
+
+
+@app.post("/run/batch")
+async def run_case_batch(request: Request):
+    """
+    Runs many cases through the pipeline with bounded concurrency.
+    Body: JSON list of CaseInput records, {"cases": [...]}, or JSONL.
+    Streams NDJSON: one 'case_result' line per case as it completes, then a 'batch_summary'.
+    """
+    cases, invalid = parse_case_records(await request.body(), request.headers.get("content-type", ""))
+
+    async def run_one(case: CaseInput) -> Dict[str, Any]:
+        flight = await attach_case_run(case)
+        async for _ in flight.subscribe():
+            pass
+        outcome = flight.outcome
+        if not outcome:
+            return {"status": "error", "error": "Pipeline finished without a final consensus payload"}
+        return {"status": "ok", "result": outcome}
+
+    async def ndjson_stream():
+        for record in invalid:
+            yield json.dumps(record) + "\n"
+        async for record in run_batch(cases, run_one):
+            yield json.dumps(record) + "\n"
 
-    return StreamingResponse(stream_protocol(), media_type="text/event-stream")
+    print(f"  [📦 BATCH] Scheduling {len(cases)} cases ({len(invalid)} invalid records skipped)")
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
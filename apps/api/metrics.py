@@ -0,0 +1,318 @@
+import time
+import asyncio
+import functools
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# -----------------------------
+# PROMETHEUS METRICS
+# -----------------------------
+# A small in-process registry rendered in the Prometheus text format on /metrics.
+# Every update happens on the event loop, so no locking is needed.
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+BYTES_BUCKETS = (64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6)
+QUERY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+INF_LABEL = 'le="+Inf"'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def total(self, **match: str) -> float:
+        """Sum over every label set that matches the given subset of labels."""
+        idx = {name: i for i, name in enumerate(self.labelnames)}
+        return sum(
+            v for key, v in self._values.items()
+            if all(key[idx[name]] == str(val) for name, val in match.items())
+        )
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Gauge computed at scrape time from a callback (e.g. a ratio of two counters)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, fn: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.fn = fn
+
+    def samples(self) -> List[str]:
+        return [f"{self.name} {self.fn()}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def count(self, **labels: str) -> int:
+        return sum(self._counts.get(self._key(labels), []))
+
+    def mean(self, **labels: str) -> Optional[float]:
+        n = self.count(**labels)
+        return self._sums.get(self._key(labels), 0.0) / n if n else None
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            cumulative += counts[-1]
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, INF_LABEL)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {self._sums[key]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+AGENT_CALL_SECONDS = REGISTRY.register(Histogram(
+    "bridge_agent_call_seconds", "Wall-clock duration of upstream agent calls (full stream for streamed agents).", ["agent"]))
+STREAM_TTFT_SECONDS = REGISTRY.register(Histogram(
+    "bridge_stream_first_token_seconds", "Time from request to first streamed chunk.", ["agent"]))
+STREAM_CHUNKS = REGISTRY.register(Counter(
+    "bridge_stream_chunks_total", "Streamed chunks relayed from upstream agents.", ["agent"]))
+STREAM_CHUNK_RATE = REGISTRY.register(Histogram(
+    "bridge_stream_chunks_per_second", "Chunk throughput of a stream after its first chunk.", ["agent"], RATE_BUCKETS))
+PIPELINE_SECONDS = REGISTRY.register(Histogram(
+    "bridge_pipeline_stage_seconds", "Duration of /run pipeline stages measured from case start.", ["stage"]))
+UPLOAD_BYTES = REGISTRY.register(Counter(
+    "bridge_upload_bytes_total", "Bytes received by the upload endpoint.", ["artifact"]))
+UPLOAD_SIZE = REGISTRY.register(Histogram(
+    "bridge_upload_size_bytes", "Size of individual uploaded artifacts.", ["artifact"], BYTES_BUCKETS))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "bridge_cache_lookups_total", "Result cache lookups by agent and outcome.", ["agent", "result"]))
+NOTE_SECTIONS = REGISTRY.register(Counter(
+    "bridge_note_sections_total", "Clinical note sections by route (llm / rules_only fast path).", ["route"]))
+PROMPT_TOKENS = REGISTRY.register(Histogram(
+    "bridge_prompt_tokens", "Estimated tokens of each consensus input after budgeting, by agent.", ["agent"], TOKEN_BUCKETS))
+PROMPT_TOKENS_TRIMMED = REGISTRY.register(Counter(
+    "bridge_prompt_tokens_trimmed_total", "Estimated consensus input tokens cut by the prompt budget, by agent.", ["agent"]))
+PRIOR_STUDY_LOOKUPS = REGISTRY.register(Counter(
+    "bridge_prior_study_lookups_total", "Patient study store lookups by study kind and outcome (hit = analysis reused).", ["kind", "result"]))
+PREPROCESS_SECONDS = REGISTRY.register(Histogram(
+    "bridge_preprocess_seconds", "Time to build a model-ready derivative of an uploaded artifact.", ["artifact"]))
+PREPROCESS_BYTES = REGISTRY.register(Counter(
+    "bridge_preprocess_bytes_total", "Bytes before (original) and after (derivative) preprocessing.", ["kind"]))
+ARTIFACT_TRANSFERS = REGISTRY.register(Counter(
+    "bridge_artifact_transfers_total", "Artifact pushes to the GPU backend by result (pushed / already_held / unsupported / failed).", ["result"]))
+ARTIFACT_BYTES = REGISTRY.register(Counter(
+    "bridge_artifact_pushed_bytes_total", "Artifact bytes pushed to the GPU backend."))
+ARTIFACT_REFERENCES = REGISTRY.register(Counter(
+    "bridge_artifact_references_total", "Agent calls by how the artifact was sent (reference / multipart).", ["agent", "mode"]))
+BACKEND_ROUTED = REGISTRY.register(Counter(
+    "bridge_backend_routed_total", "Agent calls routed to each GPU backend.", ["backend", "agent"]))
+BACKEND_EJECTIONS = REGISTRY.register(Counter(
+    "bridge_backend_ejections_total", "Times a GPU backend was taken out of rotation after repeated failures.", ["backend"]))
+BREAKER_TRANSITIONS = REGISTRY.register(Counter(
+    "bridge_circuit_breaker_transitions_total", "Circuit breaker state changes per backend endpoint (open / closed).", ["breaker", "state"]))
+CIRCUIT_REJECTIONS = REGISTRY.register(Counter(
+    "bridge_circuit_rejections_total", "Agent calls failed fast because the endpoint's breaker was open on every backend.", ["agent"]))
+AGENT_RETRIES = REGISTRY.register(Counter(
+    "bridge_agent_retries_total", "Agent call attempts repeated after a transient failure.", ["agent"]))
+STREAM_STALLS = REGISTRY.register(Counter(
+    "bridge_stream_stalls_total", "Agent streams aborted for sending no event within the first-event / idle deadline.", ["agent"]))
+HEDGED_STREAMS = REGISTRY.register(Counter(
+    "bridge_hedged_streams_total", "Streams raced against a duplicate request, by which copy answered first.", ["agent", "outcome"]))
+BLOB_DEDUP_BYTES = REGISTRY.register(Counter(
+    "bridge_blob_dedup_bytes_total", "Uploaded bytes not stored again because an identical blob already existed."))
+STORAGE_GC_REMOVED = REGISTRY.register(Counter(
+    "bridge_storage_gc_cases_removed_total", "Case directories removed by the storage GC, by reason (age / size).", ["reason"]))
+STORAGE_GC_FREED_BYTES = REGISTRY.register(Counter(
+    "bridge_storage_gc_freed_bytes_total", "Bytes freed by the storage GC, by reason (age / size / unreferenced blobs).", ["reason"]))
+RESULTS_STORED = REGISTRY.register(Counter(
+    "bridge_results_stored_total", "Final case payloads queued for the result store."))
+RESULT_QUERY_SECONDS = REGISTRY.register(Histogram(
+    "bridge_result_query_seconds", "Result store read latency by endpoint (list / get).", ["endpoint"], QUERY_BUCKETS))
+WARMUP_RUNS = REGISTRY.register(Counter(
+    "bridge_warmup_runs_total", "Warmup and keep-alive calls per upstream component by result (ok / failed).", ["component", "result"]))
+WARMUP_SECONDS = REGISTRY.register(Histogram(
+    "bridge_warmup_seconds", "Duration of warmup calls (Ollama model load / backend connections and HeAR).", ["component"]))
+LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    "bridge_event_loop_lag_seconds", "How late the event loop heartbeat woke up (time other callbacks held the loop).", buckets=LAG_BUCKETS))
+LOOP_BLOCKS = REGISTRY.register(Counter(
+    "bridge_event_loop_blocks_total", "Event loop stalls longer than LOOP_BLOCK_THRESHOLD_MS (stacks on GET /debug/loop)."))
+PROFILES_CAPTURED = REGISTRY.register(Counter(
+    "bridge_run_profiles_total", "Per-request /run profiles written to PROFILE_DIR."))
+RUN_REQUESTS = REGISTRY.register(Counter(
+    "bridge_run_requests_total", "Case run requests that started a pipeline or joined an identical in-flight one.", ["mode"]))
+JOBS_TOTAL = REGISTRY.register(Counter(
+    "bridge_jobs_total", "Background case jobs by status (submitted / completed / failed / cancelled).", ["status"]))
+JOB_STREAM_RESUMES = REGISTRY.register(Counter(
+    "bridge_job_stream_resumes_total", "Job event streams resumed with Last-Event-ID."))
+CLIENT_DISCONNECTS = REGISTRY.register(Counter(
+    "bridge_client_disconnects_total", "Streaming clients that went away before their stream ended.", ["endpoint"]))
+RUN_CANCELLATIONS = REGISTRY.register(Counter(
+    "bridge_run_cancellations_total", "Case pipelines cancelled because every listener had gone away."))
+AGENT_CALLS_CANCELLED = REGISTRY.register(Counter(
+    "bridge_agent_calls_cancelled_total", "Upstream agent calls aborted mid-flight (connection closed).", ["agent"]))
+GPU_SECONDS_SAVED = REGISTRY.register(Counter(
+    "bridge_gpu_seconds_saved_total", "Estimated GPU backend seconds not spent thanks to cancelled pipelines (mean call duration minus time already spent)."))
+SPECULATION_OUTCOMES = REGISTRY.register(Counter(
+    "bridge_speculative_consensus_total", "Speculative consensus calls by outcome (confirmed / rejected / superseded).", ["outcome"]))
+SPECULATION_HEAD_START_SECONDS = REGISTRY.register(Histogram(
+    "bridge_speculative_consensus_head_start_seconds", "Time a confirmed speculative consensus ran before the vision final arrived."))
+
+
+def _cache_hit_ratio() -> float:
+    lookups = CACHE_LOOKUPS.total()
+    return CACHE_LOOKUPS.total(result="hit") / lookups if lookups else 0.0
+
+
+REGISTRY.register(Gauge("bridge_cache_hit_ratio", "Share of result cache lookups served from cache.", _cache_hit_ratio))
+
+
+def _speculation_hit_ratio() -> float:
+    settled = SPECULATION_OUTCOMES.value(outcome="confirmed") + SPECULATION_OUTCOMES.value(outcome="rejected")
+    return SPECULATION_OUTCOMES.value(outcome="confirmed") / settled if settled else 0.0
+
+
+REGISTRY.register(Gauge(
+    "bridge_speculative_consensus_hit_ratio", "Share of settled speculative consensus calls confirmed by the vision final.", _speculation_hit_ratio))
+
+
+# Filled by every storage stats pass (apps/api/storage.py)
+STORAGE_USAGE: Dict[str, float] = {"blob_bytes": 0.0, "case_bytes": 0.0}
+
+REGISTRY.register(Gauge(
+    "bridge_storage_blob_bytes", "Bytes held by the content-addressed blob store.", lambda: STORAGE_USAGE["blob_bytes"]))
+REGISTRY.register(Gauge(
+    "bridge_storage_case_bytes", "Bytes held only by case directories (derivatives, uploads from before dedup).", lambda: STORAGE_USAGE["case_bytes"]))
+
+
+# -----------------------------
+# AGENT INSTRUMENTATION
+# -----------------------------
+
+def expected_remaining_seconds(agent: str, elapsed: float) -> float:
+    """How much longer a call of this agent would typically have run (0 with no history)."""
+    mean = AGENT_CALL_SECONDS.mean(agent=agent)
+    return max(0.0, mean - elapsed) if mean else 0.0
+
+
+def instrument_call(agent: str):
+    """Decorator for request/response agents: records total call duration."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = await fn(*args, **kwargs)
+            except asyncio.CancelledError:
+                # Aborted calls are counted apart so they don't drag the duration down
+                AGENT_CALLS_CANCELLED.inc(agent=agent)
+                raise
+            AGENT_CALL_SECONDS.observe(time.perf_counter() - started, agent=agent)
+            return result
+        return wrapper
+    return decorator
+
+
+def instrument_stream(agent: str):
+    """Decorator for streamed agents: records time-to-first-chunk, duration, chunk count and chunk rate."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            first_at = None
+            chunks = 0
+            cancelled = False
+            try:
+                async for chunk in fn(*args, **kwargs):
+                    if first_at is None:
+                        first_at = time.perf_counter()
+                        STREAM_TTFT_SECONDS.observe(first_at - started, agent=agent)
+                    chunks += 1
+                    yield chunk
+            except (asyncio.CancelledError, GeneratorExit):
+                cancelled = True
+                raise
+            finally:
+                finished = time.perf_counter()
+                if cancelled:
+                    AGENT_CALLS_CANCELLED.inc(agent=agent)
+                else:
+                    AGENT_CALL_SECONDS.observe(finished - started, agent=agent)
+                STREAM_CHUNKS.inc(chunks, agent=agent)
+                if first_at is not None and finished > first_at:
+                    STREAM_CHUNK_RATE.observe(chunks / (finished - first_at), agent=agent)
+        return wrapper
+    return decorator
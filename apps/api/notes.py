@@ -0,0 +1,227 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from apps.api.settings import env_int
+
+# -----------------------------
+# CLINICAL NOTE PROCESSING
+# -----------------------------
+# Long discharge summaries made the history agent one huge, CPU-bound Ollama prompt.
+# Before extraction the note is cut into sections at its headers (HPI:, Vitals:, ...);
+# oversized sections are split at sentence boundaries, header-only stubs join the
+# section after them, and notes up to NOTE_SECTION_CHARS stay a single section. Every
+# section is extracted on its own (bounded by LIMIT_OLLAMA) and cached by its text, so
+# editing one part of a note only re-runs that part.
+# A regex pre-pass finds negations ("denies fever, chills") and abnormal vitals in
+# microseconds; a section made only of those never reaches the LLM. All findings are
+# merged with a set keyed on the normalized "[CATEGORY] text".
+
+NOTE_SECTION_CHARS = env_int("NOTE_SECTION_CHARS", 1500)
+NOTE_SECTION_MIN_CHARS = env_int("NOTE_SECTION_MIN_CHARS", 120)
+# Confidence of regex findings and of model findings that come without one
+RULE_CONFIDENCE = 0.9
+
+
+def note_settings() -> str:
+    """Part of the whole-note cache key: sectioning and rules change the merged result."""
+    return f"sections:{NOTE_SECTION_CHARS}/{NOTE_SECTION_MIN_CHARS}/rules:1/confidence:{RULE_CONFIDENCE}"
+
+
+_HEADER = re.compile(r"^[ \t]*[A-Z][A-Za-z0-9 /&(),'-]{1,40}:", re.M)
+_SENTENCE_END = re.compile(r"(?<=[.!?;])\s+|\n+")
+_PREFIX = re.compile(r"^\s*\[(ACTIVE|BASELINE|RISK|NEGATION)\]\s*", re.I)
+
+
+# --- Sectioning ------------------------------------------------------------
+
+def _split_long(block: str, limit: int) -> List[str]:
+    """Cuts a block into chunks of at most `limit` characters at sentence boundaries."""
+    chunks: List[str] = []
+    current = ""
+    for sentence in _SENTENCE_END.split(block):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        while len(sentence) > limit:
+            # A single run-on "sentence" longer than the limit is cut at a word boundary
+            cut = sentence.rfind(" ", 0, limit)
+            cut = cut if cut > 0 else limit
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if current and len(current) + 1 + len(sentence) > limit:
+            chunks.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_sections(note: str, max_chars: int = NOTE_SECTION_CHARS, min_chars: int = NOTE_SECTION_MIN_CHARS) -> List[str]:
+    """
+    The note as extraction sections. A section only depends on its own text and its
+    neighbours' sizes, so an edit doesn't shift the boundaries of the rest of the note.
+    """
+    note = note.strip()
+    if len(note) <= max_chars or max_chars <= 0:
+        return [note] if note else []
+
+    starts = sorted({0, *(m.start() for m in _HEADER.finditer(note))})
+    if len(starts) == 1:
+        # No headers: fall back to paragraphs
+        starts = sorted({0, *(m.end() for m in re.finditer(r"\n[ \t]*\n", note))})
+    blocks = [note[a:b].strip() for a, b in zip(starts, starts[1:] + [len(note)])]
+
+    sections: List[str] = []
+    pending = ""
+    for block in blocks:
+        if not block:
+            continue
+        block = f"{pending}\n{block}" if pending else block
+        pending = ""
+        if len(block) < min_chars:
+            pending = block
+            continue
+        sections.extend(_split_long(block, max_chars) if len(block) > max_chars else [block])
+    if pending:
+        if sections and len(sections[-1]) + len(pending) < max_chars:
+            sections[-1] = f"{sections[-1]}\n{pending}"
+        else:
+            sections.append(pending)
+    return sections
+
+
+# --- Rule pre-pass -----------------------------------------------------------
+
+_NEGATION = re.compile(r"\b(?:denies|denied|negative for|without|absence of|free of|no)\b\s+([^.;:\n]+)", re.I)
+_NEGATION_STOP = re.compile(r"\b(?:but|however|except|although|though|apart from)\b", re.I)
+_LIST_SPLIT = re.compile(r",|/|\bor\b|\band\b|\bnor\b", re.I)
+_QUALIFIERS = re.compile(r"^(?:any|recent|significant|known|history of|h/o|evidence of|signs of|symptoms of)\s+", re.I)
+
+_TEMP = re.compile(r"\b(?:t|temp|temperature|tmax)\s*[:=]?\s*(\d{2,3}(?:\.\d+)?)\s*°?\s*([fc])?\b", re.I)
+_HR = re.compile(r"\b(?:hr|heart rate|pulse)\s*[:=]?\s*(\d{2,3})\b", re.I)
+_RR = re.compile(r"\b(?:rr|resp(?:iratory)? rate)\s*[:=]?\s*(\d{1,2})\b", re.I)
+_BP = re.compile(r"\b(?:bp|blood pressure)\s*[:=]?\s*(\d{2,3})\s*/\s*(\d{2,3})\b", re.I)
+_SPO2 = re.compile(r"\b(?:spo2|sao2|o2 sat(?:uration)?|sats?|saturation)\s*[:=]?\s*(\d{2,3})\s*%", re.I)
+_VITAL_FILLER = re.compile(r"\b(?:vitals?|vital signs|signs|on|ra|room|air|bpm|mmhg|and|with|at|of|is|was|were|c|f|min|nc|l)\b|[^a-z]", re.I)
+
+
+@dataclass
+class RuleFindings:
+    findings: List[str] = field(default_factory=list)
+    # True when every sentence of the text was explained by the rules (no LLM needed)
+    covered: bool = False
+
+
+def _vital_findings(text: str) -> List[str]:
+    findings = []
+    for m in _TEMP.finditer(text):
+        value = float(m.group(1))
+        fahrenheit = (m.group(2) or ("f" if value > 50 else "c")).lower() == "f"
+        celsius = (value - 32) * 5 / 9 if fahrenheit else value
+        if celsius >= 38.0:
+            findings.append(f"[ACTIVE] Fever: temperature {m.group(1)}{'F' if fahrenheit else 'C'}")
+        elif celsius < 35.0:
+            findings.append(f"[ACTIVE] Hypothermia: temperature {m.group(1)}{'F' if fahrenheit else 'C'}")
+    for m in _HR.finditer(text):
+        rate = int(m.group(1))
+        if rate > 100:
+            findings.append(f"[ACTIVE] Tachycardia: heart rate {rate}")
+        elif rate < 50:
+            findings.append(f"[ACTIVE] Bradycardia: heart rate {rate}")
+    for m in _RR.finditer(text):
+        rate = int(m.group(1))
+        if rate > 20:
+            findings.append(f"[ACTIVE] Tachypnea: respiratory rate {rate}")
+        elif rate < 10:
+            findings.append(f"[ACTIVE] Bradypnea: respiratory rate {rate}")
+    for m in _BP.finditer(text):
+        systolic, diastolic = int(m.group(1)), int(m.group(2))
+        if systolic < 90:
+            findings.append(f"[ACTIVE] Hypotension: blood pressure {systolic}/{diastolic}")
+        elif systolic >= 140 or diastolic >= 90:
+            findings.append(f"[ACTIVE] Hypertension: blood pressure {systolic}/{diastolic}")
+    for m in _SPO2.finditer(text):
+        saturation = int(m.group(1))
+        if saturation < 94:
+            findings.append(f"[ACTIVE] Hypoxemia: SpO2 {saturation}%")
+    return findings
+
+
+def _negation_findings(text: str) -> List[str]:
+    findings = []
+    for m in _NEGATION.finditer(text):
+        scope = _NEGATION_STOP.split(m.group(1))[0]
+        for item in _LIST_SPLIT.split(scope):
+            item = _QUALIFIERS.sub("", item.strip(" -")).strip()
+            if 3 <= len(item) <= 60 and len(item.split()) <= 6:
+                findings.append(f"[NEGATION] {item}")
+    return findings
+
+
+def _sentence_covered(sentence: str) -> bool:
+    sentence = _HEADER.sub("", sentence, count=1).strip()
+    if not re.search(r"[a-z]{3,}", sentence, re.I):
+        return True
+    negation = _NEGATION.match(sentence)
+    if negation and not _NEGATION_STOP.search(negation.group(1)):
+        return True
+    residual = sentence
+    for pattern in (_TEMP, _HR, _RR, _BP, _SPO2):
+        residual = pattern.sub(" ", residual)
+    return residual != sentence and not re.search(r"[a-z]{3,}", _VITAL_FILLER.sub(" ", residual), re.I)
+
+
+def rule_findings(text: str) -> RuleFindings:
+    """Negations and abnormal vitals found by regex; `covered` says the LLM has nothing left to read."""
+    sentences = [s for s in _SENTENCE_END.split(text) if s.strip()]
+    return RuleFindings(
+        findings=_vital_findings(text) + _negation_findings(text),
+        covered=bool(sentences) and all(_sentence_covered(s) for s in sentences),
+    )
+
+
+# --- Merging -------------------------------------------------------------------
+
+def normalize_finding(raw: object) -> Optional[Tuple[str, str]]:
+    """'[ACTIVE] [ACTIVE]  Fever 102F.' -> ('ACTIVE', 'Fever 102F'); None without a known category."""
+    text = str(raw).strip()
+    m = _PREFIX.match(text)
+    if not m:
+        return None
+    category = m.group(1).upper()
+    # Models sometimes repeat the tag: keep the first, drop the rest
+    while m:
+        text = text[m.end():]
+        m = _PREFIX.match(text)
+    body = " ".join(text.split()).strip(" .;,")
+    return (category, body) if body else None
+
+
+def merge_findings(groups: Iterable[Iterable[Union[str, Tuple[str, float]]]], min_chars: int = 10) -> List[Tuple[str, float]]:
+    """
+    (finding, confidence) pairs in first-seen order, deduplicated on category +
+    case/punctuation-insensitive text; a duplicate keeps the higher confidence.
+    Plain strings count as RULE_CONFIDENCE.
+    """
+    seen: Dict[Tuple[str, str], Tuple[str, float]] = {}
+    for group in groups:
+        for raw in group:
+            raw, confidence = (raw[0], float(raw[1])) if isinstance(raw, (list, tuple)) else (raw, RULE_CONFIDENCE)
+            normalized = normalize_finding(raw)
+            if normalized is None:
+                continue
+            category, body = normalized
+            finding = f"[{category}] {body}"
+            key = (category, re.sub(r"[^a-z0-9%/.]+", " ", body.lower()).strip())
+            if len(finding) <= min_chars:
+                continue
+            if key not in seen:
+                seen[key] = (finding, confidence)
+            elif confidence > seen[key][1]:
+                seen[key] = (seen[key][0], confidence)
+    return list(seen.values())
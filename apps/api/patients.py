@@ -0,0 +1,99 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+from typing import Any, Dict, List, Optional
+
+from apps.api.settings import env_str
+from apps.api.metrics import PRIOR_STUDY_LOOKUPS
+
+# -----------------------------
+# PATIENT STUDY STORE
+# -----------------------------
+# Longitudinal comparison needs the analysis of every earlier study of a patient.
+# Each analyzed study (the current one of every case, and any prior sent for comparison)
+# is recorded once under artifacts/patients/{patient_id}/{kind}/{sha256}.json, keyed by
+# the study's bytes and the model identity that produced it. A follow-up case finds its
+# prior here and only pays for the new study; without an explicit prior, the patient's
+# most recent earlier study is used. Unlike the result cache, records never expire.
+
+PATIENT_DIR = env_str("PATIENT_DIR", "artifacts/patients")
+
+STUDY_KINDS = ("xray", "audio")
+
+_SAFE_ID = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9._-]{0,63}$")
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.part"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class PatientStore:
+    """Analyses of a patient's studies on disk, one JSON record per study."""
+
+    def __init__(self, root: str = PATIENT_DIR):
+        self.root = root
+
+    def _dir(self, patient_id: str) -> str:
+        # Identifiers that aren't safe as a directory name are stored under their hash
+        name = patient_id if _SAFE_ID.match(patient_id) else hashlib.sha256(patient_id.encode()).hexdigest()
+        return os.path.join(self.root, name)
+
+    def _path(self, patient_id: str, kind: str, sha256: str) -> str:
+        if kind not in STUDY_KINDS or not _SHA256.match(sha256):
+            raise ValueError(f"Invalid study reference {kind}/{sha256}")
+        return os.path.join(self._dir(patient_id), kind, f"{sha256}.json")
+
+    async def get(self, patient_id: str, kind: str, sha256: str, model_key: str) -> Optional[Dict[str, Any]]:
+        """The stored analysis of one study, unless it was produced by another model or setting."""
+        record = await asyncio.to_thread(_read_json, self._path(patient_id, kind, sha256))
+        hit = record is not None and record.get("model_key") == model_key
+        PRIOR_STUDY_LOOKUPS.inc(kind=kind, result="hit" if hit else "miss")
+        return record if hit else None
+
+    async def put(self, patient_id: str, kind: str, sha256: str, model_key: str, case_id: str, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        record = {
+            "kind": kind,
+            "sha256": sha256,
+            "case_id": case_id,
+            "model_key": model_key,
+            "analyzed_at": time.time(),
+            "analysis": analysis,
+        }
+        await asyncio.to_thread(_write_json, self._path(patient_id, kind, sha256), record)
+        return record
+
+    def _records(self, patient_id: str, kind: str) -> List[Dict[str, Any]]:
+        kind_dir = os.path.join(self._dir(patient_id), kind)
+        try:
+            names = [name for name in os.listdir(kind_dir) if name.endswith(".json")]
+        except FileNotFoundError:
+            return []
+        records = [_read_json(os.path.join(kind_dir, name)) for name in names]
+        return sorted((r for r in records if r), key=lambda r: r.get("analyzed_at", 0))
+
+    async def latest(self, patient_id: str, kind: str, model_key: str, exclude: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """The most recently analyzed study of this kind other than `exclude` (the current one)."""
+        records = await asyncio.to_thread(self._records, patient_id, kind)
+        for record in reversed(records):
+            if record.get("sha256") != exclude and record.get("model_key") == model_key:
+                return record
+        return None
+
+    async def studies(self, patient_id: str) -> Dict[str, List[Dict[str, Any]]]:
+        return {kind: await asyncio.to_thread(self._records, patient_id, kind) for kind in STUDY_KINDS}
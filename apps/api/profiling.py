@@ -0,0 +1,373 @@
+import gc
+import os
+import json
+import re
+import sys
+import time
+import asyncio
+import inspect
+import itertools
+import threading
+import traceback
+import contextvars
+import weakref
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional
+
+from apps.api.settings import env_bool, env_float, env_int, env_str
+from apps.api.metrics import LOOP_BLOCKS, LOOP_LAG_SECONDS, PROFILES_CAPTURED
+from apps.api.sse import frame_payload, has_agent, sniff_type
+
+# -----------------------------
+# EVENT LOOP LAG & RUN PROFILING
+# -----------------------------
+# Synchronous work slipped into async handlers (file IO, large json.dumps / .dict()
+# calls) stalls every SSE stream sharing the loop, and nothing showed where.
+#
+# Lag monitor: a heartbeat coroutine wakes every LOOP_LAG_INTERVAL_MS and records how
+# late it woke (bridge_event_loop_lag_seconds). A watchdog thread checks the heartbeat.
+# When the loop has not come back for LOOP_BLOCK_THRESHOLD_MS, the thread captures the
+# loop thread's stack while it is still blocked, so the offending callback is caught
+# in the act. Once the loop resumes, the block is logged with its duration and kept
+# for GET /debug/loop.
+#
+# Run profiling: /run?profile=1 (or an X-Profile: 1 header) starts a fresh pipeline
+# that a sampling thread watches every PROFILE_INTERVAL_MS. The profile is
+# async-aware: only the pipeline's own tasks are sampled, and a task factory tags
+# every task created inside the run. The loop thread's stack is recorded while one of
+# them is running ([running]). The coroutine chain of every suspended task is recorded
+# as well ([waiting]), which shows where the run spends wall-clock time waiting on
+# upstreams. Samples are written as folded stacks to PROFILE_DIR, ready for
+# flamegraph.pl or speedscope.
+
+LOOP_MONITOR = env_bool("LOOP_MONITOR", True)
+LOOP_LAG_INTERVAL_MS = env_int("LOOP_LAG_INTERVAL_MS", 50)
+LOOP_BLOCK_THRESHOLD_MS = env_int("LOOP_BLOCK_THRESHOLD_MS", 100)
+LOOP_BLOCKS_KEPT = env_int("LOOP_BLOCKS_KEPT", 50)
+RUN_PROFILING = env_bool("RUN_PROFILING", True)
+PROFILE_INTERVAL_MS = env_float("PROFILE_INTERVAL_MS", 5.0)
+PROFILE_DIR = env_str("PROFILE_DIR", "artifacts/profiles")
+
+PROFILE_NAME = re.compile(r"^[A-Za-z0-9_.-]+\.folded$")
+_REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+_MAX_DEPTH = 128
+# Per-process sequence in profile names: runs of one case can finish in the same second
+_PROFILE_SEQ = itertools.count(1)
+
+
+def _location(filename: str) -> str:
+    """Repo files relative to the repo, libraries from their package directory on."""
+    if filename.startswith(_REPO_ROOT):
+        return os.path.relpath(filename, _REPO_ROOT)
+    parts = filename.replace("\\", "/").split("/")
+    for marker in ("site-packages", "dist-packages"):
+        if marker in parts:
+            return "/".join(parts[parts.index(marker) + 1:])
+    return "/".join(parts[-2:])
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({_location(code.co_filename)}:{code.co_firstlineno})"
+
+
+# --- Lag monitor -----------------------------------------------------------------
+
+class LoopMonitor:
+    """Measures event loop lag and captures the stack of callbacks that block it."""
+
+    def __init__(
+        self,
+        interval_ms: int = LOOP_LAG_INTERVAL_MS,
+        threshold_ms: int = LOOP_BLOCK_THRESHOLD_MS,
+        keep: int = LOOP_BLOCKS_KEPT,
+        enabled: bool = LOOP_MONITOR,
+    ):
+        self.interval_s = interval_ms / 1000.0
+        self.threshold_s = threshold_ms / 1000.0
+        self.enabled = enabled
+        self.blocks: deque = deque(maxlen=max(1, keep))
+        self.max_lag_s = 0.0
+        self._beat = time.monotonic()
+        # Stack captured by the watchdog during the current block, consumed by the heartbeat
+        self._pending: Optional[Dict[str, Any]] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+
+    async def _heartbeat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval_s
+            await asyncio.sleep(self.interval_s)
+            now = time.monotonic()
+            self._beat = now
+            lag = max(0.0, now - expected)
+            LOOP_LAG_SECONDS.observe(lag)
+            self.max_lag_s = max(self.max_lag_s, lag)
+
+            pending, self._pending = self._pending, None
+            if pending is not None:
+                pending["blocked_ms"] = round(lag * 1000, 1)
+                self.blocks.append(pending)
+                LOOP_BLOCKS.inc()
+                print(f"  [🐢 LOOP] Event loop blocked for {pending['blocked_ms']:.0f}ms in {pending['where']}")
+
+    def _watch(self) -> None:
+        # Checked several times per threshold so a block is caught while it is still running
+        poll_s = max(0.005, min(self.interval_s, self.threshold_s) / 4)
+        while not self._stop.wait(poll_s):
+            stalled = time.monotonic() - self._beat - self.interval_s
+            if stalled >= self.threshold_s and self._pending is None:
+                self._pending = self._capture()
+
+    def _capture(self) -> Dict[str, Any]:
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = traceback.extract_stack(frame)[-40:] if frame is not None else []
+        # The innermost frame in the bridge's own code is usually the culprit (or its caller)
+        own = [fs for fs in stack if fs.filename.startswith(_REPO_ROOT)]
+        culprit = (own or stack or [None])[-1]
+        return {
+            "at": time.time(),
+            "where": f"{culprit.name} ({_location(culprit.filename)}:{culprit.lineno})" if culprit else "unknown",
+            "stack": [f"{_location(fs.filename)}:{fs.lineno} in {fs.name}: {fs.line or ''}".rstrip(": ") for fs in stack],
+        }
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "interval_ms": self.interval_s * 1000,
+            "threshold_ms": self.threshold_s * 1000,
+            "max_lag_ms": round(self.max_lag_s * 1000, 1),
+            "blocks_total": int(LOOP_BLOCKS.value()),
+            # Newest first
+            "blocks": list(reversed(self.blocks)),
+        }
+
+
+# --- Run profiler --------------------------------------------------------------------
+
+# The profiler of the run whose context a task is created in
+_ACTIVE_PROFILE: contextvars.ContextVar[Optional["RunProfiler"]] = contextvars.ContextVar("active_profile", default=None)
+
+
+class _TaskTagger:
+    """
+    Task factory that adds tasks created inside a profiled run to its profiler. Installed
+    while at least one run is profiled, on top of whatever factory was set before (which
+    still creates the tasks), and swapped back out when the last profiled run ends.
+    """
+
+    def __init__(self):
+        self.users = 0
+        self.previous = None
+
+    def __call__(self, loop: asyncio.AbstractEventLoop, coro, **kwargs) -> asyncio.Task:
+        task = self.previous(loop, coro, **kwargs) if self.previous is not None else asyncio.Task(coro, loop=loop, **kwargs)
+        context = kwargs.get("context")
+        profiler = context.get(_ACTIVE_PROFILE) if context is not None else _ACTIVE_PROFILE.get()
+        if profiler is not None:
+            profiler.tasks.add(task)
+        return task
+
+    def acquire(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self.users == 0:
+            self.previous = loop.get_task_factory()
+            loop.set_task_factory(self)
+        self.users += 1
+
+    def release(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.users -= 1
+        if self.users == 0:
+            # Someone else may have replaced the factory since: leave theirs in place
+            if loop.get_task_factory() is self:
+                loop.set_task_factory(self.previous)
+            self.previous = None
+
+
+_TASK_TAGGER = _TaskTagger()
+
+
+def _await_chain(awaitable: Any) -> List[str]:
+    """Frames of a suspended coroutine / async generator chain, outermost first."""
+    labels: List[str] = []
+    while awaitable is not None and len(labels) < _MAX_DEPTH:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "ag_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            kind = type(awaitable).__name__
+            if kind in ("async_generator_asend", "async_generator_athrow"):
+                # __anext__() of an async generator: continue into the generator itself
+                awaitable = next((ref for ref in gc.get_referents(awaitable) if inspect.isasyncgen(ref)), None)
+                continue
+            if isinstance(awaitable, asyncio.Task):
+                labels.append(f"[await task {awaitable.get_name()}]")
+            elif kind not in ("coroutine", "async_generator", "generator"):
+                labels.append(f"[await {kind}]")
+            break
+        labels.append(_frame_label(frame))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "ag_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    return labels
+
+
+def _running_stack(frame) -> List[str]:
+    """The loop thread's stack below the asyncio machinery, outermost first."""
+    frames = []
+    while frame is not None and len(frames) < _MAX_DEPTH:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    # Everything up to the Handle._run that stepped the task is the loop itself
+    start = 0
+    for i, f in enumerate(frames):
+        if f.f_code.co_filename.endswith(os.path.join("asyncio", "events.py")) and f.f_code.co_name == "_run":
+            start = i + 1
+    return [_frame_label(f) for f in frames[start:]]
+
+
+class RunProfiler:
+    """Samples the tasks of one case pipeline from a background thread into folded stacks."""
+
+    def __init__(self, case_id: str, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.case_id = case_id
+        self.interval_s = interval_ms / 1000.0
+        self.tasks: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.running_samples = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._started = 0.0
+        self._elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Called from inside the pipeline task: it and every task it creates are sampled."""
+        self._loop = asyncio.get_running_loop()
+        _TASK_TAGGER.acquire(self._loop)
+        _ACTIVE_PROFILE.set(self)
+        self.tasks.add(asyncio.current_task())
+        self._loop_thread = threading.get_ident()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample_loop, name=f"profile-{self.case_id}", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        """Restores the task factory and joins the sampler thread (off the loop)."""
+        self._elapsed = time.perf_counter() - self._started
+        if self._loop is not None:
+            _TASK_TAGGER.release(self._loop)
+        self._stop.set()
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+
+    def _sample_loop(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                self._sample()
+            except RuntimeError:
+                # A task set changed size mid-iteration: skip this tick
+                continue
+
+    def _sample(self) -> None:
+        running = asyncio.current_task(self._loop)
+        self.sample_count += 1
+        for task in list(self.tasks):
+            if task.done():
+                continue
+            if task is running:
+                frame = sys._current_frames().get(self._loop_thread)
+                stack = ["[running]", *_running_stack(frame)]
+                self.running_samples += 1
+            else:
+                stack = ["[waiting]", *_await_chain(task.get_coro())]
+            self.samples[";".join(label.replace(";", ",") for label in stack)] += 1
+
+    def save(self, directory: str = PROFILE_DIR) -> Dict[str, Any]:
+        """Writes the folded stacks (blocking); returns where and what was captured."""
+        os.makedirs(directory, exist_ok=True)
+        safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", self.case_id)[:64]
+        name = f"{safe_id}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_PROFILE_SEQ)}.folded"
+        path = os.path.join(directory, name)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return {
+            "name": name,
+            "path": path,
+            "duration_s": round(self._elapsed, 3),
+            "interval_ms": self.interval_s * 1000,
+            "ticks": self.sample_count,
+            "running_samples": self.running_samples,
+            "stacks": len(self.samples),
+        }
+
+
+def _is_case_final(frame: Any) -> bool:
+    """The pipeline's closing payload; an agent's own final event carries a top-level "agent" key."""
+    payload = frame_payload(frame.encode() if isinstance(frame, str) else bytes(frame))
+    return sniff_type(payload) == "final" and not has_agent(payload)
+
+
+async def profiled(frames, profiler: RunProfiler):
+    """
+    Runs a pipeline's frame stream under the profiler. The `profile` SSE frame goes out
+    just before the pipeline's `final` frame, which clients treat as the end of the stream.
+    """
+    held: List[Any] = []
+    profiler.start()
+    try:
+        async for frame in frames:
+            if held or _is_case_final(frame):
+                held.append(frame)
+            else:
+                yield frame
+    finally:
+        await profiler.stop()
+    info = await asyncio.to_thread(profiler.save)
+    PROFILES_CAPTURED.inc()
+    print(f"  [🔬 PROFILE] {profiler.case_id}: {info['ticks']} ticks over {info['duration_s']:.1f}s -> {info['path']}")
+    yield f"data: {json.dumps({'type': 'profile', **info})}\n\n"
+    for frame in held:
+        yield frame
+
+
+def list_profiles(directory: str = PROFILE_DIR) -> List[Dict[str, Any]]:
+    """Saved profiles, newest first (blocking)."""
+    try:
+        names = [name for name in os.listdir(directory) if PROFILE_NAME.match(name)]
+    except FileNotFoundError:
+        return []
+    entries = []
+    for name in names:
+        st = os.stat(os.path.join(directory, name))
+        entries.append({"name": name, "bytes": st.st_size, "created_at": st.st_mtime})
+    return sorted(entries, key=lambda entry: entry["created_at"], reverse=True)
+
+
+def read_profile(name: str, directory: str = PROFILE_DIR) -> Optional[str]:
+    """A saved profile's folded stacks, or None for unknown (or unsafe) names (blocking)."""
+    if not PROFILE_NAME.match(name):
+        return None
+    try:
+        with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,330 @@
+import time
+import random
+import asyncio
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Set, Tuple, TypeVar
+
+import httpx
+
+from apps.api.settings import env_bool, env_float, env_int
+from apps.api.metrics import AGENT_RETRIES, BREAKER_TRANSITIONS, HEDGED_STREAMS, STREAM_STALLS
+
+# -----------------------------
+# CLOUD CALL RESILIENCE
+# -----------------------------
+# The Colab tunnel drops, stalls and restarts. Around every cloud agent call:
+#   * circuit breakers per backend and endpoint: after BREAKER_FAILURES consecutive
+#     failures the endpoint fails fast for BREAKER_OPEN_S, then lets one trial through
+#   * jittered exponential retries: idempotent calls (HeAR) on any transient error,
+#     streamed calls only when the connection was never made (nothing reached the GPU)
+#   * idle guards on streams: a deadline for the first event and for each gap after
+#     it, counted in SSE events so raw keep-alive bytes don't keep a dead stream open
+#   * optional hedging: when a stream's first event is later than the recent
+#     HEDGE_PERCENTILE of first-event latencies, a duplicate goes to another backend
+#     and whichever answers first wins (the loser is cancelled)
+
+T = TypeVar("T")
+
+BREAKER_FAILURES = env_int("BREAKER_FAILURES", 5)
+BREAKER_OPEN_S = env_float("BREAKER_OPEN_S", 20.0)
+AGENT_RETRY_ATTEMPTS = env_int("AGENT_RETRY_ATTEMPTS", 2)
+AGENT_RETRY_BASE_MS = env_int("AGENT_RETRY_BASE_MS", 250)
+AGENT_RETRY_MAX_MS = env_int("AGENT_RETRY_MAX_MS", 4000)
+STREAM_FIRST_EVENT_TIMEOUT_S = env_float("STREAM_FIRST_EVENT_TIMEOUT_S", 180.0)
+STREAM_IDLE_TIMEOUT_S = env_float("STREAM_IDLE_TIMEOUT_S", 60.0)
+HEDGE_STREAMS = env_bool("HEDGE_STREAMS", False)
+HEDGE_PERCENTILE = env_float("HEDGE_PERCENTILE", 95.0)
+HEDGE_MIN_SAMPLES = env_int("HEDGE_MIN_SAMPLES", 20)
+
+# Statuses worth another attempt: overload and gateway errors from the tunnel
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an endpoint whose breaker is open on every backend."""
+
+
+class StreamStalled(TimeoutError):
+    """An agent stream produced no event within its first-event or idle deadline."""
+
+
+# -----------------------------
+# CIRCUIT BREAKER
+# -----------------------------
+class CircuitBreaker:
+    """closed -> open after N consecutive failures -> half_open (one trial) after a cool-down."""
+
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, open_s: float = BREAKER_OPEN_S):
+        self.name = name
+        self.threshold = failures
+        self.open_s = open_s
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.open_s else "open"
+
+    def available(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self._trial)
+
+    def retry_after(self) -> float:
+        return 0.0 if self.opened_at is None else max(0.0, self.open_s - (time.monotonic() - self.opened_at))
+
+    def begin(self) -> None:
+        if self.state == "half_open":
+            self._trial = True
+
+    def end(self) -> None:
+        """Releases a trial that finished without a verdict (cancelled, non-HTTP error)."""
+        self._trial = False
+
+    def success(self) -> None:
+        if self.opened_at is not None:
+            self._transition("closed")
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self._trial or (self.opened_at is None and self.failures >= self.threshold):
+            # A failed trial re-opens for another full cool-down
+            self.opened_at = time.monotonic()
+            self._transition("open")
+        self._trial = False
+
+    def _transition(self, state: str) -> None:
+        BREAKER_TRANSITIONS.inc(breaker=self.name, state=state)
+        print(f"  [⚡ BREAKER] {self.name} -> {state}")
+
+
+# -----------------------------
+# RETRIES
+# -----------------------------
+def retryable(error: BaseException) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUSES
+    return isinstance(error, (httpx.TransportError, StreamStalled))
+
+
+def connect_failed(error: BaseException) -> bool:
+    """True when the request never reached the backend, so even a streamed call is safe to repeat."""
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+async def retry_pause(agent: str, attempt: int, error: BaseException) -> None:
+    """Full-jitter exponential backoff before attempt + 1."""
+    cap = min(AGENT_RETRY_MAX_MS, AGENT_RETRY_BASE_MS * 2 ** attempt) / 1000.0
+    delay = random.uniform(0, cap)
+    AGENT_RETRIES.inc(agent=agent)
+    print(f"  [🔁 RETRY] {agent} attempt {attempt + 1} failed ({error!r}): retrying in {delay:.2f}s")
+    await asyncio.sleep(delay)
+
+
+async def with_retries(call: Callable[[], Awaitable[T]], agent: str, attempts: int = AGENT_RETRY_ATTEMPTS) -> T:
+    """Runs an idempotent call, repeating it on transient errors (each attempt is routed afresh)."""
+    for attempt in range(attempts + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt >= attempts or not retryable(e):
+                raise
+            await retry_pause(agent, attempt, e)
+
+
+# -----------------------------
+# IDLE GUARD
+# -----------------------------
+async def idle_guarded(
+    events: AsyncIterator[Any],
+    agent: str,
+    first_s: float = STREAM_FIRST_EVENT_TIMEOUT_S,
+    idle_s: float = STREAM_IDLE_TIMEOUT_S,
+) -> AsyncIterator[Any]:
+    """
+    Relays events, raising StreamStalled when the first one or the next one is overdue.
+    One timer per stream watches a deadline that every event pushes back, and cancels
+    the reading task out of its read once the deadline passes (wait_for would wrap
+    every token read in a Task of its own). Time spent relaying an event doesn't count.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = events.__aiter__()
+    limit = first_s
+    deadline = 0.0
+    # The task blocked in a read; None while an event is being relayed
+    reading: Optional[asyncio.Task] = None
+    timer: Optional[asyncio.TimerHandle] = None
+    stalled = False
+    relayed = False
+
+    def expire() -> None:
+        nonlocal timer, stalled
+        now = loop.time()
+        if reading is None or now < deadline:
+            # An event arrived since the timer was set: check again at the new deadline
+            timer = loop.call_at(deadline if reading is not None else now + limit, expire)
+            return
+        timer = None
+        stalled = True
+        reading.cancel()
+
+    try:
+        while True:
+            if limit > 0:
+                deadline = loop.time() + limit
+                if timer is None:
+                    timer = loop.call_at(deadline, expire)
+            elif timer is not None:
+                timer.cancel()
+                timer = None
+
+            reading = asyncio.current_task()
+            try:
+                event = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            except asyncio.CancelledError:
+                if not stalled:
+                    raise
+                reading.uncancel()
+                STREAM_STALLS.inc(agent=agent)
+                phase = "next event" if relayed else "first event"
+                raise StreamStalled(f"{agent} stream sent no {phase} for {limit:g}s") from None
+            finally:
+                reading = None
+            limit, relayed = idle_s, True
+            yield event
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+
+# -----------------------------
+# HEDGED STREAMS
+# -----------------------------
+class LatencyWindow:
+    """Recent first-event latencies of one agent, for the hedging threshold."""
+
+    def __init__(self, size: int = 200):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))]
+
+
+FIRST_EVENT_LATENCY: Dict[str, LatencyWindow] = {}
+
+# Markers pushed by an attempt's pump once its stream has ended
+_ATTEMPT_DONE = object()
+
+
+class _Attempt:
+    """One copy of a hedged stream, pumped into its own queue."""
+
+    def __init__(self, stream: AsyncIterator[Any]):
+        self.started = time.perf_counter()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._pump(stream))
+
+    async def _pump(self, stream: AsyncIterator[Any]) -> None:
+        try:
+            async for item in stream:
+                await self.queue.put(item)
+        finally:
+            self.queue.put_nowait(_ATTEMPT_DONE)
+
+    async def cancel(self) -> None:
+        if not self.task.done():
+            self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+
+
+async def hedged_stream(
+    start: Callable[[Set[str]], AsyncIterator[Any]],
+    agent: str,
+    has_spare: Callable[[Set[str]], bool],
+    enabled: bool = HEDGE_STREAMS,
+    failed: Callable[[Any], bool] = lambda item: False,
+) -> AsyncIterator[Any]:
+    """
+    Streams start(avoid). With hedging on and enough history, a duplicate
+    start(avoid) is launched once the first event is later than the threshold and
+    has_spare(avoid) says another backend is free; `avoid` holds the backends the
+    copies were routed to. The first copy to produce an event is relayed, the other
+    cancelled. A copy whose first event is a failure (failed(item), e.g. an error
+    event) doesn't win the race while another copy is still running.
+    """
+    window = FIRST_EVENT_LATENCY.setdefault(agent, LatencyWindow())
+    threshold = window.percentile(HEDGE_PERCENTILE) if enabled else None
+    avoid: Set[str] = set()
+
+    if threshold is None:
+        started = time.perf_counter()
+        first = True
+        async for item in start(avoid):
+            if first:
+                window.add(time.perf_counter() - started)
+                first = False
+            yield item
+        return
+
+    attempts = [_Attempt(start(avoid))]
+    winner: Optional[_Attempt] = None
+    try:
+        first_item: Any = _ATTEMPT_DONE
+        try:
+            first_item = await asyncio.wait_for(attempts[0].queue.get(), timeout=threshold)
+            winner = attempts[0]
+        except asyncio.TimeoutError:
+            if has_spare(avoid):
+                attempts.append(_Attempt(start(avoid)))
+                print(f"  [🏇 HEDGE] {agent}: no first event after {threshold:.2f}s, racing a duplicate")
+            gets = {asyncio.create_task(attempt.queue.get()): attempt for attempt in attempts}
+            # A copy that failed or ended without any event only wins if it is the last one left
+            fallback: Optional[Tuple[_Attempt, Any]] = None
+            try:
+                while gets and winner is None:
+                    done, _ = await asyncio.wait(gets, return_when=asyncio.FIRST_COMPLETED)
+                    for get in done:
+                        attempt = gets.pop(get)
+                        item = get.result()
+                        if winner is not None:
+                            continue
+                        if item is not _ATTEMPT_DONE and not failed(item):
+                            winner, first_item = attempt, item
+                        elif fallback is None or fallback[1] is _ATTEMPT_DONE:
+                            # An error event says more than a silent end
+                            fallback = (attempt, item)
+            finally:
+                for get in gets:
+                    get.cancel()
+            if winner is None:
+                winner, first_item = fallback
+
+        for attempt in attempts:
+            if attempt is not winner:
+                await attempt.cancel()
+        if len(attempts) > 1:
+            HEDGED_STREAMS.inc(agent=agent, outcome="primary_won" if winner is attempts[0] else "hedge_won")
+
+        window.add(time.perf_counter() - winner.started)
+        item = first_item
+        while item is not _ATTEMPT_DONE:
+            yield item
+            item = await winner.queue.get()
+        # Surface a crash of the winning copy
+        winner.task.result()
+    finally:
+        for attempt in attempts:
+            await attempt.cancel()
@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import zlib
+import queue
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+from apps.api.settings import env_int, env_str
+
+# -----------------------------
+# CASE RESULT STORE
+# -----------------------------
+# Every final /run payload (ConsensusOutput plus agent reports, audit markdown and
+# timings) is recorded in SQLite (WAL mode, so reads never wait for the writer) at
+# artifacts/results.db. The columns dashboards filter on (case, patient, discrepancy
+# level, score, time) are indexed; the full payload is stored as zlib-compressed JSON.
+# The pipeline only enqueues: a writer thread commits in batches of up to
+# RESULT_BATCH_MAX rows, waiting at most RESULT_BATCH_MS to fill one. Reads run in
+# worker threads, each with its own connection.
+
+RESULT_DB = env_str("RESULT_DB", "artifacts/results.db")
+RESULT_BATCH_MS = env_int("RESULT_BATCH_MS", 200)
+RESULT_BATCH_MAX = env_int("RESULT_BATCH_MAX", 100)
+RESULT_COMPRESS_LEVEL = env_int("RESULT_COMPRESS_LEVEL", 6)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS case_results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    case_id TEXT NOT NULL,
+    patient_id TEXT,
+    created_at REAL NOT NULL,
+    level TEXT,
+    score REAL,
+    summary TEXT,
+    recommendation TEXT,
+    duration_s REAL,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS case_results_case ON case_results (case_id, id);
+CREATE INDEX IF NOT EXISTS case_results_patient ON case_results (patient_id, id);
+CREATE INDEX IF NOT EXISTS case_results_level ON case_results (level, id);
+CREATE INDEX IF NOT EXISTS case_results_score ON case_results (score);
+CREATE INDEX IF NOT EXISTS case_results_created ON case_results (created_at);
+"""
+
+_SUMMARY_COLUMNS = "id, case_id, patient_id, created_at, level, score, summary, recommendation, duration_s"
+
+# Pushed to the writer thread to make it drain its queue and exit
+_STOP = object()
+
+
+def _row(payload: Dict[str, Any], patient_id: Optional[str], created_at: float) -> tuple:
+    alert = payload.get("discrepancy_alert") or {}
+    actions = payload.get("recommended_data_actions") or [None]
+    return (
+        payload.get("case_id", ""),
+        patient_id,
+        created_at,
+        alert.get("level"),
+        alert.get("score"),
+        alert.get("summary"),
+        actions[0],
+        (payload.get("timings") or {}).get("total"),
+        zlib.compress(json.dumps(payload).encode("utf-8"), RESULT_COMPRESS_LEVEL),
+    )
+
+
+def _summary(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "result_id": row["id"],
+        "case_id": row["case_id"],
+        "patient_id": row["patient_id"],
+        "created_at": row["created_at"],
+        "level": row["level"],
+        "score": row["score"],
+        "summary": row["summary"],
+        "recommendation": row["recommendation"],
+        "duration_s": row["duration_s"],
+    }
+
+
+class ResultStore:
+    """Append-only store of final case payloads with a batched background writer."""
+
+    def __init__(self, path: str = RESULT_DB, batch_ms: int = RESULT_BATCH_MS, batch_max: int = RESULT_BATCH_MAX):
+        self.path = path
+        self.batch_s = batch_ms / 1000.0
+        self.batch_max = max(1, batch_max)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        conn.close()
+
+        self._writer = threading.Thread(target=self._write_loop, name="result-store-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30.0)
+        conn.row_factory = sqlite3.Row
+        # WAL + NORMAL: durable across application crashes, one fsync per checkpoint
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # --- Writes -------------------------------------------------------------
+
+    def save(self, payload: Dict[str, Any], patient_id: Optional[str] = None) -> None:
+        """Queues a final payload; encoding, compression and the commit happen on the writer thread."""
+        self._queue.put((payload, patient_id, time.time()))
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.batch_s
+            while len(batch) < self.batch_max:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                rows = [_row(*entry) for entry in batch]
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO case_results (case_id, patient_id, created_at, level, score, summary, recommendation, duration_s, payload) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        rows,
+                    )
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                print(f"  [⚠️ RESULTS] Could not store {len(batch)} case results: {e!r}")
+        conn.close()
+
+    def close(self) -> None:
+        """Flushes queued results and stops the writer (blocking: call it off the event loop)."""
+        self._queue.put(_STOP)
+        self._writer.join()
+
+    # --- Reads (blocking: run them in a worker thread) -----------------------
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def query(
+        self,
+        case_id: Optional[str] = None,
+        patient_id: Optional[str] = None,
+        level: Optional[str] = None,
+        min_score: Optional[float] = None,
+        max_score: Optional[float] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        before: Optional[int] = None,
+        limit: int = 50,
+    ) -> Dict[str, Any]:
+        """Newest results first; pass the returned next_cursor as `before` for the following page."""
+        filters = [
+            ("case_id = ?", case_id),
+            ("patient_id = ?", patient_id),
+            ("level = ?", level),
+            ("score >= ?", min_score),
+            ("score <= ?", max_score),
+            ("created_at >= ?", since),
+            ("created_at < ?", until),
+            ("id < ?", before),
+        ]
+        clauses = [clause for clause, value in filters if value is not None]
+        params: List[Any] = [value for _, value in filters if value is not None]
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._reader().execute(
+            f"SELECT {_SUMMARY_COLUMNS} FROM case_results {where} ORDER BY id DESC LIMIT ?", (*params, limit + 1)
+        ).fetchall()
+        page = [_summary(row) for row in rows[:limit]]
+        return {"results": page, "next_cursor": page[-1]["result_id"] if len(rows) > limit else None}
+
+    def payload(self, result_id: Optional[int] = None, case_id: Optional[str] = None) -> Optional[bytes]:
+        """The stored payload as JSON bytes: by result id, or the latest one of a case."""
+        if result_id is not None:
+            row = self._reader().execute("SELECT payload FROM case_results WHERE id = ?", (result_id,)).fetchone()
+        else:
+            row = self._reader().execute(
+                "SELECT payload FROM case_results WHERE case_id = ? ORDER BY id DESC LIMIT 1", (case_id,)
+            ).fetchone()
+        return zlib.decompress(row["payload"]) if row else None
@@ -0,0 +1,44 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from apps.api.settings import env_int
+
+# -----------------------------
+# UPSTREAM CONCURRENCY LIMITS
+# -----------------------------
+# Each upstream has its own capacity:
+#   cloud_gpu_slots -> Colab MedGemma (Vision + Consensus share the same GPU)
+#   hear_slots      -> HeAR acoustic endpoint
+#   ollama          -> Local OpenBioLLM (CPU-bound, usually one at a time)
+# The GPU and HeAR slot counts apply to each GPU backend in the pool: every Backend
+# holds its own semaphores, taken by whichever backend a call is routed to (see
+# backends.py). Ollama is a single local upstream, so its semaphore lives here.
+# Only real upstream calls take a slot; cache hits never wait.
+
+
+@dataclass
+class ConcurrencyLimits:
+    cloud_gpu_slots: int = 2
+    hear_slots: int = 4
+    ollama_slots: int = 1
+
+    ollama: asyncio.Semaphore = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.ollama = asyncio.Semaphore(self.ollama_slots)
+
+    @classmethod
+    def from_env(cls) -> "ConcurrencyLimits":
+        return cls(
+            cloud_gpu_slots=env_int("LIMIT_CLOUD_GPU", cls.cloud_gpu_slots),
+            hear_slots=env_int("LIMIT_HEAR", cls.hear_slots),
+            ollama_slots=env_int("LIMIT_OLLAMA", cls.ollama_slots),
+        )
+
+
+async def limited_call(slot: asyncio.Semaphore, call: Callable[[], Awaitable[Any]]) -> Any:
+    """Runs a request/response agent call while holding an upstream slot."""
+    async with slot:
+        return await call()
+
@@ -0,0 +1,29 @@
+import os
+
+# -----------------------------
+# ENV HELPERS
+# -----------------------------
+# Small typed readers for optional bridge settings in .env.
+# Empty or missing variables fall back to the given default.
+
+
+def env_int(name: str, default: int) -> int:
+    raw = os.getenv(name)
+    return int(raw) if raw not in (None, "") else default
+
+
+def env_float(name: str, default: float) -> float:
+    raw = os.getenv(name)
+    return float(raw) if raw not in (None, "") else default
+
+
+def env_bool(name: str, default: bool) -> bool:
+    raw = os.getenv(name)
+    if raw in (None, ""):
+        return default
+    return raw.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_str(name: str, default: str) -> str:
+    raw = os.getenv(name)
+    return raw if raw not in (None, "") else default
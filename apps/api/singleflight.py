@@ -0,0 +1,104 @@
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from apps.api.metrics import RUN_REQUESTS
+
+# -----------------------------
+# SINGLE-FLIGHT CASE RUNS
+# -----------------------------
+# A double-submitted case (or two clinicians opening the same one) must not run two
+# pipelines against the single Colab GPU. Identical in-flight runs share one pipeline:
+# the first request starts it, later requests attach and get a fan-out copy of the same
+# frame stream, replaying the frames already emitted before following it live.
+
+# Sentinel pushed to subscribers when the shared pipeline has finished
+_FLIGHT_DONE = object()
+
+
+class SharedStream:
+    """
+    One pipeline run broadcast to any number of subscribers.
+    Every frame is kept in `history` so late subscribers see the whole stream.
+    The pipeline is cancelled once every attached request has gone away.
+    """
+
+    def __init__(self, key: str, pipeline: Callable[[Dict[str, Any]], AsyncIterator[Any]]):
+        self.key = key
+        self.history: List[Any] = []
+        # Filled by the pipeline with its final aggregate payload (see case_pipeline)
+        self.outcome: Dict[str, Any] = {}
+        self.refs = 0
+        self._subscribers: List[asyncio.Queue] = []
+        self._task = asyncio.create_task(self._run(pipeline))
+
+    @property
+    def done(self) -> bool:
+        return self._task.done()
+
+    async def _run(self, pipeline: Callable[[Dict[str, Any]], AsyncIterator[Any]]):
+        try:
+            async for frame in pipeline(self.outcome):
+                self.history.append(frame)
+                for queue in self._subscribers:
+                    queue.put_nowait(frame)
+        finally:
+            for queue in self._subscribers:
+                queue.put_nowait(_FLIGHT_DONE)
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        """Replays the frames emitted so far, then follows the live pipeline to its end."""
+        # Snapshot + registration happen without an await in between, so no frame is missed or doubled
+        backlog = list(self.history)
+        queue: Optional[asyncio.Queue] = None
+        if not self.done:
+            queue = asyncio.Queue()
+            self._subscribers.append(queue)
+
+        try:
+            for frame in backlog:
+                yield frame
+            if queue is not None:
+                while True:
+                    frame = await queue.get()
+                    if frame is _FLIGHT_DONE:
+                        break
+                    yield frame
+        finally:
+            if queue is not None:
+                self._subscribers.remove(queue)
+            self.release()
+
+    def release(self) -> None:
+        self.refs -= 1
+        if self.refs <= 0 and not self.done:
+            self._task.cancel()
+
+
+class SingleFlight:
+    """Registry of in-flight case runs keyed on the case and its artifact hashes."""
+
+    def __init__(self):
+        self._flights: Dict[str, SharedStream] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def attach(self, key: str, pipeline: Callable[[Dict[str, Any]], AsyncIterator[Any]]) -> Tuple[SharedStream, bool]:
+        """
+        Returns (flight, joined). Starts the pipeline unless an identical run is in flight.
+        Each attach holds one reference, released when its subscribe() stream ends.
+        """
+        flight = self._flights.get(key)
+        joined = flight is not None and not flight.done
+        if not joined:
+            flight = SharedStream(key, pipeline)
+            self._flights[key] = flight
+            flight._task.add_done_callback(lambda _: self._forget(flight))
+
+        flight.refs += 1
+        RUN_REQUESTS.inc(mode="joined" if joined else "started")
+        return flight, joined
+
+    def _forget(self, flight: SharedStream) -> None:
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
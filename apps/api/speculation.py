@@ -0,0 +1,118 @@
+import re
+import time
+import asyncio
+import difflib
+from typing import AsyncIterator, Callable, Optional
+
+from apps.api.settings import env_bool, env_float, env_int
+from apps.api.sse import SSEEvent
+from apps.api.metrics import SPECULATION_HEAD_START_SECONDS, SPECULATION_OUTCOMES
+
+# -----------------------------
+# SPECULATIVE CONSENSUS
+# -----------------------------
+# Normally the adjudicator waits for the complete vision stream. In speculative mode a
+# provisional consensus starts as soon as the acoustic and context reports are in and
+# the vision agent has emitted a stable intermediate summary (its plan / recall phase).
+# When the vision final arrives the speculation is confirmed if the final imaging
+# summary matches the one it started on; otherwise it is cancelled and re-issued.
+# Nothing from a speculation reaches the browser until it is confirmed.
+
+SPECULATIVE_CONSENSUS = env_bool("SPECULATIVE_CONSENSUS", False)
+SPECULATION_MATCH_RATIO = env_float("SPECULATION_MATCH_RATIO", 0.95)
+# Provisional calls per case (a later phase that diverges restarts the speculation)
+SPECULATION_MAX_ATTEMPTS = env_int("SPECULATION_MAX_ATTEMPTS", 2)
+
+# Vision phases whose text is stable enough to adjudicate on
+SPECULATIVE_PHASES = ("plan", "recall")
+# Intermediate event types that can carry a phase; token-level 'thought' events are never decoded
+_PHASE_EVENT_TYPES = {"status", "phase", "plan", "recall"}
+_PHASE_TEXT_KEYS = ("data_for_consensus", "summary", "content", "text")
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Sentinel marking the end of the provisional stream
+_SPECULATION_DONE = object()
+
+
+def phase_summary(event: SSEEvent) -> Optional[str]:
+    """Imaging summary carried by a plan / recall phase event of the vision stream, if any."""
+    if event.type not in _PHASE_EVENT_TYPES:
+        return None
+    try:
+        payload = event.json()
+    except ValueError:
+        return None
+
+    phase = payload.get("phase") or event.type
+    if phase not in SPECULATIVE_PHASES:
+        return None
+    for key in _PHASE_TEXT_KEYS:
+        text = payload.get(key)
+        if isinstance(text, str) and text.strip():
+            return text.strip()
+    return None
+
+
+def summary_similarity(a: str, b: str) -> float:
+    """Similarity in [0, 1] of two imaging summaries, ignoring case and whitespace."""
+    a = _WHITESPACE.sub(" ", a).strip().lower()
+    b = _WHITESPACE.sub(" ", b).strip().lower()
+    if a == b:
+        return 1.0
+    matcher = difflib.SequenceMatcher(None, a, b)
+    # Cheap upper bounds first: most mismatches are rejected without the full diff
+    if matcher.real_quick_ratio() < SPECULATION_MATCH_RATIO or matcher.quick_ratio() < SPECULATION_MATCH_RATIO:
+        return matcher.quick_ratio()
+    return matcher.ratio()
+
+
+class SpeculativeConsensus:
+    """
+    One provisional consensus stream running in the background.
+    Its events are buffered until the caller confirms it (events() replays the
+    buffer, then follows the live stream) or cancels it (upstream call aborted).
+    """
+
+    def __init__(self, imaging_txt: str, stream: Callable[[], AsyncIterator[SSEEvent]]):
+        self.imaging_txt = imaging_txt
+        self.started = time.perf_counter()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._pump(stream))
+
+    async def _pump(self, stream: Callable[[], AsyncIterator[SSEEvent]]):
+        try:
+            async for event in stream():
+                await self._queue.put(event)
+        finally:
+            self._queue.put_nowait(_SPECULATION_DONE)
+
+    def similarity(self, imaging_txt: str) -> float:
+        return summary_similarity(self.imaging_txt, imaging_txt)
+
+    def confirm(self) -> AsyncIterator[SSEEvent]:
+        SPECULATION_OUTCOMES.inc(outcome="confirmed")
+        SPECULATION_HEAD_START_SECONDS.observe(time.perf_counter() - self.started)
+        return self._events()
+
+    async def _events(self) -> AsyncIterator[SSEEvent]:
+        while True:
+            event = await self._queue.get()
+            if event is _SPECULATION_DONE:
+                break
+            yield event
+        # Surface a crash in the provisional call to the pipeline
+        self._task.result()
+
+    async def discard(self, outcome: str) -> None:
+        """Cancels the provisional call and waits until its upstream slot is released."""
+        SPECULATION_OUTCOMES.inc(outcome=outcome)
+        self.cancel()
+        try:
+            await self._task
+        except (asyncio.CancelledError, Exception):
+            pass
+
+    def cancel(self) -> None:
+        if not self._task.done():
+            self._task.cancel()
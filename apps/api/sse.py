@@ -0,0 +1,295 @@
+import re
+import json
+import time
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Union
+
+from apps.api.settings import env_int
+
+# -----------------------------
+# INCREMENTAL SSE PARSER / RELAY
+# -----------------------------
+# Agent streams are token-level: thousands of tiny `data: {"type": "thought", ...}`
+# events per case. The relay never decodes those. It splits the byte stream into
+# events, sniffs the event type with one bounded regex, and forwards thought payloads
+# byte-for-byte. Only control events (final / error) are ever json-parsed, plus the
+# rare payload whose key match sits behind a nested object or array.
+
+CONTROL_TYPES = {"final", "error"}
+
+# Matches only an unescaped `"type": "..."` key, so a delta that *mentions* "type" never matches
+_TYPE_RE = re.compile(rb'"type"\s*:\s*"([A-Za-z_]+)"')
+_AGENT_RE = re.compile(rb'"agent"\s*:')
+_TYPE_SNIFF_BYTES = 96
+
+COALESCE_WINDOW_S = env_int("SSE_COALESCE_MS", 50) / 1000.0
+COALESCE_MAX_BYTES = env_int("SSE_COALESCE_MAX_BYTES", 16 * 1024)
+
+
+def _maybe_nested(payload: bytes, end: int) -> bool:
+    """True when a key match at `end` might not be top-level (a bracket opens before it)."""
+    return payload[:1] != b"{" or b"{" in payload[1:end] or b"[" in payload[1:end]
+
+
+def _top_level(payload: bytes) -> Dict[str, Any]:
+    try:
+        parsed = json.loads(payload)
+    except ValueError:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+def sniff_type(payload: bytes) -> str:
+    """
+    Top-level event type from the first bytes of a JSON payload (falls back to a full
+    scan). A match behind a nested object or array may belong to it, so those payloads
+    are json-parsed instead.
+    """
+    m = _TYPE_RE.search(payload, 0, _TYPE_SNIFF_BYTES) or _TYPE_RE.search(payload)
+    if m is None:
+        return ""
+    if _maybe_nested(payload, m.start()):
+        event_type = _top_level(payload).get("type")
+        return event_type if isinstance(event_type, str) else ""
+    return m.group(1).decode()
+
+
+def frame_payload(frame: bytes) -> bytes:
+    """The JSON payload of a single-line `data: ...` SSE frame."""
+    payload = frame[len(b"data: "):] if frame.startswith(b"data: ") else frame
+    return payload.rstrip(b"\r\n")
+
+
+def has_agent(payload: bytes) -> bool:
+    """Whether a JSON payload already carries a top-level "agent" key."""
+    m = _AGENT_RE.search(payload)
+    if m is None:
+        return False
+    if _maybe_nested(payload, m.start()):
+        return "agent" in _top_level(payload)
+    return True
+
+
+class SSEEvent:
+    """One relayed event. `data` is the raw JSON payload; `json()` decodes it lazily, once."""
+
+    __slots__ = ("data", "type", "_parsed")
+
+    def __init__(self, data: bytes, event_type: Optional[str] = None):
+        self.data = data
+        self.type = event_type if event_type is not None else sniff_type(data)
+        self._parsed: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_obj(cls, obj: Dict[str, Any]) -> "SSEEvent":
+        event = cls(json.dumps(obj).encode(), obj.get("type", ""))
+        event._parsed = obj
+        return event
+
+    @property
+    def is_control(self) -> bool:
+        return self.type in CONTROL_TYPES
+
+    def json(self) -> Dict[str, Any]:
+        if self._parsed is None:
+            parsed = json.loads(self.data)
+            self._parsed = parsed if isinstance(parsed, dict) else {"type": self.type, "value": parsed}
+        return self._parsed
+
+    def frame(self, agent: Optional[str] = None) -> bytes:
+        """
+        SSE frame for the browser, optionally tagged with its agent by splicing the key into
+        the raw JSON. A payload that already has an "agent" key keeps it as is.
+        """
+        data = self.data
+        if agent and data[:1] == b"{" and data[1:].lstrip()[:1] != b"}" and not has_agent(data):
+            data = b'{"agent": "' + agent.encode() + b'", ' + data[1:]
+        return b"data: " + data + b"\n\n"
+
+
+class SSEParser:
+    """
+    Incremental parser: feed() raw bytes as they arrive, get back complete events.
+    Follows the SSE framing rules (blank line ends an event, multi-line data joined
+    with '\\n', comments / id / retry ignored). With wrap_raw_lines, bare non-field
+    lines become thought events (the vision agent sends raw text between events);
+    otherwise they are dropped.
+    """
+
+    def __init__(self, wrap_raw_lines: bool = True):
+        self.wrap_raw_lines = wrap_raw_lines
+        self._buffer = b""
+        self._data_lines: List[bytes] = []
+
+    def _dispatch(self, events: List[SSEEvent]) -> None:
+        if self._data_lines:
+            data = b"\n".join(self._data_lines).strip()
+            self._data_lines = []
+            if data:
+                events.append(SSEEvent(data))
+
+    def _line(self, line: bytes, events: List[SSEEvent]) -> None:
+        if line.endswith(b"\r"):
+            line = line[:-1]
+
+        if not line:
+            self._dispatch(events)
+        elif line.startswith(b"data:"):
+            value = line[5:]
+            self._data_lines.append(value[1:] if value[:1] == b" " else value)
+        elif line.startswith((b":", b"id:", b"event:", b"retry:")):
+            return
+        elif self.wrap_raw_lines and line.strip():
+            # Raw text outside the SSE framing: wrap it as a thought
+            self._dispatch(events)
+            events.append(SSEEvent.from_obj({"type": "thought", "delta": line.decode("utf-8", "replace")}))
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        events: List[SSEEvent] = []
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            self._line(line, events)
+        return events
+
+    def close(self) -> List[SSEEvent]:
+        """Flushes whatever is left when the upstream closes without a trailing blank line."""
+        events: List[SSEEvent] = []
+        if self._buffer:
+            self._line(self._buffer, events)
+            self._buffer = b""
+        self._dispatch(events)
+        return events
+
+
+async def iter_sse_events(byte_stream: AsyncIterator[bytes], wrap_raw_lines: bool = True) -> AsyncIterator[SSEEvent]:
+    parser = SSEParser(wrap_raw_lines)
+    async for chunk in byte_stream:
+        for event in parser.feed(chunk):
+            yield event
+    for event in parser.close():
+        yield event
+
+
+# Sentinel marking the end of the source stream inside coalesce_frames / until_disconnected
+_FRAMES_DONE = object()
+
+
+async def coalesce_frames(
+    frames: AsyncIterator[Union[str, bytes]],
+    window_s: float = COALESCE_WINDOW_S,
+    max_bytes: int = COALESCE_MAX_BYTES,
+) -> AsyncIterator[bytes]:
+    """
+    Batches consecutive SSE frames into one write to the browser.
+    A batch is flushed when it is window_s old, exceeds max_bytes, or a control
+    frame (final / error) arrives, so verdicts are never delayed. Frames are only
+    concatenated, never re-encoded, and the client still sees one event per frame.
+    """
+    if window_s <= 0:
+        async for frame in frames:
+            yield frame.encode() if isinstance(frame, str) else frame
+        return
+
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for frame in frames:
+                await queue.put(frame)
+        finally:
+            await queue.put(_FRAMES_DONE)
+
+    pump_task = asyncio.create_task(pump())
+    batch: List[bytes] = []
+    batch_bytes = 0
+    batch_started = 0.0
+
+    try:
+        while True:
+            if batch:
+                remaining = window_s - (time.monotonic() - batch_started)
+                try:
+                    frame = await asyncio.wait_for(queue.get(), timeout=max(remaining, 0))
+                except asyncio.TimeoutError:
+                    yield b"".join(batch)
+                    batch, batch_bytes = [], 0
+                    continue
+            else:
+                frame = await queue.get()
+
+            if frame is _FRAMES_DONE:
+                break
+
+            frame = frame.encode() if isinstance(frame, str) else frame
+            if not batch:
+                batch_started = time.monotonic()
+            batch.append(frame)
+            batch_bytes += len(frame)
+
+            if batch_bytes >= max_bytes or sniff_type(frame_payload(frame)) in CONTROL_TYPES:
+                yield b"".join(batch)
+                batch, batch_bytes = [], 0
+
+        if batch:
+            yield b"".join(batch)
+
+        # Surface a crash in the source stream
+        pump_task.result()
+    finally:
+        if not pump_task.done():
+            pump_task.cancel()
+
+
+# Sentinel pushed by the disconnect watcher of until_disconnected
+_CLIENT_GONE = object()
+
+
+async def until_disconnected(
+    frames: AsyncIterator[Any],
+    receive: Callable[[], Awaitable[Dict[str, Any]]],
+    on_disconnect: Optional[Callable[[], None]] = None,
+) -> AsyncIterator[Any]:
+    """
+    Relays frames until the client goes away, then closes the source stream at once.
+    Uvicorn silently drops writes to a closed socket, so without this a pipeline would
+    keep streaming (and the GPU keep generating) for a browser tab that is long gone.
+    `receive` is the ASGI receive callable of a request whose body was already read.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for frame in frames:
+                await queue.put(frame)
+        finally:
+            await queue.put(_FRAMES_DONE)
+
+    async def watch():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        queue.put_nowait(_CLIENT_GONE)
+
+    pump_task = asyncio.create_task(pump())
+    watch_task = asyncio.create_task(watch())
+    completed = False
+    try:
+        while True:
+            frame = await queue.get()
+            if frame is _FRAMES_DONE:
+                break
+            if frame is _CLIENT_GONE:
+                return
+            yield frame
+
+        completed = True
+        pump_task.result()
+    finally:
+        # Also reached when the server itself notices the disconnect and cancels the response
+        if not completed and on_disconnect is not None:
+            on_disconnect()
+        watch_task.cancel()
+        if not pump_task.done():
+            # Cancelling the pump closes `frames` (and everything it is iterating upstream)
+            pump_task.cancel()
+            await asyncio.gather(pump_task, return_exceptions=True)
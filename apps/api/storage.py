@@ -0,0 +1,418 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from apps.api.settings import env_float, env_str
+from apps.api.metrics import STORAGE_GC_FREED_BYTES, STORAGE_GC_REMOVED, STORAGE_USAGE
+
+# -----------------------------
+# CONTENT-ADDRESSED ARTIFACT STORAGE
+# -----------------------------
+# Case uploads used to live in artifacts/runs/{case_id}/ forever, and the same study
+# re-uploaded under a new case id was stored again. Now every upload is stored once,
+# as a read-only blob at artifacts/blobs/{sha256[:2]}/{sha256}. The case directory
+# gets a hardlink to the blob under the usual name (xray.jpg, audio.wav, ...), so
+# agents, the preprocessor and the caches still read plain paths. A per-case
+# manifest.json records which blob each file is. A blob's link count therefore is
+# its reference count: once the last case linking it is gone (st_nlink == 1), the
+# blob is garbage. Where hardlinks are unavailable (BLOB_DIR on another filesystem),
+# uploads stay plain files without dedup.
+#
+# A background GC pass (every STORAGE_GC_INTERVAL_S, in a worker thread):
+#   1. removes cases unused for CASE_RETENTION_DAYS
+#   2. while blobs + case-owned files (derivatives, pre-dedup uploads) exceed
+#      STORAGE_MAX_GB, removes the least recently used cases
+#   3. deletes blobs no case links anymore
+# A case counts as used when it is uploaded or run. The GC never removes a case with an
+# upload or pipeline in progress (including a case whose uploads a running case reads
+# as its prior) or a case touched within STORAGE_GC_GRACE_S. Prior references are not
+# recorded at rest: once no run holds protect() on it, a case serving only as another
+# case's prior ages out like any other, and later comparisons that name its files
+# report the prior as unavailable.
+#
+# Requests only ever wait for in-memory bookkeeping. protect() touches the manifest in
+# a worker thread, and a GC victim is renamed into artifacts/runs/.trash under the lock
+# and deleted after the lock is released. An upload racing the GC therefore gets a
+# fresh case directory instead of waiting for (or losing files to) an rmtree.
+#
+# Only blobs and artifacts/runs count toward STORAGE_MAX_GB. The other artifact
+# directories are bounded on their own and are not collected here: the result cache
+# (artifacts/cache, CACHE_MAX_DISK_MB / CACHE_TTL_SECONDS), job event logs
+# (artifacts/jobs, JOB_TTL_HOURS) and patient study records (artifacts/patients: small,
+# kept for good by design).
+
+BLOB_DIR = env_str("BLOB_DIR", "artifacts/blobs")
+RUNS_DIR = "artifacts/runs"
+MANIFEST_NAME = "manifest.json"
+# Under RUNS_DIR so removed cases are renamed, not copied; scans skip dot-names
+TRASH_NAME = ".trash"
+
+STORAGE_MAX_GB = env_float("STORAGE_MAX_GB", 20.0)
+CASE_RETENTION_DAYS = env_float("CASE_RETENTION_DAYS", 30.0)
+STORAGE_GC_INTERVAL_S = env_float("STORAGE_GC_INTERVAL_S", 600.0)
+STORAGE_GC_GRACE_S = env_float("STORAGE_GC_GRACE_S", 900.0)
+
+
+class BlobStore:
+    """Immutable blobs named by their SHA-256, shared between case directories through hardlinks."""
+
+    def __init__(self, root: str = BLOB_DIR, link_dir: str = RUNS_DIR):
+        self.root = root
+        # Serializes "link to an existing blob" against "delete an unlinked blob"
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.hardlinks = self._probe_hardlinks(link_dir)
+        if not self.hardlinks:
+            print(f"  [⚠️ STORAGE] {root} cannot be hardlinked into {link_dir}: uploads are stored without dedup")
+
+    def _probe_hardlinks(self, link_dir: str) -> bool:
+        os.makedirs(link_dir, exist_ok=True)
+        probe = os.path.join(self.root, f".probe.{uuid.uuid4().hex}")
+        link = os.path.join(link_dir, f".probe.{uuid.uuid4().hex}")
+        try:
+            open(probe, "wb").close()
+            os.link(probe, link)
+            os.remove(link)
+            return True
+        except OSError:
+            return False
+        finally:
+            try:
+                os.remove(probe)
+            except OSError:
+                pass
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    @staticmethod
+    def _link(blob_path: str, dest_path: str) -> None:
+        # Link under a temp name, then rename: readers see the old file or the new one
+        part = f"{dest_path}.{uuid.uuid4().hex}.link"
+        os.link(blob_path, part)
+        os.replace(part, dest_path)
+
+    def ingest(self, tmp_path: str, digest: str, dest_path: str) -> bool:
+        """
+        Places a completed upload at dest_path as a link to its blob (blocking).
+        Returns True when the blob already existed and the upload's bytes were dropped.
+        """
+        if not self.hardlinks:
+            os.replace(tmp_path, dest_path)
+            return False
+
+        blob_path = self.path(digest)
+        with self._lock:
+            try:
+                self._link(blob_path, dest_path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                # Read-only: nothing may modify a blob in place through one of its links
+                os.chmod(tmp_path, 0o444)
+                os.replace(tmp_path, blob_path)
+                self._link(blob_path, dest_path)
+                return False
+        os.remove(tmp_path)
+        return True
+
+    def remove_if_unreferenced(self, digest: str, min_age_s: float = 0.0) -> int:
+        """Deletes the blob when no case links it anymore; returns the bytes freed."""
+        blob_path = self.path(digest)
+        with self._lock:
+            try:
+                st = os.stat(blob_path)
+            except FileNotFoundError:
+                return 0
+            if st.st_nlink > 1 or time.time() - st.st_mtime < min_age_s:
+                return 0
+            os.remove(blob_path)
+        return st.st_size
+
+    def digests(self) -> Iterator[str]:
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if len(prefix) == 2 and os.path.isdir(prefix_dir):
+                yield from (name for name in os.listdir(prefix_dir) if name.startswith(prefix) and len(name) == 64)
+
+    def usage(self) -> Dict[str, int]:
+        count = stored = shared = 0
+        for digest in self.digests():
+            try:
+                st = os.stat(self.path(digest))
+            except FileNotFoundError:
+                continue
+            count += 1
+            stored += st.st_size
+            # Bytes every linking case would hold on its own without dedup
+            shared += st.st_size * max(0, st.st_nlink - 1)
+        return {"count": count, "bytes": stored, "logical_bytes": shared}
+
+
+@dataclass
+class CaseUsage:
+    case_id: str
+    path: str
+    last_used: float
+    # Files only this case holds (derivatives, sidecars, uploads from before dedup)
+    exclusive_bytes: int = 0
+    digests: List[str] = field(default_factory=list)
+
+
+class CaseStorage:
+    """Case directories over a BlobStore: manifests, in-use protection, quotas and GC."""
+
+    def __init__(
+        self,
+        blobs: BlobStore,
+        runs_dir: str = RUNS_DIR,
+        max_gb: float = STORAGE_MAX_GB,
+        retention_days: float = CASE_RETENTION_DAYS,
+        grace_s: float = STORAGE_GC_GRACE_S,
+    ):
+        self.blobs = blobs
+        self.runs_dir = runs_dir
+        self.max_bytes = int(max_gb * 1024 ** 3)
+        self.retention_s = retention_days * 86400
+        self.grace_s = grace_s
+        # case_id -> number of pipelines / uploads currently using it
+        self._in_use: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.last_gc: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def case_dir(self, case_id: str) -> str:
+        return os.path.join(self.runs_dir, case_id)
+
+    @property
+    def trash_dir(self) -> str:
+        return os.path.join(self.runs_dir, TRASH_NAME)
+
+    # --- Upload side ----------------------------------------------------------
+
+    def record(self, case_id: str, files: Dict[str, Dict[str, Any]]) -> None:
+        """Merges {filename: {"sha256", "bytes"}} into the case manifest (blocking)."""
+        path = os.path.join(self.case_dir(case_id), MANIFEST_NAME)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            manifest = {"case_id": case_id, "files": {}}
+        for name, info in files.items():
+            manifest["files"][name] = {"sha256": info["sha256"], "bytes": info["bytes"], "stored_at": time.time()}
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+    @asynccontextmanager
+    async def protect(self, *case_ids: str) -> AsyncIterator[None]:
+        """Keeps the cases away from GC while the block runs; entering counts as a use."""
+        with self._lock:
+            for case_id in case_ids:
+                self._in_use[case_id] = self._in_use.get(case_id, 0) + 1
+        try:
+            await asyncio.to_thread(self._touch, case_ids)
+            yield
+        finally:
+            with self._lock:
+                for case_id in case_ids:
+                    self._in_use[case_id] -= 1
+                    if not self._in_use[case_id]:
+                        del self._in_use[case_id]
+
+    def _touch(self, case_ids: Tuple[str, ...]) -> None:
+        for case_id in case_ids:
+            for path in (os.path.join(self.case_dir(case_id), MANIFEST_NAME), self.case_dir(case_id)):
+                try:
+                    os.utime(path)
+                    break
+                except OSError:
+                    continue
+
+    # --- Scan & GC (blocking: run them in a worker thread) ----------------------
+
+    def _scan_case(self, case_id: str) -> CaseUsage:
+        path = self.case_dir(case_id)
+        usage = CaseUsage(case_id, path, os.stat(path).st_mtime)
+        manifest_path = os.path.join(path, MANIFEST_NAME)
+        try:
+            # Uploads and runs touch the manifest: its mtime is the case's last use
+            usage.last_used = os.stat(manifest_path).st_mtime
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                usage.digests = [info["sha256"] for info in json.load(f).get("files", {}).values()]
+            has_manifest = True
+        except (OSError, ValueError):
+            has_manifest = False
+
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    st = os.lstat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                if not has_manifest:
+                    usage.last_used = max(usage.last_used, st.st_mtime)
+                if st.st_nlink == 1:
+                    usage.exclusive_bytes += st.st_size
+        return usage
+
+    def scan(self) -> List[CaseUsage]:
+        cases = []
+        try:
+            names = os.listdir(self.runs_dir)
+        except FileNotFoundError:
+            return cases
+        for name in names:
+            if not name.startswith(".") and os.path.isdir(self.case_dir(name)):
+                try:
+                    cases.append(self._scan_case(name))
+                except FileNotFoundError:
+                    continue
+        return cases
+
+    def _empty_trash(self) -> None:
+        try:
+            names = os.listdir(self.trash_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            shutil.rmtree(os.path.join(self.trash_dir, name), ignore_errors=True)
+
+    def _remove_case(self, case: CaseUsage) -> Optional[int]:
+        """Deletes a case directory and the blobs only it linked; None when the case is in use."""
+        os.makedirs(self.trash_dir, exist_ok=True)
+        trash_path = os.path.join(self.trash_dir, f"{case.case_id}.{uuid.uuid4().hex}")
+        # Only the in-use check and the rename happen under the lock, never the rmtree
+        with self._lock:
+            if case.case_id in self._in_use:
+                return None
+            try:
+                os.rename(case.path, trash_path)
+            except FileNotFoundError:
+                trash_path = None
+        if trash_path is not None:
+            shutil.rmtree(trash_path, ignore_errors=True)
+        freed = case.exclusive_bytes
+        for digest in set(case.digests):
+            freed += self.blobs.remove_if_unreferenced(digest)
+        return freed
+
+    def collect(self) -> Dict[str, Any]:
+        """One GC pass: age quota, size quota (least recently used first), unreferenced blobs."""
+        started = time.time()
+        # Cases an interrupted pass renamed but never finished deleting
+        self._empty_trash()
+        cases = sorted(self.scan(), key=lambda case: case.last_used)
+        blob_bytes = self.blobs.usage()["bytes"]
+        used = blob_bytes + sum(case.exclusive_bytes for case in cases)
+        removed = {"age": 0, "size": 0}
+        freed = {"age": 0, "size": 0, "unreferenced": 0}
+
+        def evict(case: CaseUsage, reason: str) -> bool:
+            nonlocal used
+            case_freed = self._remove_case(case)
+            if case_freed is None:
+                return False
+            used -= case_freed
+            removed[reason] += 1
+            freed[reason] += case_freed
+            return True
+
+        remaining = []
+        for case in cases:
+            if self.retention_s > 0 and started - case.last_used > self.retention_s and evict(case, "age"):
+                continue
+            remaining.append(case)
+
+        for case in remaining:
+            if self.max_bytes <= 0 or used <= self.max_bytes:
+                break
+            if started - case.last_used >= self.grace_s:
+                evict(case, "size")
+
+        # Blobs left behind by cases removed outside the GC (or by interrupted passes)
+        for digest in list(self.blobs.digests()):
+            size = self.blobs.remove_if_unreferenced(digest, min_age_s=self.grace_s)
+            if size:
+                used -= size
+                freed["unreferenced"] += size
+
+        self.last_gc = {
+            "at": started,
+            "seconds": round(time.time() - started, 3),
+            "cases_removed": removed,
+            "bytes_freed": freed,
+            "used_bytes": used,
+        }
+        if any(removed.values()) or freed["unreferenced"]:
+            print(
+                f"  [🧹 STORAGE] GC removed {removed['age']} expired + {removed['size']} over-quota cases, "
+                f"freed {sum(freed.values()) / 1e6:.1f} MB ({used / 1e6:.1f} MB in use)"
+            )
+        return self.last_gc
+
+    def stats(self) -> Dict[str, Any]:
+        """Disk usage of blobs and case directories, dedup savings, quotas and the last GC pass."""
+        blobs = self.blobs.usage()
+        cases = self.scan()
+        exclusive = sum(case.exclusive_bytes for case in cases)
+        with self._lock:
+            in_use = sorted(self._in_use)
+        disk = shutil.disk_usage(self.runs_dir)
+        return {
+            "blobs": blobs,
+            "cases": {"count": len(cases), "in_use": in_use, "exclusive_bytes": exclusive},
+            "dedup": {
+                "hardlinks": self.blobs.hardlinks,
+                "saved_bytes": max(0, blobs["logical_bytes"] - blobs["bytes"]),
+            },
+            "used_bytes": blobs["bytes"] + exclusive,
+            "quota": {"max_bytes": self.max_bytes or None, "retention_days": self.retention_s / 86400 or None},
+            "disk": {"total": disk.total, "used": disk.used, "free": disk.free},
+            "last_gc": self.last_gc,
+        }
+
+    # --- Background loop --------------------------------------------------------
+
+    def start(self, interval_s: float = STORAGE_GC_INTERVAL_S) -> None:
+        if interval_s > 0:
+            self._task = asyncio.create_task(self._gc_loop(interval_s))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def gc(self) -> Dict[str, Any]:
+        """Runs one GC pass off the event loop and records it in the metrics."""
+        report = await asyncio.to_thread(self.collect)
+        for reason, count in report["cases_removed"].items():
+            if count:
+                STORAGE_GC_REMOVED.inc(count, reason=reason)
+        for reason, size in report["bytes_freed"].items():
+            if size:
+                STORAGE_GC_FREED_BYTES.inc(size, reason=reason)
+        return report
+
+    async def usage(self) -> Dict[str, Any]:
+        """stats() off the event loop, also published as the storage gauges."""
+        stats = await asyncio.to_thread(self.stats)
+        STORAGE_USAGE["blob_bytes"] = stats["blobs"]["bytes"]
+        STORAGE_USAGE["case_bytes"] = stats["cases"]["exclusive_bytes"]
+        return stats
+
+    async def _gc_loop(self, interval_s: float) -> None:
+        while True:
+            try:
+                await self.gc()
+                await self.usage()
+            except OSError as e:
+                print(f"  [⚠️ STORAGE] GC pass failed: {e!r}")
+            await asyncio.sleep(interval_s)
@@ -0,0 +1,130 @@
+import os
+import asyncio
+import hashlib
+import uuid
+from typing import Any, BinaryIO, Dict, Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+from apps.api.settings import env_int
+from apps.api.storage import BlobStore
+
+# -----------------------------
+# STREAMING UPLOADS
+# -----------------------------
+# Uploads are copied chunk by chunk with every blocking write pushed to a worker
+# thread, so a 100 MB scan never stalls the SSE streams sharing the event loop.
+# Bytes land in a temp file next to the target and are renamed into place only
+# once complete: agents either see the previous artifact or the whole new one.
+# With a BlobStore the completed file becomes (or is linked to) its content blob.
+#
+# The per-file limits are checked as the parts are copied, but by then Starlette has
+# already spooled the whole multipart body. UploadLimitMiddleware therefore caps the
+# request itself, before the form is parsed: an over-limit Content-Length is rejected
+# without reading the body, and a chunked body is cut off with a 413 as soon as it
+# passes MAX_UPLOAD_REQUEST_MB.
+
+UPLOAD_CHUNK_BYTES = env_int("UPLOAD_CHUNK_KB", 1024) * 1024
+MAX_XRAY_BYTES = env_int("MAX_XRAY_UPLOAD_MB", 50) * 1024 * 1024
+MAX_AUDIO_BYTES = env_int("MAX_AUDIO_UPLOAD_MB", 200) * 1024 * 1024
+# One /upload request carries at most an x-ray, a recording and one prior of each,
+# plus a little multipart framing
+MAX_UPLOAD_REQUEST_BYTES = env_int(
+    "MAX_UPLOAD_REQUEST_MB", (2 * (MAX_XRAY_BYTES + MAX_AUDIO_BYTES)) // (1024 * 1024) + 1
+) * 1024 * 1024
+
+
+def _too_large(max_bytes: int) -> str:
+    return f"Upload request exceeds the {max_bytes // (1024 * 1024)} MB limit"
+
+
+class UploadLimitMiddleware:
+    """Rejects upload requests whose body exceeds max_bytes before the form parser spools it."""
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_REQUEST_BYTES, path_prefix: str = "/upload/"):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.max_bytes:
+            await JSONResponse({"detail": _too_large(self.max_bytes)}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside request.form(): FastAPI passes HTTPExceptions through as-is
+                    raise HTTPException(status_code=413, detail=_too_large(self.max_bytes))
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def _write_chunk(f: BinaryIO, digest: "hashlib._Hash", chunk: bytes) -> None:
+    f.write(chunk)
+    digest.update(chunk)
+
+
+def _discard(f: BinaryIO, tmp_path: str) -> None:
+    f.close()
+    try:
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+def _commit(f: BinaryIO, tmp_path: str, dest_path: str, blobs: Optional[BlobStore], digest: str) -> bool:
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    if blobs is None:
+        os.replace(tmp_path, dest_path)
+        return False
+    return blobs.ingest(tmp_path, digest, dest_path)
+
+
+async def save_upload(upload: UploadFile, dest_path: str, max_bytes: int, blobs: Optional[BlobStore] = None) -> Dict[str, Any]:
+    """
+    Streams an UploadFile to dest_path off the event loop.
+    Hashes and counts bytes on the fly; rejects with 413 once max_bytes is exceeded.
+    Returns {"path", "sha256", "bytes", "deduplicated"}.
+    """
+    await asyncio.to_thread(os.makedirs, os.path.dirname(dest_path), exist_ok=True)
+    tmp_path = f"{dest_path}.{uuid.uuid4().hex}.part"
+
+    digest = hashlib.sha256()
+    size = 0
+    f = await asyncio.to_thread(open, tmp_path, "wb")
+
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"{upload.filename or 'upload'} exceeds the {max_bytes // (1024 * 1024)} MB limit",
+                )
+
+            await asyncio.to_thread(_write_chunk, f, digest, chunk)
+    except BaseException:
+        await asyncio.to_thread(_discard, f, tmp_path)
+        raise
+
+    deduplicated = await asyncio.to_thread(_commit, f, tmp_path, dest_path, blobs, digest.hexdigest())
+    return {"path": dest_path, "sha256": digest.hexdigest(), "bytes": size, "deduplicated": deduplicated}
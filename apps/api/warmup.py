@@ -0,0 +1,167 @@
+import io
+import time
+import wave
+import asyncio
+from typing import Any, Dict, Optional, Set
+
+import httpx
+import ollama
+
+from apps.api.settings import env_bool, env_float, env_int, env_str
+from apps.api.metrics import WARMUP_RUNS, WARMUP_SECONDS
+from apps.api.backends import BACKEND_HEALTH_PATH, Backend, BackendPool
+
+# -----------------------------
+# WARMUP & KEEP-ALIVE
+# -----------------------------
+# The first case after a restart used to pay for loading OpenBioLLM into Ollama and
+# for cold tunnel handshakes, and Ollama unloaded the model again after 5 idle minutes.
+# At startup a background task:
+#   * preloads the Ollama model (an empty chat) with OLLAMA_KEEP_ALIVE, which every
+#     history call also sends
+#   * opens WARMUP_CONNECTIONS pooled connections to every GPU backend
+#   * sends a one-second silent clip to every HeAR backend (WARMUP_HEAR), so the
+#     first real window doesn't pay for lazy model initialization; vision / consensus
+#     are full generations and are only warmed at the connection level
+# Failed steps are retried every WARMUP_RETRY_S. Once everything is warm, the Ollama
+# preload is repeated every KEEPALIVE_PING_S so the model never idles out (the backend
+# health probes keep the tunnel connections in use). From then on /ready follows the
+# live state: it is 503 again while the Ollama keep-alive fails, or while every backend
+# serving some agent is ejected by the health checks or has that endpoint's breaker open.
+
+WARMUP_ENABLED = env_bool("WARMUP_ENABLED", True)
+WARMUP_CONNECTIONS = env_int("WARMUP_CONNECTIONS", 2)
+WARMUP_HEAR = env_bool("WARMUP_HEAR", True)
+WARMUP_RETRY_S = env_float("WARMUP_RETRY_S", 5.0)
+KEEPALIVE_PING_S = env_float("KEEPALIVE_PING_S", 120.0)
+OLLAMA_KEEP_ALIVE = env_str("OLLAMA_KEEP_ALIVE", "30m")
+
+
+def _silent_clip(seconds: float = 1.0, rate: int = 16000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b"\x00\x00" * int(seconds * rate))
+    return buffer.getvalue()
+
+
+class Warmup:
+    """Warms every upstream once, then keeps the Ollama model loaded; tracks readiness."""
+
+    def __init__(
+        self,
+        backends: BackendPool,
+        cloud_client: httpx.AsyncClient,
+        ollama_client: ollama.AsyncClient,
+        ollama_model: str,
+        enabled: bool = WARMUP_ENABLED,
+    ):
+        self.backends = backends
+        self.cloud_client = cloud_client
+        self.ollama_client = ollama_client
+        self.ollama_model = ollama_model
+        self.enabled = enabled
+        # component -> {"ready", "seconds", "error", "at"}
+        self.components: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _agents(self) -> Set[str]:
+        return {agent for backend in self.backends.backends for agent in backend.agents}
+
+    @property
+    def warm(self) -> bool:
+        """The Ollama model is loaded and every agent endpoint has a warmed backend."""
+        if not self.components.get("ollama", {}).get("ready"):
+            return False
+        return all(
+            any(self.components.get(backend.url, {}).get("ready") for backend in self.backends.backends if agent in backend.agents)
+            for agent in self._agents()
+        )
+
+    def serving(self) -> Dict[str, bool]:
+        """Per agent: is some backend not ejected, with that endpoint's breaker not open?"""
+        return {
+            agent: any(
+                backend.healthy and backend.breakers[agent].state != "open"
+                for backend in self.backends.backends
+                if agent in backend.agents
+            )
+            for agent in sorted(self._agents())
+        }
+
+    @property
+    def ready(self) -> bool:
+        if self.enabled and not self.warm:
+            return False
+        return all(self.serving().values())
+
+    def start(self) -> None:
+        if self.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        started = time.perf_counter()
+        while True:
+            steps = []
+            if not self.components.get("ollama", {}).get("ready"):
+                steps.append(self._step("ollama", self.preload_ollama()))
+            for backend in self.backends.backends:
+                if not self.components.get(backend.url, {}).get("ready"):
+                    steps.append(self._step(backend.url, self.warm_backend(backend)))
+            await asyncio.gather(*steps)
+            if self.ready:
+                break
+            await asyncio.sleep(WARMUP_RETRY_S)
+        print(f"  [🔥 WARMUP] Upstreams warm after {time.perf_counter() - started:.1f}s: ready for traffic")
+
+        # 💤 Keep-alive: refresh the Ollama model's lease before it expires
+        while True:
+            await asyncio.sleep(KEEPALIVE_PING_S)
+            await self._step("ollama", self.preload_ollama())
+
+    async def _step(self, component: str, call) -> None:
+        started = time.perf_counter()
+        try:
+            await call
+        except Exception as e:
+            WARMUP_RUNS.inc(component=component, result="failed")
+            if self.components.get(component, {}).get("error") is None:
+                print(f"  [⚠️ WARMUP] {component} not warm yet ({e!r}): retrying every {WARMUP_RETRY_S:g}s")
+            self.components[component] = {"ready": False, "seconds": None, "error": repr(e), "at": time.time()}
+            return
+        elapsed = time.perf_counter() - started
+        WARMUP_RUNS.inc(component=component, result="ok")
+        WARMUP_SECONDS.observe(elapsed, component="ollama" if component == "ollama" else "backend")
+        self.components[component] = {"ready": True, "seconds": round(elapsed, 3), "error": None, "at": time.time()}
+
+    async def preload_ollama(self) -> None:
+        """An empty chat loads the model (or renews its keep-alive) without generating anything."""
+        await self.ollama_client.chat(model=self.ollama_model, messages=[], keep_alive=OLLAMA_KEEP_ALIVE)
+
+    async def warm_backend(self, backend: Backend) -> None:
+        """Opens pooled connections through the tunnel, then wakes HeAR with a silent clip."""
+        url = f"{backend.url}{BACKEND_HEALTH_PATH}"
+        # Over HTTP/1.1 each concurrent request opens its own pooled connection; over HTTP/2
+        # they share one, and this just completes the handshake and a few round trips
+        responses = await asyncio.gather(*(self.cloud_client.get(url, timeout=10.0) for _ in range(max(1, WARMUP_CONNECTIONS))))
+        if any(response.status_code >= 500 for response in responses):
+            raise RuntimeError(f"{url} answered {responses[0].status_code}")
+
+        if WARMUP_HEAR and "audio" in backend.agents:
+            async with backend.slot("audio"):
+                response = await self.cloud_client.post(
+                    f"{backend.url}/agent/audio",
+                    files={"file": ("warmup.wav", _silent_clip(), "audio/wav")},
+                    timeout=60.0,
+                )
+            response.raise_for_status()
+
+    def info(self) -> Dict[str, Any]:
+        return {"ready": self.ready, "enabled": self.enabled, "agents": self.serving(), "components": self.components}
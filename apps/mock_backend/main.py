@@ -0,0 +1,273 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, File, Form, HTTPException, Request, Response, UploadFile
+from fastapi.responses import StreamingResponse
+
+# -----------------------------
+# MOCK GPU BACKEND
+# -----------------------------
+# Local stand-in for the Colab MedGemma / HeAR backend and the local Ollama daemon, for
+# running and benchmarking the bridge offline. It implements the artifact transfer
+# protocol (see apps/api/artifacts.py), the three agent endpoints and Ollama's
+# /api/chat with canned output shaped like the real ones. Latency, token rate, error
+# rate and payload size are configurable (MOCK_* env vars, or PUT /config at runtime).
+#
+#   uvicorn apps.mock_backend.main:app --port 8001
+#   API_URL=http://localhost:8001 OLLAMA_HOST=http://localhost:8001 python -m uvicorn apps.api.main:app
+
+ARTIFACT_DIR = os.getenv("MOCK_ARTIFACT_DIR", "artifacts/mock_backend")
+
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+
+@dataclass
+class MockConfig:
+    tokens_per_s: float = 50.0       # Streamed token rate of vision / consensus
+    ttft_ms: float = 200.0           # Delay before the first streamed event
+    vision_tokens: int = 40          # Streamed thought events per vision call
+    consensus_tokens: int = 20       # Streamed thought events per consensus call
+    token_bytes: int = 8             # Approximate size of each thought delta
+    audio_latency_ms: float = 50.0   # HeAR latency per request
+    ollama_latency_ms: float = 300.0 # Ollama chat latency
+    prefill_tokens_per_s: float = 0.0 # Consensus prompt processing rate (~4 chars / token; 0 = free)
+    ollama_load_ms: float = 0.0      # Ollama model load time (empty preload chat)
+    error_rate: float = 0.0          # Share of agent calls answered with 503
+
+    @classmethod
+    def from_env(cls) -> "MockConfig":
+        config = cls()
+        for name, default in asdict(config).items():
+            raw = os.getenv(f"MOCK_{name.upper()}")
+            if raw not in (None, ""):
+                setattr(config, name, type(default)(raw))
+        return config
+
+
+config = MockConfig.from_env()
+
+app = FastAPI(title="Mock GPU Backend")
+
+# Bytes received per transfer mode, so a test can check nothing was sent twice
+stats: Dict[str, int] = {"artifact_puts": 0, "artifact_bytes": 0, "multipart_uploads": 0, "multipart_bytes": 0, "agent_calls": 0, "injected_errors": 0, "model_loads": 0}
+
+
+def _artifact_path(sha256: str) -> str:
+    if not _SHA256.match(sha256):
+        raise HTTPException(status_code=400, detail="Content ID must be a lowercase SHA-256 hex digest")
+    return os.path.join(ARTIFACT_DIR, sha256[:2], sha256)
+
+
+def sse(data: dict) -> str:
+    return f"data: {json.dumps(data)}\n\n"
+
+
+def maybe_fail(agent: str) -> None:
+    """Counts the call and injects a 503 for the configured share of calls."""
+    stats["agent_calls"] += 1
+    if config.error_rate and random.random() < config.error_rate:
+        stats["injected_errors"] += 1
+        raise HTTPException(status_code=503, detail=f"Injected {agent} failure")
+
+
+def _delta(i: int) -> str:
+    word = f"tok{i} "
+    return (word * (config.token_bytes // len(word) + 1))[:max(config.token_bytes, 1)]
+
+
+async def token_stream(count: int):
+    """Yields thought events after the configured time to first token, at the configured rate."""
+    await asyncio.sleep(config.ttft_ms / 1000.0)
+    interval = 1.0 / config.tokens_per_s if config.tokens_per_s > 0 else 0.0
+    next_at = time.perf_counter()
+    for i in range(count):
+        next_at += interval
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield sse({"type": "thought", "delta": _delta(i)})
+
+
+# -----------------------------
+# ARTIFACT STORE
+# -----------------------------
+@app.head("/artifacts/{sha256}")
+async def has_artifact(sha256: str):
+    return Response(status_code=200 if os.path.exists(_artifact_path(sha256)) else 404)
+
+
+@app.put("/artifacts/{sha256}")
+async def put_artifact(sha256: str, request: Request):
+    path = _artifact_path(sha256)
+    if os.path.exists(path):
+        return Response(status_code=200)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.part"
+    digest = hashlib.sha256()
+    size = 0
+    with open(tmp_path, "wb") as f:
+        async for chunk in request.stream():
+            digest.update(chunk)
+            size += len(chunk)
+            f.write(chunk)
+
+    if digest.hexdigest() != sha256:
+        os.remove(tmp_path)
+        raise HTTPException(status_code=400, detail="Body does not match its content ID")
+
+    os.replace(tmp_path, path)
+    stats["artifact_puts"] += 1
+    stats["artifact_bytes"] += size
+    return Response(status_code=201)
+
+
+async def load_artifact(upload: Optional[UploadFile], sha256: Optional[str]) -> bytes:
+    """Artifact bytes from a content ID (409 if unknown) or a multipart file."""
+    if sha256:
+        path = _artifact_path(sha256)
+        if not os.path.exists(path):
+            raise HTTPException(status_code=409, detail=f"Unknown artifact {sha256}")
+        with open(path, "rb") as f:
+            return f.read()
+    if upload is None:
+        raise HTTPException(status_code=422, detail="Send the artifact as a file or by content ID")
+
+    data = await upload.read()
+    stats["multipart_uploads"] += 1
+    stats["multipart_bytes"] += len(data)
+    return data
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+@app.get("/config")
+async def get_config():
+    return asdict(config)
+
+
+@app.put("/config")
+async def update_config(changes: Dict[str, Any]):
+    """Adjusts the mock behaviour between benchmark runs without restarting it."""
+    for name, value in changes.items():
+        if not hasattr(config, name):
+            raise HTTPException(status_code=400, detail=f"Unknown setting: {name}")
+        setattr(config, name, type(getattr(config, name))(value))
+    return asdict(config)
+
+
+# -----------------------------
+# AGENTS
+# -----------------------------
+@app.post("/agent/vision")
+async def vision(
+    context_hint: str = Form(""),
+    image: Optional[UploadFile] = File(None),
+    image_sha256: Optional[str] = Form(None),
+):
+    data = await load_artifact(image, image_sha256)
+    maybe_fail("vision")
+    tag = hashlib.sha256(data).hexdigest()[:8]
+    plan = f"Assess lung fields, cardiac silhouette and costophrenic angles (image {tag})."
+    summary = f"Mock imaging summary for image {tag}: no focal consolidation."
+
+    async def stream():
+        yield sse({"type": "status", "phase": "plan", "summary": summary, "message": plan})
+        async for event in token_stream(config.vision_tokens):
+            yield event
+        yield sse({
+            "type": "final",
+            "finding": summary,
+            "data_for_consensus": summary,
+            "agent_metadata": {"plan": plan, "recall_data": "No missed findings on recall."},
+        })
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.post("/agent/audio")
+async def audio(
+    file: Optional[UploadFile] = File(None),
+    file_sha256: Optional[str] = Form(None),
+):
+    data = await load_artifact(file, file_sha256)
+    maybe_fail("audio")
+    await asyncio.sleep(config.audio_latency_ms / 1000.0)
+    digest = hashlib.sha256(data).digest()
+    return {"prediction": ("normal", "crackles", "wheeze")[digest[0] % 3], "confidence": 0.5 + digest[1] / 510}
+
+
+@app.post("/agent/consensus")
+async def consensus(
+    imaging_text: str = Form(""),
+    audio_text: str = Form(""),
+    history_text: str = Form(""),
+    image: Optional[UploadFile] = File(None),
+    image_sha256: Optional[str] = Form(None),
+):
+    await load_artifact(image, image_sha256)
+    maybe_fail("consensus")
+    reasoning = f"Imaging ({imaging_text[:40]}) weighed against acoustics ({audio_text}) and history."
+    prompt_tokens = (len(imaging_text) + len(audio_text) + len(history_text)) / 4
+    prefill_s = prompt_tokens / config.prefill_tokens_per_s if config.prefill_tokens_per_s else 0.0
+    verdict = {"score": 0.35, "reasoning": reasoning, "recommendation": "Routine follow-up."}
+
+    async def stream():
+        # Longer prompts delay the first token, like a real prefill
+        await asyncio.sleep(prefill_s)
+        async for event in token_stream(config.consensus_tokens):
+            yield event
+        yield sse({
+            "type": "final",
+            "parsed": verdict,
+            "audit_markdown": f"### Mock audit\n\n{reasoning}",
+            "thought_process": history_text,
+        })
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+# -----------------------------
+# OLLAMA
+# -----------------------------
+@app.post("/api/chat")
+async def ollama_chat(request: Request):
+    """Non-streaming Ollama chat: history findings as the JSON object the context agent expects."""
+    body = await request.json()
+    if not body.get("messages"):
+        # An empty chat only loads the model (Ollama's preload / keep-alive request)
+        stats["model_loads"] += 1
+        await asyncio.sleep(config.ollama_load_ms / 1000.0)
+        return {"model": body.get("model", "mock"), "message": {"role": "assistant", "content": ""}, "done": True, "done_reason": "load"}
+    maybe_fail("ollama")
+    await asyncio.sleep(config.ollama_latency_ms / 1000.0)
+    note = body["messages"][-1].get("content", "")
+    findings = {
+        "ACTIVE": [f"fever and productive cough ({len(note)} chars of notes)"],
+        "BASELINE": ["no known chronic lung disease"],
+        "RISK": ["former smoker, 20 pack-years"],
+    }
+    if isinstance(body.get("format"), dict):
+        # Structured output request: answer in the schema's {"findings": [...]} shape
+        findings = {"findings": [
+            {"category": category, "finding": finding, "confidence": confidence}
+            for (category, values), confidence in zip(findings.items(), (0.9, 0.6, 0.7))
+            for finding in values
+        ]}
+    return {
+        "model": body.get("model", "mock"),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "message": {"role": "assistant", "content": json.dumps(findings)},
+        "done": True,
+        "done_reason": "stop",
+    }
@@ -0,0 +1,159 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from consensus_board.schemas.contracts import Claim, HistoryExtraction
+from apps.api.budget import PROMPT_BUDGET_HISTORY_TOKENS, claim_rank, estimate_tokens, fit_claims
+from apps.api.notes import merge_findings, rule_findings, split_sections
+
+# Consensus prompt size and structured extraction benchmark.
+#
+# Budget (offline): synthetic discharge summaries of growing length produce history
+# claims the way the context agent does (per-section findings + rule findings). The
+# benchmark then compares the unbounded history_text (every claim joined) with the
+# budgeted one: estimated tokens, estimated consensus prefill time, the cost of
+# budgeting, and whether the ranking invariant held ([ACTIVE] findings before
+# [BASELINE] ones).
+#
+# Extraction (live, --ollama URL): the same note sections go to a real Ollama with
+# format='json' and with the HistoryExtraction schema. The report compares latency,
+# output size (characters and eval_count tokens) and how often the output matched
+# the schema.
+#
+#   python benchmarks/bench_prompt_budget.py [--sizes 2,8,32,128] [--budget 400] [--prefill-tokens-per-s 1500]
+#   python benchmarks/bench_prompt_budget.py --ollama http://localhost:11434 --model koesn/llama3-openbiollm-8b --repeats 3
+
+SECTION_TEMPLATES = [
+    ("HPI", "Patient reports {d} days of productive cough and subjective fevers. Shortness of breath on exertion has worsened since {day}. "
+            "Denies chest pain, hemoptysis or leg swelling."),
+    ("Past Medical History", "Hypertension, type 2 diabetes on metformin, hyperlipidemia. Remote appendectomy. No known chronic lung disease."),
+    ("Social History", "Former smoker, {py} pack-years, quit {q} years ago. Occasional alcohol. Lives with spouse."),
+    ("Vitals", "T {t}F, HR {hr}, RR {rr}, BP {sbp}/{dbp}, SpO2 {spo2}% on room air."),
+    ("Review of Systems", "Negative for rash, dysuria, headache, abdominal pain or diarrhea."),
+    ("Hospital Course", "Started on ceftriaxone and azithromycin on day {day}. Oxygen weaned to room air. Repeat chest film showed "
+                        "{change} of the right lower lobe opacity. Blood cultures with no growth at 48 hours."),
+]
+CATEGORIES = ("ACTIVE", "BASELINE", "RISK")
+
+
+def synthetic_note(blocks: int, rng: random.Random) -> str:
+    parts = []
+    for i in range(blocks):
+        header, template = SECTION_TEMPLATES[i % len(SECTION_TEMPLATES)]
+        parts.append(f"{header}: " + template.format(
+            d=rng.randint(2, 9), day=rng.choice(("Monday", "day 2", "admission")), py=rng.randint(5, 40), q=rng.randint(1, 20),
+            t=round(rng.uniform(97.5, 103.0), 1), hr=rng.randint(60, 125), rr=rng.randint(12, 28), sbp=rng.randint(85, 160),
+            dbp=rng.randint(50, 95), spo2=rng.randint(86, 99), change=rng.choice(("improvement", "no change", "progression")),
+        ))
+    return "\n\n".join(parts)
+
+
+def model_findings(section: str, rng: random.Random):
+    """Stand-in for one extraction: a finding per sentence with a category and a confidence."""
+    findings = []
+    for sentence in section.replace("\n", " ").split(". "):
+        sentence = sentence.split(":", 1)[-1].strip(" .")
+        if len(sentence) > 12:
+            findings.append((f"[{rng.choice(CATEGORIES)}] {sentence[:120]}", round(rng.uniform(0.4, 1.0), 2)))
+    return findings
+
+
+def history_claims(note: str, rng: random.Random):
+    sections = split_sections(note)
+    rules = [rule_findings(section) for section in sections]
+    groups = [model_findings(section, rng) for section, rule in zip(sections, rules) if not rule.covered]
+    merged = merge_findings([*groups, [f for rule in rules for f in rule.findings]])
+    return [Claim(label="finding", value=f, confidence=confidence) for f, confidence in merged]
+
+
+def ranking_holds(text: str) -> bool:
+    """Kept claims appear in non-decreasing category rank (the omission note is not a claim)."""
+    ranks = [claim_rank(Claim(label="finding", value=value, confidence=1.0)) for value in text.split("; ")[0].split(", [")]
+    return all(a <= b for a, b in zip(ranks, ranks[1:]))
+
+
+def bench_budget(args) -> bool:
+    rng = random.Random(7)
+    print(f"✂️  History budget: {args.budget} tokens, prefill estimate at {args.prefill_tokens_per_s:g} tokens/s\n")
+    print(f"  {'blocks':>6} {'note chars':>10} {'claims':>6} {'unbounded':>10} {'budgeted':>9} {'dropped':>7} {'prefill saved':>13} {'fit µs':>8}")
+    ok = True
+    for blocks in args.sizes:
+        note = synthetic_note(blocks, rng)
+        claims = history_claims(note, rng)
+        unbounded = ", ".join(claim.value for claim in claims)
+
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            budgeted = fit_claims(claims, args.budget)
+        fit_us = (time.perf_counter() - started) / args.iterations * 1e6
+
+        saved_s = (estimate_tokens(unbounded) - budgeted.tokens) / args.prefill_tokens_per_s
+        print(
+            f"  {blocks:>6} {len(note):>10} {len(claims):>6} {estimate_tokens(unbounded):>10} {budgeted.tokens:>9}"
+            f" {budgeted.dropped:>7} {saved_s:>12.2f}s {fit_us:>8.1f}"
+        )
+        if budgeted.tokens > args.budget or not ranking_holds(budgeted.text):
+            print(f"     ❌ budget or ranking violated for {blocks} blocks")
+            ok = False
+    return ok
+
+
+async def bench_extraction(args) -> None:
+    import ollama
+    from apps.api.main import HISTORY_FORMAT, HISTORY_SYSTEM_PROMPT
+
+    client = ollama.AsyncClient(host=args.ollama)
+    sections = split_sections(synthetic_note(len(SECTION_TEMPLATES), random.Random(11)), max_chars=400)
+    print(f"\n🧪 Extraction: {len(sections)} note sections x {args.repeats} repeats on {args.model}\n")
+    for label, fmt in (("json", "json"), ("schema", HISTORY_FORMAT)):
+        latencies, chars, tokens, valid = [], [], [], 0
+        for _ in range(args.repeats):
+            for section in sections:
+                started = time.perf_counter()
+                response = await client.chat(
+                    model=args.model,
+                    messages=[{"role": "system", "content": HISTORY_SYSTEM_PROMPT}, {"role": "user", "content": f"Extract: {section}"}],
+                    format=fmt,
+                    options={"temperature": 0},
+                )
+                latencies.append(time.perf_counter() - started)
+                content = response["message"]["content"]
+                chars.append(len(content))
+                tokens.append(response.get("eval_count") or 0)
+                try:
+                    HistoryExtraction.model_validate_json(content)
+                    valid += 1
+                except ValueError:
+                    pass
+        print(
+            f"  {label:<7} p50 {statistics.median(latencies):6.2f}s   max {max(latencies):6.2f}s"
+            f"   output {statistics.mean(chars):7.0f} chars / {statistics.mean(tokens):5.0f} tokens"
+            f"   schema-valid {valid}/{len(latencies)}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark consensus prompt budgeting and structured history extraction")
+    parser.add_argument("--sizes", default="2,8,32,128", help="Note sizes to test, in section blocks")
+    parser.add_argument("--budget", type=int, default=PROMPT_BUDGET_HISTORY_TOKENS)
+    parser.add_argument("--prefill-tokens-per-s", type=float, default=1500.0, help="Consensus prompt processing rate for the saved-time estimate")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--ollama", help="Ollama URL: also compare format='json' with the schema on a live model")
+    parser.add_argument("--model", default="koesn/llama3-openbiollm-8b")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+
+    ok = bench_budget(args)
+    if args.ollama:
+        asyncio.run(bench_extraction(args))
+    if not ok:
+        sys.exit(1)
+    print("\n✅ Every budgeted history text fit its budget with [ACTIVE] findings ranked first.")
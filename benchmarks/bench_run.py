@@ -0,0 +1,365 @@
+import io
+import os
+import sys
+import json
+import math
+import time
+import wave
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# End-to-end load benchmark for the local bridge.
+# By default it starts the mock GPU/Ollama backend (apps/mock_backend/main.py) and a
+# bridge pointed at it, each in its own process and scratch directory, uploads
+# synthetic cases, then drives POST /run at the requested concurrency. Reports
+# latency and time-to-first-event percentiles, throughput, errors and bridge CPU /
+# memory. --out saves the report; --baseline compares against a saved one and exits
+# non-zero on a regression, so performance changes to apps/api can be checked.
+#
+#   python benchmarks/bench_run.py --requests 40 --concurrency 8 --tokens-per-s 100 --out run.json
+#   python benchmarks/bench_run.py --baseline run.json --max-regression 15
+#   python benchmarks/bench_run.py --backends 4 --concurrency 16   # API_URLS pool of 4 mock backends
+#   python benchmarks/bench_run.py --bridge http://localhost:8000 --bridge-pid 1234   # existing bridge
+
+MOCK_OPTIONS = {
+    "tokens_per_s": float,
+    "ttft_ms": float,
+    "vision_tokens": int,
+    "consensus_tokens": int,
+    "token_bytes": int,
+    "audio_latency_ms": float,
+    "ollama_latency_ms": float,
+    "prefill_tokens_per_s": float,
+    "error_rate": float,
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn(module: str, port: int, cwd: str, env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", module, "--port", str(port), "--log-level", "warning"],
+        cwd=cwd,
+        env={**os.environ, "PYTHONPATH": REPO_ROOT, **env},
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def wait_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+# -----------------------------
+# SYNTHETIC CASES
+# -----------------------------
+
+def synthetic_xray(size: int) -> bytes:
+    """A grayscale gradient JPEG (Pillow), or arbitrary bytes when Pillow is missing."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return os.urandom(size * size // 8)
+    img = Image.linear_gradient("L").resize((size, size))
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=95)
+    return buf.getvalue()
+
+
+def synthetic_wav(seconds: float, rate: int = 16000) -> bytes:
+    """A 16-bit mono tone with a short pause, so silence skipping is exercised."""
+    frames = bytearray()
+    for i in range(int(seconds * rate)):
+        t = i / rate
+        amplitude = 0.0 if 2.0 <= t % 6.0 < 3.0 else 0.3
+        frames += int(amplitude * 32767 * math.sin(2 * math.pi * 220 * t)).to_bytes(2, "little", signed=True)
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(bytes(frames))
+    return buf.getvalue()
+
+
+# -----------------------------
+# PROCESS SAMPLING
+# -----------------------------
+
+class ProcessSampler:
+    """Samples CPU % and RSS of one process from /proc (Linux) or psutil when available."""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.25):
+        self.pid = pid
+        self.interval = interval
+        self.cpu: List[float] = []
+        self.rss_mb: List[float] = []
+        self._ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def _read(self):
+        try:
+            import psutil
+            proc = psutil.Process(self.pid)
+            times = proc.cpu_times()
+            return times.user + times.system, proc.memory_info().rss / 1e6
+        except ImportError:
+            pass
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu_s = (int(fields[11]) + int(fields[12])) / self._ticks
+        with open(f"/proc/{self.pid}/status") as f:
+            rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+        return cpu_s, rss_kb / 1e3
+
+    async def run(self):
+        if self.pid is None:
+            return
+        try:
+            last_cpu, _ = self._read()
+            last_at = time.perf_counter()
+            while True:
+                await asyncio.sleep(self.interval)
+                cpu_s, rss = self._read()
+                now = time.perf_counter()
+                self.cpu.append(100.0 * (cpu_s - last_cpu) / (now - last_at))
+                self.rss_mb.append(rss)
+                last_cpu, last_at = cpu_s, now
+        except (OSError, StopIteration, ValueError):
+            return
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        if not self.cpu:
+            return {"cpu_mean_pct": None, "cpu_max_pct": None, "rss_max_mb": None}
+        return {
+            "cpu_mean_pct": round(sum(self.cpu) / len(self.cpu), 1),
+            "cpu_max_pct": round(max(self.cpu), 1),
+            "rss_max_mb": round(max(self.rss_mb), 1),
+        }
+
+
+# -----------------------------
+# LOAD GENERATION
+# -----------------------------
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Linear-interpolated percentile (q in [0, 100])."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100.0
+    lo, hi = math.floor(rank), math.ceil(rank)
+    return round(ordered[lo] + (ordered[hi] - ordered[lo]) * (rank - lo), 4)
+
+
+async def run_one(client: httpx.AsyncClient, bridge: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    first_event = None
+    final = error = None
+    received = 0
+    buffer = b""
+    try:
+        async with client.stream("POST", f"{bridge}/run", json=body) as response:
+            async for chunk in response.aiter_bytes():
+                if first_event is None:
+                    first_event = time.perf_counter() - started
+                received += len(chunk)
+                buffer += chunk
+                *frames, buffer = buffer.split(b"\n\n")
+                for frame in frames:
+                    if frame.startswith(b'data: {"type": "final"'):
+                        final = json.loads(frame[6:])
+                    elif b'"type": "error"' in frame[:120]:
+                        # Pipeline errors and agent errors (tagged '{"agent": ..., "type": "error"')
+                        event = json.loads(frame[6:])
+                        error = f"{event.get('agent', 'pipeline')}: {event.get('message')}"
+    except httpx.HTTPError as e:
+        error = repr(e)
+
+    if final is not None and error is None:
+        for report in final.get("agent_reports", []):
+            if report.get("analysis_status") == "failed" or any(c.get("label") == "error" for c in report.get("claims", [])):
+                error = f"{report.get('agent_name')}: agent failed"
+    return {
+        "ok": final is not None and error is None,
+        "error": error,
+        "latency_s": time.perf_counter() - started,
+        "ttfe_s": first_event,
+        "bytes": received,
+        "timings": (final or {}).get("timings", {}),
+    }
+
+
+async def drive(args, bridge: str, pid: Optional[int]) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency + 4, max_keepalive_connections=args.concurrency + 4)
+    async with httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=None), limits=limits) as client:
+        xray, audio = synthetic_xray(args.xray_px), synthetic_wav(args.audio_s)
+        case_ids = [f"bench-{i}" for i in range(args.cases)]
+        for case_id in case_ids:
+            r = await client.post(f"{bridge}/upload/{case_id}", files={"xray": ("xray.jpg", xray), "audio": ("audio.wav", audio)})
+            r.raise_for_status()
+
+        def body(i: int) -> Dict[str, Any]:
+            # A unique note per request: identical in-flight requests would be coalesced
+            return {
+                "case_id": case_ids[i % len(case_ids)],
+                "clinical_note_text": f"Benchmark request {i}: 3 days of fever and productive cough.",
+                "use_cache": args.use_cache,
+            }
+
+        for i in range(args.warmup):
+            await run_one(client, bridge, body(-1 - i))
+
+        sampler = ProcessSampler(pid)
+        sampler_task = asyncio.create_task(sampler.run())
+        queue: asyncio.Queue = asyncio.Queue()
+        for i in range(args.requests):
+            queue.put_nowait(i)
+        results: List[Dict[str, Any]] = []
+
+        async def worker():
+            while not queue.empty():
+                results.append(await run_one(client, bridge, body(queue.get_nowait())))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        sampler_task.cancel()
+
+    ok = [r for r in results if r["ok"]]
+    latencies = [r["latency_s"] for r in ok]
+    ttfe = [r["ttfe_s"] for r in ok if r["ttfe_s"] is not None]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r["ok"]:
+            errors[str(r["error"])[:80]] = errors.get(str(r["error"])[:80], 0) + 1
+
+    return {
+        "config": {k: getattr(args, k) for k in ("requests", "concurrency", "cases", "use_cache", "xray_px", "audio_s", "backends", *MOCK_OPTIONS) if hasattr(args, k)},
+        "requests": len(results),
+        "succeeded": len(ok),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else None,
+        "latency_s": {f"p{q}": percentile(latencies, q) for q in (50, 95, 99)},
+        "ttfe_s": {f"p{q}": percentile(ttfe, q) for q in (50, 95, 99)},
+        "mean_bytes": round(sum(r["bytes"] for r in results) / len(results)) if results else 0,
+        "bridge": sampler.summary(),
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """Metrics that got worse than the baseline by more than max_regression percent."""
+    checks = [
+        ("latency p50", report["latency_s"]["p50"], baseline["latency_s"]["p50"], False),
+        ("latency p95", report["latency_s"]["p95"], baseline["latency_s"]["p95"], False),
+        ("ttfe p50", report["ttfe_s"]["p50"], baseline["ttfe_s"]["p50"], False),
+        ("throughput", report["throughput_rps"], baseline["throughput_rps"], True),
+    ]
+    regressions = []
+    for name, value, base, higher_is_better in checks:
+        if value is None or not base:
+            continue
+        change = 100.0 * (value - base) / base
+        if (-change if higher_is_better else change) > max_regression:
+            regressions.append(f"{name}: {base} -> {value} ({change:+.1f}%)")
+    return regressions
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    lat, ttfe, bridge = report["latency_s"], report["ttfe_s"], report["bridge"]
+    print(f"\n📊 {report['succeeded']}/{report['requests']} requests ok in {report['elapsed_s']}s "
+          f"({report['throughput_rps']} req/s at concurrency {report['config']['concurrency']})")
+    print(f"  latency   p50 {lat['p50']}s  p95 {lat['p95']}s  p99 {lat['p99']}s")
+    print(f"  1st event p50 {ttfe['p50']}s  p95 {ttfe['p95']}s  p99 {ttfe['p99']}s")
+    print(f"  bridge    cpu mean {bridge['cpu_mean_pct']}%  max {bridge['cpu_max_pct']}%  rss max {bridge['rss_max_mb']} MB")
+    for error, count in report["errors"].items():
+        print(f"  ❌ {count}x {error}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load and latency benchmark for POST /run")
+    parser.add_argument("--bridge", help="Benchmark an already running bridge instead of spawning one with the mock backend")
+    parser.add_argument("--bridge-pid", type=int, help="PID of an existing bridge, for CPU / memory sampling")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--cases", type=int, default=4, help="Distinct case ids (uploaded once each)")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured requests before the run")
+    parser.add_argument("--use-cache", action="store_true", help="Allow cached agent results (default: fresh runs)")
+    parser.add_argument("--xray-px", type=int, default=2048)
+    parser.add_argument("--audio-s", type=float, default=10.0)
+    for name, kind in MOCK_OPTIONS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=kind, help="Mock backend setting (spawned mode)")
+    parser.add_argument("--backends", type=int, default=1, help="Mock GPU backends behind the spawned bridge (API_URLS pool)")
+    parser.add_argument("--bridge-env", action="append", default=[], help="Extra KEY=VALUE for the spawned bridge")
+    parser.add_argument("--out", help="Write the JSON report here")
+    parser.add_argument("--baseline", help="Compare against a saved JSON report")
+    parser.add_argument("--max-regression", type=float, default=10.0, help="Allowed slowdown vs the baseline, in percent")
+    args = parser.parse_args()
+
+    processes: List[subprocess.Popen] = []
+    try:
+        if args.bridge:
+            bridge, pid = args.bridge.rstrip("/"), args.bridge_pid
+        else:
+            workdir = tempfile.mkdtemp(prefix="bench_run_")
+            mock_env = {f"MOCK_{name.upper()}": str(getattr(args, name)) for name in MOCK_OPTIONS if getattr(args, name) is not None}
+            mock_urls = []
+            for i in range(max(1, args.backends)):
+                mock_port = free_port()
+                # Separate artifact stores, like separate Colab instances
+                processes.append(spawn("apps.mock_backend.main:app", mock_port, workdir, {**mock_env, "MOCK_ARTIFACT_DIR": f"artifacts/mock_backend_{i}"}))
+                mock_urls.append(f"http://127.0.0.1:{mock_port}")
+            bridge_port = free_port()
+            bridge_env = {
+                "API_URLS": ",".join(mock_urls),
+                "OLLAMA_HOST": mock_urls[0],
+                **dict(kv.split("=", 1) for kv in args.bridge_env),
+            }
+            processes.append(spawn("apps.api.main:app", bridge_port, workdir, bridge_env))
+            bridge, pid = f"http://127.0.0.1:{bridge_port}", processes[-1].pid
+            for mock_url in mock_urls:
+                wait_ready(f"{mock_url}/config")
+            # /ready answers 503 until the bridge has warmed its upstreams
+            wait_ready(f"{bridge}/ready")
+            print(f"🧪 Mock backends {', '.join(mock_urls)} | bridge {bridge} | scratch dir {workdir}")
+
+        report = asyncio.run(drive(args, bridge, pid))
+        print_report(report)
+
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"\n💾 Report written to {args.out}")
+
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as f:
+                regressions = compare(report, json.load(f), args.max_regression)
+            if regressions:
+                print(f"\n❌ Regressions beyond {args.max_regression}%:")
+                for line in regressions:
+                    print(f"  {line}")
+                sys.exit(1)
+            print(f"\n✅ Within {args.max_regression}% of the baseline.")
+    finally:
+        for proc in processes:
+            proc.terminate()
+            proc.wait(timeout=10)
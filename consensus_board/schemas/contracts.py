@@ -17,6 +17,21 @@ class Claim(BaseModel):
     evidence: list[EvidenceRef] = Field(default_factory=list)
 
 
+FINDING_MAX_CHARS = 160
+MAX_FINDINGS = 24
+
+
+class ExtractedFinding(BaseModel):
+    # One history claim as the local extractor must emit it (Ollama structured output)
+    category: Literal["ACTIVE", "BASELINE", "RISK", "NEGATION"]
+    finding: str = Field(min_length=3, max_length=FINDING_MAX_CHARS)
+    confidence: float = Field(ge=0.0, le=1.0)
+
+
+class HistoryExtraction(BaseModel):
+    findings: list[ExtractedFinding] = Field(max_length=MAX_FINDINGS)
+
+
 class QualityFlag(BaseModel):
     type: str
     severity: Literal["low", "medium", "high"] = "low"
@@ -48,12 +63,19 @@ class VisionReport(BaseModel):
 
 class CaseInput(BaseModel):
     case_id: str
+    # Studies of the same patient are recorded and reused as priors for interval comparison
+    patient_id: Optional[str] = None
     # In Day 1 we pass paths/ids; later you'll pass uploaded bytes and store to disk
     image_current_path: Optional[str] = None
+    # Prior studies (default: xray_prior.jpg / audio_prior.wav uploaded with the case, else the patient's latest)
     image_prior_path: Optional[str] = None
     audio_current_path: Optional[str] = None
     audio_prior_path: Optional[str] = None
     clinical_note_text: str
+    # False skips cached agent results for this request (fresh results still refresh the cache)
+    use_cache: bool = True
+    # Start the consensus on the vision plan/recall summary before the vision final (None -> SPECULATIVE_CONSENSUS in .env)
+    speculative_consensus: Optional[bool] = None
 
 
 class DiscrepancyAlert(BaseModel):
@@ -73,4 +95,8 @@ class ConsensusOutput(BaseModel):
     agent_reports: List[Union[VisionReport, AgentReport]] 
     audit_markdown: Optional[str] = None
     thought_process : Optional[str] = None
+    # Seconds since case start at which each pipeline stage completed
+    timings: dict[str, float] = Field(default_factory=dict)
+    # Speculative consensus outcome: confirmed / rejected / not_started (None when speculation was off)
+    speculation: Optional[str] = None
     
\ No newline at end of file
@@ -0,0 +1,54 @@
+import sys
+import json
+import argparse
+import httpx
+
+# Batch driver for the local bridge: streams a JSONL file of CaseInput records
+# to POST /run/batch and prints each case result as it completes.
+#
+#   python run_batch.py cases.jsonl --bridge http://localhost:8000 --out results.jsonl
+
+parser = argparse.ArgumentParser(description="Run a JSONL file of cases through /run/batch")
+parser.add_argument("cases", help="JSONL file with one CaseInput record per line")
+parser.add_argument("--bridge", default="http://localhost:8000", help="Local bridge base URL")
+parser.add_argument("--out", help="Optional JSONL file to write every result line to")
+args = parser.parse_args()
+
+with open(args.cases, "rb") as f:
+    body = f.read()
+
+out_file = open(args.out, "w", encoding="utf-8") if args.out else None
+print(f"📦 Submitting {args.cases} to {args.bridge}/run/batch")
+
+try:
+    with httpx.stream(
+        "POST",
+        f"{args.bridge}/run/batch",
+        content=body,
+        headers={"Content-Type": "application/x-ndjson"},
+        timeout=httpx.Timeout(30.0, read=None),
+    ) as response:
+        if response.status_code != 200:
+            print(f"❌ Bridge rejected batch ({response.status_code}): {response.read().decode()}")
+            sys.exit(1)
+
+        for line in response.iter_lines():
+            if not line.strip():
+                continue
+            if out_file:
+                out_file.write(line + "\n")
+
+            record = json.loads(line)
+            if record["type"] == "batch_summary":
+                print(
+                    f"\n✅ {record['succeeded']}/{record['cases']} cases succeeded in {record['elapsed_s']}s "
+                    f"({record['cases_per_minute']} cases/min, mean {record['mean_case_s']}s per case)"
+                )
+            elif record.get("status") == "ok":
+                alert = record["result"]["discrepancy_alert"]
+                print(f"  [✓] {record['case_id']}: {alert['level']} ({alert['score']}) in {record['elapsed_s']}s")
+            else:
+                print(f"  [✗] {record.get('case_id', 'line ' + str(record.get('line')))}: {record.get('error')}")
+finally:
+    if out_file:
+        out_file.close()
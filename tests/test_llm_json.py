@@ -0,0 +1,68 @@
+import os
+import json
+
+import pytest
+
+from apps.api.llm_json import DEFAULT_VERDICT, extract_json, extract_tag
+
+CORPUS = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "llm_json", "corpus.jsonl")
+
+with open(CORPUS, encoding="utf-8") as f:
+    CASES = {case["name"]: case for case in map(json.loads, filter(str.strip, f))}
+
+
+def parsed(name):
+    return extract_json(CASES[name]["raw"])
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_corpus_case_recovers_expected_fields(name):
+    result = parsed(name)
+    for key, value in CASES[name]["expected"].items():
+        assert result.get(key) == value
+
+
+def test_apostrophes_in_reasoning_survive():
+    assert "patient's" in parsed("apostrophe_in_reasoning")["reasoning"]
+    assert parsed("single_quoted_with_apostrophe")["reasoning"] == "The patient's cough is chronic."
+
+
+def test_fenced_output():
+    assert parsed("fenced")["score"] == 0.35
+    assert parsed("think_then_json")["score"] == CASES["think_then_json"]["expected"]["score"]
+
+
+def test_trailing_commas():
+    assert parsed("trailing_comma")["recommendation"] == "No action"
+    assert parsed("numbers_trailing_comma")["ids"] == [1, 2]
+
+
+def test_single_quoted_keys():
+    assert parsed("single_quoted")["score"] == 0.9
+    assert parsed("python_literals")["urgent"] is True
+
+
+def test_comma_before_number_is_kept():
+    assert parsed("comma_separated_numbers")["scores"] == [0.1, 0.2]
+    assert extract_json("{'a': [1, 2,3], 'score': 0.4}") == {"a": [1, 2, 3], "score": 0.4}
+
+
+def test_truncated_objects_are_closed():
+    assert parsed("truncated_number_list") == {"score": 0.52, "ids": [1, 2]}
+    assert parsed("truncated_after_key")["recommendation"] is None
+    assert parsed("truncated_mid_string")["reasoning"].startswith("Crackles in the right base")
+
+
+def test_fallback_verdicts():
+    assert extract_json("") == DEFAULT_VERDICT
+    assert parsed("no_json")["reasoning"] == "JSON boundaries not found"
+    assert parsed("score_as_string_regex_fallback")["recommendation"] == "Urgent CT"
+
+
+def test_extract_tag_fallbacks():
+    text = "<think>\n  weighing crackles  \n</think><answer>0.8</answer>"
+    assert extract_tag(text, "think") == "weighing crackles"
+    assert extract_tag(text, "answer") == "0.8"
+    assert extract_tag(text, "verdict") == ""
+    assert extract_tag("<think>never closed", "think") == ""
+    assert extract_tag("<a.b>x</a.b>", "a.b") == "x"
@@ -0,0 +1,41 @@
+import time
+import asyncio
+
+from apps.api.sse import SSEEvent, coalesce_frames, frame_payload, has_agent, sniff_type
+
+
+def test_sniff_type_reads_top_level_key_only():
+    assert sniff_type(b'{"type": "thought", "delta": "x"}') == "thought"
+    assert sniff_type(b'{"parsed": {"type": "final"}, "type": "error"}') == "error"
+    assert sniff_type(b'{"parsed": {"type": "final"}}') == ""
+    assert sniff_type(b'[{"type": "final"}]') == ""
+    assert sniff_type(b'{"delta": "say \\"type\\": \\"final\\""}') == ""
+
+
+def test_frame_keeps_an_existing_agent_key():
+    assert SSEEvent(b'{"type": "thought"}').frame("vision") == b'data: {"agent": "vision", "type": "thought"}\n\n'
+    assert SSEEvent(b'{"type": "final", "agent": "audio"}').frame("vision") == b'data: {"type": "final", "agent": "audio"}\n\n'
+    assert not has_agent(b'{"meta": {"agent": 1}, "type": "x"}')
+
+
+def test_frame_payload_sniffs_like_the_event():
+    frame = SSEEvent(b'{"type": "final", "parsed": {}}').frame("consensus")
+    assert sniff_type(frame_payload(frame)) == "final"
+
+
+def test_control_frame_flushes_an_open_batch_at_once():
+    window_s = 0.5
+
+    async def frames():
+        yield SSEEvent(b'{"type": "thought", "delta": "a"}').frame("vision")
+        yield SSEEvent(b'{"type": "final", "parsed": {}}').frame()
+        await asyncio.sleep(window_s * 4)
+
+    async def first_batch():
+        started = time.monotonic()
+        async for batch in coalesce_frames(frames(), window_s=window_s):
+            return batch, time.monotonic() - started
+
+    batch, elapsed = asyncio.run(first_batch())
+    assert batch.count(b"data: ") == 2
+    assert elapsed < window_s / 2